@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Measures escape.xhtml_escape against xml.sax.saxutils.escape and a
+single-pass re.sub.
+
+Each input is escaped --num_calls times with each function, and the
+calls per second are reported:
+
+    python demos/benchmark/escape_benchmark.py --num_calls=100000
+"""
+
+import re
+import time
+import xml.sax.saxutils
+
+from tornado import escape
+from tornado.options import define, options, parse_command_line
+
+define("num_calls", type=int, default=100000, help="calls per input")
+
+INPUTS = [
+    ("short ascii", "Hello, world"),
+    ("long ascii", "The quick brown fox jumps over the lazy dog. " * 20),
+    ("short unicode", u"\xe9l\xe8ve na\xefve"),
+    ("long unicode", u"\xe9l\xe8ve na\xefve caf\xe9 " * 50),
+    ("some markup", 'Say "hi" to <b>Tom & Jerry</b> ' * 20),
+    ("worst case", '<>&"' * 250),
+]
+
+
+def saxutils_escape(value):
+    return xml.sax.saxutils.escape(value, {'"': "&quot;"})
+
+
+_XHTML_ESCAPE_RE = re.compile('[&<>"]')
+_XHTML_ESCAPE_DICT = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}
+
+def regex_escape(value):
+    return _XHTML_ESCAPE_RE.sub(lambda m: _XHTML_ESCAPE_DICT[m.group(0)],
+                                value)
+
+
+def measure(function, value):
+    start = time.time()
+    for i in xrange(options.num_calls):
+        function(value)
+    return options.num_calls / (time.time() - start)
+
+
+def main():
+    parse_command_line()
+    print "%-14s %14s %14s %14s" % ("input", "xhtml_escape", "saxutils",
+                                     "re.sub")
+    for name, value in INPUTS:
+        assert escape.xhtml_escape(value) == saxutils_escape(value)
+        assert escape.xhtml_escape(value) == regex_escape(value)
+        print "%-14s %12.0f/s %12.0f/s %12.0f/s" % (
+            name, measure(escape.xhtml_escape, value),
+            measure(saxutils_escape, value), measure(regex_escape, value))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Measures RequestHandler.render_string throughput.
+
+A small page that extends a base template and loops over --num_items
+rows is rendered --num_renders times through a handler, without any
+network I/O, and the renders per second are reported.  For comparison
+the same renders are first timed with a baseline Template.generate that
+execs the whole compiled template module on every call, as it did before
+the _execute function was compiled once per template.
+
+    python demos/benchmark/template_benchmark.py --num_items=10
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from tornado import template
+from tornado import web
+from tornado import wsgi
+from tornado.options import define, options, parse_command_line
+
+define("num_renders", type=int, default=20000, help="number of renders")
+define("num_items", type=int, default=10,
+       help="rows rendered by the loop in the page template")
+
+TEMPLATES = {
+    "base.html": """\
+<html>
+  <head><title>{% block title %}Default title{% end %}</title></head>
+  <body>
+    {% block body %}{% end %}
+  </body>
+</html>
+""",
+    "page.html": """\
+{% extends "base.html" %}
+{% block title %}{{ title }}{% end %}
+{% block body %}
+  <ul>
+    {% for item in items %}
+      <li class="{{ "odd" if item["id"] % 2 else "even" }}">
+        <a href="/items/{{ item["id"] }}">{{ escape(item["name"]) }}</a>
+      </li>
+    {% end %}
+  </ul>
+{% end %}
+""",
+}
+
+
+def exec_generate(self, **kwargs):
+    """Template.generate as it was before _execute was kept per template."""
+    namespace = template._DEFAULT_NAMESPACE.copy()
+    namespace["_fragment_cache"] = self.fragment_cache
+    namespace.update(kwargs)
+    exec self.compiled in namespace
+    return namespace["_execute"]()
+
+
+def time_renders(handler, items):
+    # Load and compile the templates before timing
+    handler.render_string("page.html", title="Items", items=items)
+    start = time.time()
+    for i in xrange(options.num_renders):
+        handler.render_string("page.html", title="Items", items=items)
+    return time.time() - start
+
+
+def main():
+    parse_command_line()
+    template_path = tempfile.mkdtemp()
+    try:
+        for name, content in TEMPLATES.iteritems():
+            f = open(os.path.join(template_path, name), "w")
+            f.write(content)
+            f.close()
+        app = web.Application(template_path=template_path)
+        # A WSGI request needs no connection
+        request = wsgi.HTTPRequest({
+                "REQUEST_METHOD": "GET", "SCRIPT_NAME": "", "PATH_INFO": "/",
+                "QUERY_STRING": "", "SERVER_NAME": "localhost",
+                "REMOTE_ADDR": "127.0.0.1", "wsgi.url_scheme": "http"})
+        handler = web.RequestHandler(app, request)
+        items = [dict(id=i, name="Item <%d>" % i)
+                 for i in xrange(options.num_items)]
+        generate = template.Template.generate
+        template.Template.generate = exec_generate
+        try:
+            baseline = time_renders(handler, items)
+        finally:
+            template.Template.generate = generate
+        current = time_renders(handler, items)
+    finally:
+        shutil.rmtree(template_path)
+    print "%d renders of %d items" % (options.num_renders, options.num_items)
+    for label, elapsed in [("baseline (exec per render)", baseline),
+                           ("current", current)]:
+        print "%-28s %6.2fs %8.0f renders/sec" % (
+            label + ":", elapsed, options.num_renders / elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Measures TLS throughput between SimpleAsyncHTTPClient and HTTPServer.
+
+The server runs in a forked child process and uses the self-signed
+certificate from tornado/test.  Each request downloads (or, with
+--upload, posts) --size bytes over a fresh TLS connection, and the
+client reports requests and megabytes per second.
+
+    python demos/benchmark/tls_benchmark.py --size=4194304 --num_requests=50
+"""
+
+import os
+import signal
+import sys
+import time
+
+from tornado import httpserver
+from tornado import ioloop
+from tornado import web
+from tornado.options import define, options, parse_command_line
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+from tornado.testing import get_unused_port
+
+define("size", type=int, default=1024 * 1024,
+       help="bytes transferred per request")
+define("num_requests", type=int, default=100, help="number of requests")
+define("write_size", type=int, default=4096,
+       help="size of each write() call made by the server")
+define("upload", type=bool, default=False,
+       help="send the data to the server instead of downloading it")
+
+TEST_DIR = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                        "tornado", "test")
+
+
+class DataHandler(web.RequestHandler):
+    def get(self):
+        chunk = "x" * options.write_size
+        remaining = options.size
+        while remaining > 0:
+            self.write(chunk[:remaining])
+            remaining -= options.write_size
+        self.finish()
+
+    def post(self):
+        self.finish(str(len(self.request.body)))
+
+
+def run_server(port):
+    app = web.Application([("/", DataHandler)])
+    server = httpserver.HTTPServer(app, ssl_options=dict(
+            certfile=os.path.join(TEST_DIR, "test.crt"),
+            keyfile=os.path.join(TEST_DIR, "test.key")))
+    server.listen(port, "127.0.0.1")
+    ioloop.IOLoop.instance().start()
+
+
+def run_client(port):
+    io_loop = ioloop.IOLoop.instance()
+    client = SimpleAsyncHTTPClient(io_loop)
+    url = "https://127.0.0.1:%d/" % port
+    if options.upload:
+        kwargs = dict(method="POST", body="x" * options.size)
+    else:
+        kwargs = dict()
+    state = dict(remaining=options.num_requests, bytes=0)
+
+    def fetch():
+        client.fetch(url, on_response, request_timeout=600, **kwargs)
+
+    def on_response(response):
+        if response.error:
+            raise response.error
+        state["bytes"] += options.size
+        state["remaining"] -= 1
+        if state["remaining"]:
+            fetch()
+        else:
+            io_loop.stop()
+
+    # One warm-up request, which also checks that the server is up.
+    warmup = []
+    client.fetch(url, lambda response: (warmup.append(response),
+                                        io_loop.stop()))
+    io_loop.start()
+    if warmup[0].error:
+        sys.exit("warm-up request failed: %s" % warmup[0].error)
+
+    start = time.time()
+    fetch()
+    io_loop.start()
+    elapsed = time.time() - start
+    print "%d requests of %d bytes in %.2fs" % (
+        options.num_requests, options.size, elapsed)
+    print "%.1f requests/sec, %.1f MB/sec" % (
+        options.num_requests / elapsed,
+        state["bytes"] / elapsed / (1024 * 1024))
+
+
+def main():
+    parse_command_line()
+    port = get_unused_port()
+    pid = os.fork()
+    if pid == 0:
+        run_server(port)
+        return
+    try:
+        time.sleep(0.5)  # give the server a moment to start listening
+        run_client(port)
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -65,6 +65,14 @@ class OpenIdMixin(object):
 
     See GoogleMixin below for example implementations.
     """
+    def get_auth_http_client(self):
+        """Returns the AsyncHTTPClient instance to be used for auth requests.
+
+        May be overridden by subclasses to use an HTTP client other than
+        the default, such as an httpcache.CachingHTTPClient.
+        """
+        return httpclient.AsyncHTTPClient()
+
     def authenticate_redirect(self, callback_uri=None,
                               ax_attrs=["name","email","language","username"]):
         """Returns the authentication URL for this service.
@@ -92,7 +100,7 @@ class OpenIdMixin(object):
         args = dict((k, v[-1]) for k, v in self.request.arguments.iteritems())
         args["openid.mode"] = u"check_authentication"
         url = self._OPENID_ENDPOINT
-        http = httpclient.AsyncHTTPClient()
+        http = self.get_auth_http_client()
         http.fetch(url, self.async_callback(
             self._on_authentication_verified, callback),
             method="POST", body=urllib.urlencode(args))
@@ -203,6 +211,14 @@ class OAuthMixin(object):
     See TwitterMixin and FriendFeedMixin below for example implementations.
     """
 
+    def get_auth_http_client(self):
+        """Returns the AsyncHTTPClient instance to be used for auth requests.
+
+        May be overridden by subclasses to use an HTTP client other than
+        the default, such as an httpcache.CachingHTTPClient.
+        """
+        return httpclient.AsyncHTTPClient()
+
     def authorize_redirect(self, callback_uri=None, extra_params=None):
         """Redirects the user to obtain OAuth authorization for this service.
 
@@ -218,7 +234,7 @@ class OAuthMixin(object):
         """
         if callback_uri and getattr(self, "_OAUTH_NO_CALLBACKS", False):
             raise Exception("This service does not support oauth_callback")
-        http = httpclient.AsyncHTTPClient()
+        http = self.get_auth_http_client()
         if getattr(self, "_OAUTH_VERSION", "1.0a") == "1.0a":
             http.fetch(self._oauth_request_token_url(callback_uri=callback_uri,
                 extra_params=extra_params),
@@ -258,7 +274,7 @@ class OAuthMixin(object):
         token = dict(key=cookie_key, secret=cookie_secret)
         if oauth_verifier:
           token["verifier"] = oauth_verifier
-        http = httpclient.AsyncHTTPClient()
+        http = self.get_auth_http_client()
         http.fetch(self._oauth_access_token_url(token), self.async_callback(
             self._on_access_token, callback))
 
@@ -372,6 +388,14 @@ class OAuthMixin(object):
 class OAuth2Mixin(object):
     """Abstract implementation of OAuth v 2."""
 
+    def get_auth_http_client(self):
+        """Returns the AsyncHTTPClient instance to be used for auth requests.
+
+        May be overridden by subclasses to use an HTTP client other than
+        the default, such as an httpcache.CachingHTTPClient.
+        """
+        return httpclient.AsyncHTTPClient()
+
     def authorize_redirect(self, redirect_uri=None, client_id=None,
                            client_secret=None, extra_params=None ):
         """Redirects the user to obtain OAuth authorization for this service.
@@ -450,7 +474,7 @@ class TwitterMixin(OAuthMixin):
         This is generally the right interface to use if you are using
         Twitter for single-sign on.
         """
-        http = httpclient.AsyncHTTPClient()
+        http = self.get_auth_http_client()
         http.fetch(self._oauth_request_token_url(), self.async_callback(
             self._on_request_token, self._OAUTH_AUTHENTICATE_URL, None))
 
@@ -505,7 +529,7 @@ class TwitterMixin(OAuthMixin):
             args.update(oauth)
         if args: url += "?" + urllib.urlencode(args)
         callback = self.async_callback(self._on_twitter_request, callback)
-        http = httpclient.AsyncHTTPClient()
+        http = self.get_auth_http_client()
         if post_args is not None:
             http.fetch(url, method="POST", body=urllib.urlencode(post_args),
                        callback=callback)
@@ -628,7 +652,7 @@ class FriendFeedMixin(OAuthMixin):
             args.update(oauth)
         if args: url += "?" + urllib.urlencode(args)
         callback = self.async_callback(self._on_friendfeed_request, callback)
-        http = httpclient.AsyncHTTPClient()
+        http = self.get_auth_http_client()
         if post_args is not None:
             http.fetch(url, method="POST", body=urllib.urlencode(post_args),
                        callback=callback)
@@ -719,7 +743,7 @@ class GoogleMixin(OpenIdMixin, OAuthMixin):
                 break
         token = self.get_argument("openid." + oauth_ns + ".request_token", "")
         if token:
-            http = httpclient.AsyncHTTPClient()
+            http = self.get_auth_http_client()
             token = dict(key=token, secret="")
             http.fetch(self._oauth_access_token_url(token),
                        self.async_callback(self._on_access_token, callback))
@@ -767,6 +791,14 @@ class FacebookMixin(object):
     required to make requests on behalf of the user later with
     facebook_request().
     """
+    def get_auth_http_client(self):
+        """Returns the AsyncHTTPClient instance to be used for auth requests.
+
+        May be overridden by subclasses to use an HTTP client other than
+        the default, such as an httpcache.CachingHTTPClient.
+        """
+        return httpclient.AsyncHTTPClient()
+
     def authenticate_redirect(self, callback_uri=None, cancel_uri=None,
                               extended_permissions=None):
         """Authenticates/installs this app for the current user."""
@@ -871,7 +903,7 @@ class FacebookMixin(object):
         args["sig"] = self._signature(args)
         url = "http://api.facebook.com/restserver.php?" + \
             urllib.urlencode(args)
-        http = httpclient.AsyncHTTPClient()
+        http = self.get_auth_http_client()
         http.fetch(url, callback=self.async_callback(
             self._parse_response, callback))
 
@@ -947,7 +979,7 @@ class FacebookGraphMixin(OAuth2Mixin):
           self.finish()
 
       """
-      http = httpclient.AsyncHTTPClient()
+      http = self.get_auth_http_client()
       args = {
         "redirect_uri": redirect_uri,
         "code": code,
@@ -1035,7 +1067,7 @@ class FacebookGraphMixin(OAuth2Mixin):
             all_args.update(post_args or {})
         if all_args: url += "?" + urllib.urlencode(all_args)
         callback = self.async_callback(self._on_facebook_request, callback)
-        http = httpclient.AsyncHTTPClient()
+        http = self.get_auth_http_client()
         if post_args is not None:
             http.fetch(url, method="POST", body=urllib.urlencode(post_args),
                        callback=callback)
@@ -18,27 +18,32 @@
 
 import htmlentitydefs
 import re
-import xml.sax.saxutils
 import urllib
 
 # json module is in the standard library as of python 2.6; fall back to
-# simplejson if present for older versions.
+# simplejson if present for older versions.  Applications can install a
+# faster library with set_json_backend().
+_json_iterencode = None
+_json_escapes_slashes = False
 try:
     import json
     assert hasattr(json, "loads") and hasattr(json, "dumps")
     _json_decode = json.loads
     _json_encode = json.dumps
+    _json_iterencode = json.JSONEncoder().iterencode
 except:
     try:
         import simplejson
         _json_decode = lambda s: simplejson.loads(_unicode(s))
         _json_encode = lambda v: simplejson.dumps(v)
+        _json_iterencode = simplejson.JSONEncoder().iterencode
     except ImportError:
         try:
             # For Google AppEngine
             from django.utils import simplejson
             _json_decode = lambda s: simplejson.loads(_unicode(s))
             _json_encode = lambda v: simplejson.dumps(v)
+            _json_iterencode = simplejson.JSONEncoder().iterencode
         except ImportError:
             def _json_decode(s):
                 raise NotImplementedError(
@@ -47,9 +52,40 @@ except:
             _json_encode = _json_decode
 
 
+def set_json_backend(encode, decode, iterencode=None, escapes_slashes=False):
+    """Makes json_encode() and friends use the given JSON library.
+
+    encode(value) must return the JSON encoding of value as a str, and
+    decode(string) the Python object for a JSON string.  iterencode(value),
+    if given, returns the encoding as an iterable of strings and is used
+    by json_encode_chunks().
+
+    If escapes_slashes is true, encode and iterencode already escape
+    forward slashes in strings (as e.g. ujson does by default), so
+    json_encode() returns their output as it is instead of making a
+    second pass over it to escape "</".
+    """
+    global _json_encode, _json_decode, _json_iterencode, _json_escapes_slashes
+    _json_encode = encode
+    _json_decode = decode
+    _json_iterencode = iterencode
+    _json_escapes_slashes = escapes_slashes
+
+
 def xhtml_escape(value):
     """Escapes a string so it is valid within XML or XHTML."""
-    return xml.sax.saxutils.escape(value, {'"': "&quot;"})
+    # A re.sub with a replacement function is much slower than a few
+    # replace() calls.  Short strings, which usually contain none of the
+    # characters, are only searched; for long ones, replace() (which
+    # returns the string itself if there is nothing to replace) is faster.
+    if len(value) > 200:
+        return value.replace("&", "&amp;").replace("<", "&lt;").replace(
+            ">", "&gt;").replace('"', "&quot;")
+    if "&" in value: value = value.replace("&", "&amp;")
+    if "<" in value: value = value.replace("<", "&lt;")
+    if ">" in value: value = value.replace(">", "&gt;")
+    if '"' in value: value = value.replace('"', "&quot;")
+    return value
 
 
 def xhtml_unescape(value):
@@ -65,7 +101,46 @@ def json_encode(value):
     # the javscript.  Some json libraries do this escaping by default,
     # although python's standard library does not, so we do it here.
     # http://stackoverflow.com/questions/1580647/json-why-are-forward-slashes-escaped
-    return _json_encode(value).replace("</", "<\\/")
+    encoded = _json_encode(value)
+    if not _json_escapes_slashes and "</" in encoded:
+        encoded = encoded.replace("</", "<\\/")
+    return encoded
+
+
+def json_encode_chunks(value, chunk_size=64 * 1024):
+    """JSON-encodes the given Python object in pieces.
+
+    Yields the same string as json_encode(), in pieces of about
+    chunk_size bytes, so that large values can
+    be written out without building their whole encoding in memory.
+    """
+    if _json_iterencode is None:
+        yield json_encode(value)
+        return
+    pieces = []
+    size = 0
+    for piece in _json_iterencode(value):
+        pieces.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            chunk = "".join(pieces)
+            pieces = []
+            size = 0
+            if not _json_escapes_slashes:
+                # A "<" at the end may start a "</" in the next chunk
+                if chunk.endswith("<"):
+                    chunk = chunk[:-1]
+                    pieces.append("<")
+                    size = 1
+                if "</" in chunk:
+                    chunk = chunk.replace("</", "<\\/")
+            if chunk:
+                yield chunk
+    if pieces:
+        chunk = "".join(pieces)
+        if not _json_escapes_slashes and "</" in chunk:
+            chunk = chunk.replace("</", "<\\/")
+        yield chunk
 
 
 def json_decode(value):
@@ -0,0 +1,510 @@
+#!/usr/bin/env python
+#
+# Copyright 2009 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""A client-side HTTP cache for the asynchronous HTTP clients.
+
+CachingHTTPClient wraps an AsyncHTTPClient or SimpleAsyncHTTPClient and
+answers repeated GET requests from a local cache, following the rules of
+RFC 7234 for a private (single-user) cache:
+
+    http_client = CachingHTTPClient(AsyncHTTPClient(),
+                                    max_bytes=10 * 1024 * 1024)
+    http_client.fetch("http://api.example.com/users/1", callback)
+
+Responses are stored if they carry explicit freshness information
+(Cache-Control: max-age or Expires) or a validator (ETag or
+Last-Modified).  Fresh responses are served without contacting the
+server; stale ones are revalidated with If-None-Match/If-Modified-Since,
+and a 304 answer refreshes the stored copy.  Request and response
+Cache-Control directives (no-store, no-cache, max-age, max-stale,
+min-fresh) and Vary are honored.  Only one variant is kept per URL.
+
+Stored responses live in an in-memory LRU bounded by max_bytes, and
+optionally in a directory on disk (cache_dir) that survives restarts and
+can be shared by the processes of a pre-forked server.  Disk access is
+ordinary blocking file I/O, so cache_dir should be on a local
+filesystem.
+
+Identical GET requests (same URL and headers) that arrive while one is
+already in flight are not sent again; all of them get the response of
+the first.
+
+Requests with a streaming_callback or header_callback, and requests
+with any method other than GET, are passed straight through; PUT, POST
+and DELETE also evict the cached copy of their URL.
+"""
+
+from __future__ import with_statement
+
+import cPickle as pickle
+import email.utils
+import functools
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+from cStringIO import StringIO
+from tornado import ioloop
+from tornado import stack_context
+from tornado.httpclient import HTTPRequest, HTTPResponse
+from tornado.httpclient import _BatchFetch, _copy_response
+from tornado.httputil import HTTPHeaders
+
+# Status codes that may be cached without explicit freshness information
+# (RFC 7231 section 6.1), which are also the only ones we store.
+_CACHEABLE_CODES = frozenset([200, 203, 300, 301, 404, 410])
+
+# Methods that leave server state alone and so never invalidate entries.
+_SAFE_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "TRACE"])
+
+
+class CachingHTTPClient(object):
+    """Wraps an asynchronous HTTP client with an HTTP cache.
+
+    client is the AsyncHTTPClient or SimpleAsyncHTTPClient that requests
+    are sent through.  max_bytes bounds the size of the in-memory cache;
+    if cache_dir is given, entries are also written there, and
+    max_disk_bytes (if not None) bounds its size.  heuristic_max_age caps
+    the freshness lifetime derived from Last-Modified for responses
+    without explicit freshness information.
+
+    The hits, misses and revalidations attributes count how requests
+    were answered.
+    """
+    def __init__(self, client, max_bytes=10 * 1024 * 1024, cache_dir=None,
+                 max_disk_bytes=None, heuristic_max_age=24 * 60 * 60,
+                 io_loop=None):
+        self.client = client
+        self.io_loop = io_loop or getattr(client, "io_loop", None) or \
+            ioloop.IOLoop.instance()
+        self.heuristic_max_age = heuristic_max_age
+        self.memory = _LRUCache(max_bytes)
+        if cache_dir is not None:
+            self.disk = _DiskCache(cache_dir, max_disk_bytes)
+        else:
+            self.disk = None
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        # coalescing key -> list of (request, callback) waiting on it
+        self._pending = {}
+
+    def fetch(self, request, callback, **kwargs):
+        """Executes an HTTPRequest, from the cache if possible.
+
+        Takes the same arguments as AsyncHTTPClient.fetch.  Responses
+        served from the cache are delivered on the next IOLoop
+        iteration, never before fetch() returns.
+        """
+        if not isinstance(request, HTTPRequest):
+            request = HTTPRequest(url=request, **kwargs)
+        if not isinstance(request.headers, HTTPHeaders):
+            request.headers = HTTPHeaders(request.headers)
+        if (request.method != "GET" or
+            request.streaming_callback is not None or
+            request.header_callback is not None):
+            if request.method not in _SAFE_METHODS:
+                self.invalidate(request.url)
+            self.client.fetch(request, callback)
+            return
+        callback = stack_context.wrap(callback)
+        request_cc = _parse_cache_control(
+            request.headers.get("Cache-Control", ""))
+        if "no-cache" in request.headers.get("Pragma", "").lower():
+            request_cc.setdefault("no-cache", None)
+        if "no-store" in request_cc:
+            self.client.fetch(request, callback)
+            return
+
+        entry = self._get(request.url)
+        if entry is not None and not entry.matches(request):
+            entry = None
+        now = time.time()
+        if (entry is not None and "no-cache" not in request_cc and
+            entry.is_fresh(now, request_cc, self.heuristic_max_age)):
+            self.hits += 1
+            self.io_loop.add_callback(functools.partial(
+                    callback, entry.to_response(request)))
+            return
+
+        key = (request.url, tuple(sorted(request.headers.get_all())))
+        if key in self._pending:
+            self._pending[key].append((request, callback))
+            return
+        self._pending[key] = [(request, callback)]
+
+        upstream = HTTPRequest(
+            request.url, headers=HTTPHeaders(request.headers),
+            **dict((name, getattr(request, name)) for name in _REQUEST_ARGS))
+        if entry is not None:
+            etag = entry.headers.get("Etag")
+            if etag is not None:
+                upstream.headers["If-None-Match"] = etag
+            last_modified = entry.headers.get("Last-Modified")
+            if last_modified is not None:
+                upstream.headers["If-Modified-Since"] = last_modified
+        with stack_context.NullContext():
+            self.client.fetch(upstream, functools.partial(
+                    self._on_response, key, entry, now))
+
+    def fetch_all(self, requests, callback, max_concurrency=None,
+                  timeout=None):
+        """Executes a list of requests; see AsyncHTTPClient.fetch_all."""
+        _BatchFetch(self, requests, callback, max_concurrency,
+                    timeout).start()
+
+    def invalidate(self, url):
+        """Removes any cached response for url."""
+        self.memory.remove(url)
+        if self.disk is not None:
+            self.disk.remove(url)
+
+    def _on_response(self, key, entry, request_time, response):
+        waiters = self._pending.pop(key)
+        first_request = waiters[0][0]
+        response_time = time.time()
+        if response.code == 304 and entry is not None:
+            self.revalidations += 1
+            entry.refresh(response.headers, request_time, response_time)
+            self._put(entry)
+        else:
+            self.misses += 1
+            entry = None
+            if self._cacheable(first_request, response):
+                entry = _CacheEntry.from_response(
+                    first_request, response, request_time, response_time)
+                self._put(entry)
+        for request, callback in waiters:
+            if entry is not None:
+                result = entry.to_response(request)
+            else:
+                result = _copy_response(response, request)
+            try:
+                callback(result)
+            except Exception:
+                logging.error("Exception in HTTP callback", exc_info=True)
+
+    def _cacheable(self, request, response):
+        if response.code not in _CACHEABLE_CODES:
+            return False
+        cache_control = _parse_cache_control(
+            response.headers.get("Cache-Control", ""))
+        if "no-store" in cache_control:
+            return False
+        if response.headers.get("Vary", "").strip() == "*":
+            return False
+        return ("max-age" in cache_control or
+                "Expires" in response.headers or
+                "Etag" in response.headers or
+                "Last-Modified" in response.headers)
+
+    def _get(self, url):
+        entry = self.memory.get(url)
+        if entry is None and self.disk is not None:
+            entry = self.disk.get(url)
+            if entry is not None:
+                self.memory.put(url, entry, entry.size)
+        return entry
+
+    def _put(self, entry):
+        self.memory.put(entry.url, entry, entry.size)
+        if self.disk is not None:
+            self.disk.put(entry.url, entry)
+
+
+# HTTPRequest constructor arguments copied to the upstream request.
+_REQUEST_ARGS = ("method", "body", "auth_username", "auth_password",
+                 "connect_timeout", "request_timeout", "follow_redirects",
+                 "max_redirects", "user_agent", "use_gzip",
+                 "network_interface", "prepare_curl_callback",
+                 "proxy_host", "proxy_port", "proxy_username",
+                 "proxy_password", "allow_nonstandard_methods",
+                 "dns_timeout", "first_byte_timeout", "total_timeout",
+                 "max_retries", "retry_backoff", "retry_backoff_max",
+                 "hedge_after", "hedge_percentile", "body_producer")
+
+
+class _CacheEntry(object):
+    """A stored response plus what is needed to judge its freshness."""
+    def __init__(self, url, code, headers, body, vary, request_time,
+                 response_time):
+        self.url = url
+        self.code = code
+        self.headers = headers
+        self.body = body
+        # header name -> value in the request that produced this response
+        self.vary = vary
+        self.request_time = request_time
+        self.response_time = response_time
+        self.size = len(body) + sum(len(k) + len(v)
+                                    for k, v in headers.get_all())
+
+    @classmethod
+    def from_response(cls, request, response, request_time, response_time):
+        vary = {}
+        for name in response.headers.get("Vary", "").split(","):
+            name = name.strip()
+            if name:
+                vary[name] = request.headers.get(name)
+        return cls(request.url, response.code, HTTPHeaders(response.headers),
+                   response.body or "", vary, request_time, response_time)
+
+    def matches(self, request):
+        for name, value in self.vary.iteritems():
+            if request.headers.get(name) != value:
+                return False
+        return True
+
+    def refresh(self, headers, request_time, response_time):
+        """Applies the headers of a 304 Not Modified response."""
+        for name, value in headers.get_all():
+            if name not in ("Content-Length", "Transfer-Encoding",
+                            "Content-Encoding"):
+                self.headers[name] = value
+        self.request_time = request_time
+        self.response_time = response_time
+
+    def freshness_lifetime(self, heuristic_max_age):
+        cache_control = _parse_cache_control(
+            self.headers.get("Cache-Control", ""))
+        if "max-age" in cache_control:
+            return _parse_int(cache_control["max-age"])
+        date = _parse_date(self.headers.get("Date")) or self.response_time
+        if "Expires" in self.headers:
+            # An invalid Expires value means "already expired"
+            expires = _parse_date(self.headers["Expires"]) or 0
+            return max(0, expires - date)
+        last_modified = _parse_date(self.headers.get("Last-Modified"))
+        if last_modified is not None:
+            return min(max(0, date - last_modified) / 10, heuristic_max_age)
+        return 0
+
+    def current_age(self, now):
+        date = _parse_date(self.headers.get("Date")) or self.response_time
+        apparent_age = max(0, self.response_time - date)
+        age_value = _parse_int(self.headers.get("Age", "0"))
+        corrected_age = age_value + (self.response_time - self.request_time)
+        return max(apparent_age, corrected_age) + (now - self.response_time)
+
+    def is_fresh(self, now, request_cc, heuristic_max_age):
+        cache_control = _parse_cache_control(
+            self.headers.get("Cache-Control", ""))
+        if "no-cache" in cache_control:
+            # May be stored, but must be revalidated before every use
+            return False
+        lifetime = self.freshness_lifetime(heuristic_max_age)
+        if "max-age" in request_cc:
+            lifetime = min(lifetime, _parse_int(request_cc["max-age"]))
+        age = self.current_age(now)
+        if "min-fresh" in request_cc:
+            age += _parse_int(request_cc["min-fresh"])
+        if age < lifetime:
+            return True
+        if "max-stale" in request_cc and "must-revalidate" not in cache_control:
+            max_stale = request_cc["max-stale"]
+            if max_stale is None:
+                return True
+            return age - lifetime <= _parse_int(max_stale)
+        return False
+
+    def to_response(self, request):
+        return HTTPResponse(request, self.code,
+                            headers=HTTPHeaders(self.headers),
+                            buffer=StringIO(self.body),
+                            effective_url=self.url, request_time=0)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["headers"] = list(self.headers.get_all())
+        return state
+
+    def __setstate__(self, state):
+        headers = HTTPHeaders()
+        for name, value in state["headers"]:
+            headers.add(name, value)
+        state["headers"] = headers
+        self.__dict__.update(state)
+
+
+class _LRUCache(object):
+    """A dict-like cache bounded by the total size of its values.
+
+    Entries are kept in a doubly-linked list in order of use; the least
+    recently used ones are dropped to make room.  Values larger than
+    max_bytes are not stored at all.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        # key -> [prev, next, key, value, size]
+        self._map = {}
+        self._root = root = []
+        root[:] = [root, root, None, None, 0]
+
+    def __len__(self):
+        return len(self._map)
+
+    def get(self, key):
+        link = self._map.get(key)
+        if link is None:
+            return None
+        self._unlink(link)
+        self._append(link)
+        return link[3]
+
+    def put(self, key, value, size):
+        self.remove(key)
+        if size > self.max_bytes:
+            return
+        while self.size + size > self.max_bytes:
+            self.remove(self._root[1][2])
+        link = [None, None, key, value, size]
+        self._map[key] = link
+        self._append(link)
+        self.size += size
+
+    def remove(self, key):
+        link = self._map.pop(key, None)
+        if link is not None:
+            self._unlink(link)
+            self.size -= link[4]
+
+    def _append(self, link):
+        root = self._root
+        last = root[0]
+        link[0] = last
+        link[1] = root
+        last[1] = root[0] = link
+
+    def _unlink(self, link):
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+
+
+class _DiskCache(object):
+    """Pickled cache entries stored one per file in a directory.
+
+    When max_bytes is set, the least recently written files are removed
+    once the directory grows beyond it.  I/O errors are logged and
+    otherwise treated as cache misses.
+    """
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get(self, url):
+        try:
+            with open(self._path(url), "rb") as f:
+                stored_url, entry = pickle.load(f)
+        except (IOError, OSError):
+            return None
+        except Exception:
+            logging.warning("Unreadable cache file for %s", url,
+                            exc_info=True)
+            return None
+        if stored_url != url:
+            return None
+        return entry
+
+    def put(self, url, entry):
+        path = self._path(url)
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((url, entry), f, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp_path, path)
+        except (IOError, OSError):
+            logging.warning("Could not write cache file for %s", url,
+                            exc_info=True)
+            return
+        if self.max_bytes is not None:
+            self._trim()
+
+    def remove(self, url):
+        try:
+            os.unlink(self._path(url))
+        except OSError:
+            pass
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url).hexdigest())
+
+    def _trim(self):
+        files = []
+        total = 0
+        for name in os.listdir(self.directory):
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            files.append((st.st_mtime, name, st.st_size))
+            total += st.st_size
+        files.sort()
+        while total > self.max_bytes and files:
+            mtime, name, size = files.pop(0)
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+
+def _parse_cache_control(value):
+    """Parses a Cache-Control header into a dict.
+
+    >>> sorted(_parse_cache_control('max-age=60, no-cache, private="x"').items())
+    [('max-age', '60'), ('no-cache', None), ('private', 'x')]
+    """
+    directives = {}
+    for part in value.split(","):
+        name, sep, arg = part.strip().partition("=")
+        name = name.strip().lower()
+        if not name:
+            continue
+        if sep:
+            directives[name] = arg.strip().strip('"')
+        else:
+            directives[name] = None
+    return directives
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    try:
+        return email.utils.mktime_tz(parsed)
+    except (OverflowError, ValueError):
+        return None
+
+
+def _parse_int(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def doctests():
+    import doctest
+    return doctest.DocTestSuite()
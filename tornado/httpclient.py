@@ -23,9 +23,11 @@ import calendar
 import collections
 import email.utils
 import errno
+import functools
 import httplib
 import logging
 import os
+import random
 try:
     import pycurl
 except ImportError:
@@ -37,6 +39,7 @@ except ImportError:
 import sys
 import threading
 import time
+import urlparse
 import weakref
 
 from tornado import escape
@@ -114,12 +117,24 @@ class AsyncHTTPClient(object):
 
     The keyword argument max_clients to the AsyncHTTPClient constructor
     determines the maximum number of simultaneous fetch() operations that
-    can execute in parallel on each IOLoop.
+    can execute in parallel on each IOLoop.  max_clients_per_host
+    additionally limits how many of those may go to any one host:port,
+    so that a slow server cannot occupy every slot.  Queued requests are
+    started round-robin across hosts.  Per-host counters (active and
+    queued requests, time spent waiting in the queue, connection reuse)
+    are available in the host_stats dictionary, keyed by "host:port".
+
+    response_hook, if given, is called as response_hook(host, response)
+    for every response before it is passed to the fetch callback.  It is
+    the place to feed response.request_time and response.time_info into
+    per-host latency histograms; it may also be set as an attribute on
+    an existing client.
     """
     _ASYNC_CLIENTS = weakref.WeakKeyDictionary()
 
     def __new__(cls, io_loop=None, max_clients=10,
-                max_simultaneous_connections=None):
+                max_simultaneous_connections=None,
+                max_clients_per_host=None, response_hook=None):
         # There is one client per IOLoop since they share curl instances
         io_loop = io_loop or ioloop.IOLoop.instance()
         if io_loop in cls._ASYNC_CLIENTS:
@@ -135,7 +150,11 @@ class AsyncHTTPClient(object):
             instance._curls = [_curl_create(max_simultaneous_connections)
                                for i in xrange(max_clients)]
             instance._free_list = instance._curls[:]
-            instance._requests = collections.deque()
+            instance._requests = _HostScheduler(max_clients_per_host)
+            instance.host_stats = instance._requests.stats
+            instance.response_hook = response_hook
+            # host -> deque of recent response times, for hedging
+            instance._latencies = {}
             instance._fds = {}
             instance._timeout = None
             cls._ASYNC_CLIENTS[io_loop] = instance
@@ -185,7 +204,57 @@ class AsyncHTTPClient(object):
         """
         if not isinstance(request, HTTPRequest):
             request = HTTPRequest(url=request, **kwargs)
-        self._requests.append((request, stack_context.wrap(callback)))
+        # Checked here as well as in _curl_setup_request, which runs once
+        # a curl handle has been taken for the request and could not give
+        # it back
+        _check_body_producer(request)
+        _check_curl_options(request, ("dns_timeout", "first_byte_timeout"))
+        _Fetch(self, _request_host(request.url), request,
+               stack_context.wrap(callback)).start()
+
+    def fetch_all(self, requests, callback, max_concurrency=None,
+                  timeout=None):
+        """Executes a list of requests, calling callback with all responses.
+
+        requests may contain HTTPRequest objects or URLs.  callback is
+        run once, with a list of HTTPResponses in the same order as
+        requests.  At most max_concurrency of the requests are in progress
+        at once (in addition to the client's own limits).  If timeout is
+        given and some requests have not finished after that many
+        seconds, callback is run with what has arrived so far; the
+        missing responses are 599 errors, and requests that were never
+        started are not sent at all.
+        """
+        _BatchFetch(self, requests, callback, max_concurrency,
+                    timeout).start()
+
+    def _enqueue(self, host, request, callback, attempt):
+        self._requests.add(host, (request, callback, attempt))
+        self._process_queue()
+        self._set_timeout(0)
+
+    def _record_latency(self, host, latency):
+        _record_latency(self._latencies, host, latency)
+
+    def _hedge_delay(self, host, request):
+        """Returns how long to wait before hedging request, or None."""
+        return _hedge_delay(self._latencies, host, request)
+
+    def _cancel(self, curl, info):
+        """Abandons the transfer described by info, if curl still runs it."""
+        if curl.info is not info:
+            return
+        curl.info = None
+        self._multi.remove_handle(curl)
+        self._requests.finish(info["host"])
+        info["buffer"].close()
+        # This may run while _finish_pending_requests goes through curls
+        # that libcurl reported as done, curl among them, so the handle
+        # is only reused once that is over
+        self.io_loop.add_callback(functools.partial(self._release, curl))
+
+    def _release(self, curl):
+        self._free_list.append(curl)
         self._process_queue()
         self._set_timeout(0)
 
@@ -299,10 +368,18 @@ class AsyncHTTPClient(object):
             while True:
                 started = 0
                 while self._free_list and self._requests:
+                    next = self._requests.pop()
+                    if next is None:
+                        # Everything queued is for hosts at their limit
+                        break
+                    host, (request, callback, attempt) = next
+                    if attempt.cancelled:
+                        self._requests.finish(host)
+                        continue
                     started += 1
                     curl = self._free_list.pop()
-                    (request, callback) = self._requests.popleft()
                     curl.info = {
+                        "host": host,
                         "headers": httputil.HTTPHeaders(),
                         "buffer": cStringIO.StringIO(),
                         "request": request,
@@ -317,15 +394,20 @@ class AsyncHTTPClient(object):
                     _curl_setup_request(curl, request, curl.info["buffer"],
                                         curl.info["headers"])
                     self._multi.add_handle(curl)
+                    attempt.connection = _CurlTransfer(self, curl)
 
                 if not started:
                     break
 
     def _finish(self, curl, curl_error=None, curl_message=None):
         info = curl.info
+        if info is None:
+            # Cancelled after libcurl reported it done
+            return
         curl.info = None
         self._multi.remove_handle(curl)
         self._free_list.append(curl)
+        self._requests.finish(info["host"])
         buffer = info["buffer"]
         if curl_error:
             error = CurlError(curl_error, curl_message)
@@ -349,12 +431,23 @@ class AsyncHTTPClient(object):
             total=curl.getinfo(pycurl.TOTAL_TIME),
             redirect=curl.getinfo(pycurl.REDIRECT_TIME),
             )
+        if hasattr(pycurl, "APPCONNECT_TIME"):
+            # The end of the SSL handshake (pycurl 7.19.0+)
+            time_info["appconnect"] = curl.getinfo(pycurl.APPCONNECT_TIME)
+        if not curl_error:
+            stats = self.host_stats[info["host"]]
+            if curl.getinfo(pycurl.NUM_CONNECTS):
+                stats.pool_misses += 1
+            else:
+                stats.pool_hits += 1
+        response = HTTPResponse(
+            request=info["request"], code=code, headers=info["headers"],
+            buffer=buffer, effective_url=effective_url, error=error,
+            request_time=time.time() - info["curl_start_time"],
+            time_info=time_info)
+        _run_response_hook(self.response_hook, info["host"], response)
         try:
-            info["callback"](HTTPResponse(
-                request=info["request"], code=code, headers=info["headers"],
-                buffer=buffer, effective_url=effective_url, error=error,
-                request_time=time.time() - info["curl_start_time"],
-                time_info=time_info))
+            info["callback"](response)
         except (KeyboardInterrupt, SystemExit):
             raise
         except:
@@ -364,6 +457,341 @@ class AsyncHTTPClient(object):
     def handle_callback_exception(self, callback):
         self.io_loop.handle_callback_exception(callback)
 
+class _BatchFetch(object):
+    """Runs the requests of one fetch_all call on an HTTP client."""
+    def __init__(self, client, requests, callback, max_concurrency=None,
+                 timeout=None):
+        self.client = client
+        self.io_loop = client.io_loop
+        self.requests = [r if isinstance(r, HTTPRequest) else HTTPRequest(r)
+                         for r in requests]
+        self.responses = [None] * len(self.requests)
+        self.callback = stack_context.wrap(callback)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._timeout = None
+        self._next = 0
+        self._active = 0
+        self._finished = 0
+
+    def start(self):
+        if not self.requests:
+            self.io_loop.add_callback(self._finish)
+            return
+        if self.timeout is not None:
+            self._timeout = self.io_loop.add_timeout(
+                time.time() + self.timeout, self._on_timeout)
+        self._start_requests()
+
+    def _start_requests(self):
+        while (self._next < len(self.requests) and
+               (self.max_concurrency is None or
+                self._active < self.max_concurrency)):
+            index = self._next
+            self._next += 1
+            self._active += 1
+            self.client.fetch(self.requests[index],
+                              functools.partial(self._on_response, index))
+
+    def _on_response(self, index, response):
+        self._active -= 1
+        if self.callback is None:
+            # Already answered by the timeout
+            return
+        self.responses[index] = response
+        self._finished += 1
+        if self._finished == len(self.requests):
+            self._finish()
+        else:
+            self._start_requests()
+
+    def _on_timeout(self):
+        self._timeout = None
+        for i, response in enumerate(self.responses):
+            if response is None:
+                self.responses[i] = HTTPResponse(
+                    self.requests[i], 599, error=HTTPError(599, "Timeout"))
+        self._finish()
+
+    def _finish(self):
+        if self._timeout is not None:
+            self.io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+        callback = self.callback
+        self.callback = None
+        callback(self.responses)
+
+
+# Requests that may be sent more than once
+_IDEMPOTENT_METHODS = set(["GET", "HEAD", "PUT", "DELETE"])
+
+# Response times kept per host for hedge_percentile, and the number
+# needed before they are used instead of hedge_after.
+_LATENCY_SAMPLES = 100
+_MIN_LATENCY_SAMPLES = 10
+
+
+def _record_latency(latencies, host, latency):
+    samples = latencies.get(host)
+    if samples is None:
+        samples = latencies[host] = collections.deque(
+            maxlen=_LATENCY_SAMPLES)
+    samples.append(latency)
+
+
+def _hedge_delay(latencies, host, request):
+    """Returns how long to wait before hedging request, or None."""
+    samples = latencies.get(host)
+    if (request.hedge_percentile is not None and samples and
+        len(samples) >= _MIN_LATENCY_SAMPLES):
+        ordered = sorted(samples)
+        index = int(len(ordered) * request.hedge_percentile / 100.0)
+        return ordered[min(index, len(ordered) - 1)]
+    return request.hedge_after
+
+
+class _Attempt(object):
+    """One try at a request, queued or in progress."""
+    def __init__(self):
+        self.start_time = time.time()
+        self.connection = None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        if self.connection is not None:
+            self.connection.cancel()
+
+
+class _Fetch(object):
+    """Runs the attempts for one call to fetch() on an HTTP client.
+
+    Requests are tried once, plus the retries and hedged attempts
+    allowed by the HTTPRequest.  The callback gets the first successful
+    (or final) response; attempts still running at that point are
+    cancelled.
+    """
+    _RETRY_CODES = set([502, 503, 504, 599])
+
+    def __init__(self, client, host, request, callback):
+        self.client = client
+        self.io_loop = client.io_loop
+        self.host = host
+        self.request = request
+        self.callback = callback
+        self.attempts = []
+        self.retries = 0
+        self._replayable = (
+            request.method in _IDEMPOTENT_METHODS and
+            request.body_producer is None and
+            request.streaming_callback is None and
+            request.header_callback is None)
+        self._hedged = False
+        self._retry_timeout = None
+        self._hedge_timeout = None
+        self._total_timeout = None
+
+    def start(self):
+        if self.request.total_timeout:
+            self._total_timeout = self.io_loop.add_timeout(
+                time.time() + self.request.total_timeout,
+                self._on_total_timeout)
+        if self._replayable:
+            delay = self.client._hedge_delay(self.host, self.request)
+            if delay is not None:
+                self._hedge_timeout = self.io_loop.add_timeout(
+                    time.time() + delay, self._on_hedge)
+        self._start_attempt()
+
+    def _start_attempt(self):
+        attempt = _Attempt()
+        self.attempts.append(attempt)
+        self.client._enqueue(self.host, self.request,
+                             functools.partial(self._on_response, attempt),
+                             attempt)
+
+    def _on_hedge(self):
+        self._hedge_timeout = None
+        if self.callback is not None and not self._hedged:
+            logging.debug("hedging request for %s", self.request.url)
+            self._hedged = True
+            self._start_attempt()
+
+    def _on_retry(self):
+        self._retry_timeout = None
+        if self.callback is not None:
+            self._start_attempt()
+
+    def _on_total_timeout(self):
+        self._total_timeout = None
+        self._finish(HTTPResponse(self.request, 599,
+                                  error=HTTPError(599, "Timeout")))
+
+    def _on_response(self, attempt, response):
+        if attempt in self.attempts:
+            self.attempts.remove(attempt)
+        if self.callback is None:
+            return
+        if (not self._replayable or
+            response.code not in self._RETRY_CODES):
+            if response.error is None:
+                self.client._record_latency(
+                    self.host, time.time() - attempt.start_time)
+            self._finish(response)
+            return
+        if self.attempts or self._retry_timeout is not None:
+            # A hedged attempt is still running; it may yet succeed
+            return
+        if self.retries >= self.request.max_retries:
+            self._finish(response)
+            return
+        self.retries += 1
+        cap = min(self.request.retry_backoff * 2 ** (self.retries - 1),
+                  self.request.retry_backoff_max)
+        delay = random.uniform(cap / 2, cap)
+        logging.debug("retrying %s in %.3fs after %s", self.request.url,
+                      delay, response.error)
+        self._retry_timeout = self.io_loop.add_timeout(
+            time.time() + delay, self._on_retry)
+
+    def _finish(self, response):
+        for name in ("_retry_timeout", "_hedge_timeout", "_total_timeout"):
+            timeout = getattr(self, name)
+            if timeout is not None:
+                self.io_loop.remove_timeout(timeout)
+                setattr(self, name, None)
+        callback = self.callback
+        self.callback = None
+        attempts, self.attempts = self.attempts, []
+        for attempt in attempts:
+            attempt.cancel()
+        callback(response)
+
+
+class _CurlTransfer(object):
+    """Lets a _Fetch cancel the transfer it started on a curl handle."""
+    def __init__(self, client, curl):
+        self.client = client
+        self.curl = curl
+        self.info = curl.info
+
+    def cancel(self):
+        self.client._cancel(self.curl, self.info)
+
+
+class HostStats(object):
+    """Request counters for one host, kept by the HTTP clients.
+
+    active and queued are the current number of requests in progress and
+    waiting for a slot.  requests, total_queue_time and max_queue_time
+    cover every request that has been started so far.  pool_hits and
+    pool_misses count the requests that were sent on a reused keep-alive
+    connection and on a new one.
+    """
+    def __init__(self):
+        self.active = 0
+        self.queued = 0
+        self.requests = 0
+        self.total_queue_time = 0.0
+        self.max_queue_time = 0.0
+        self.pool_hits = 0
+        self.pool_misses = 0
+
+    def average_queue_time(self):
+        """Returns the mean time requests waited for a slot, or None."""
+        if not self.requests:
+            return None
+        return self.total_queue_time / self.requests
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, ",".join(
+                "%s=%r" % i for i in sorted(self.__dict__.iteritems())))
+
+
+class _HostScheduler(object):
+    """Queues requests per host and hands them out round-robin.
+
+    Each host has its own FIFO queue.  pop() returns the next request
+    from the first host (in round-robin order) that is below
+    max_per_host active requests, so a backlog for one host does not
+    delay requests for others.  The caller enforces the global limit and
+    calls finish() when a request started by pop() completes.
+    """
+    def __init__(self, max_per_host=None):
+        self.max_per_host = max_per_host
+        # host -> HostStats
+        self.stats = {}
+        # host -> deque of (enqueue time, item)
+        self._queues = {}
+        # hosts with queued requests, in the order they will be served
+        self._ready = collections.deque()
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def add(self, host, item):
+        queue = self._queues.get(host)
+        if queue is None:
+            queue = self._queues[host] = collections.deque()
+            self._ready.append(host)
+        queue.append((time.time(), item))
+        self._len += 1
+        self._get_stats(host).queued += 1
+
+    def pop(self):
+        """Returns (host, item) for the next request to start, or None."""
+        for i in xrange(len(self._ready)):
+            host = self._ready.popleft()
+            stats = self._get_stats(host)
+            if (self.max_per_host is not None and
+                stats.active >= self.max_per_host):
+                self._ready.append(host)
+                continue
+            queue = self._queues[host]
+            enqueued, item = queue.popleft()
+            if queue:
+                self._ready.append(host)
+            else:
+                del self._queues[host]
+            self._len -= 1
+            wait = time.time() - enqueued
+            stats.queued -= 1
+            stats.active += 1
+            stats.requests += 1
+            stats.total_queue_time += wait
+            stats.max_queue_time = max(stats.max_queue_time, wait)
+            return host, item
+        return None
+
+    def finish(self, host):
+        self.stats[host].active -= 1
+
+    def _get_stats(self, host):
+        stats = self.stats.get(host)
+        if stats is None:
+            stats = self.stats[host] = HostStats()
+        return stats
+
+
+def _run_response_hook(hook, host, response):
+    if hook is None:
+        return
+    try:
+        hook(host, response)
+    except Exception:
+        logging.error("Exception in response hook", exc_info=True)
+
+
+def _request_host(url):
+    """Returns the "host:port" key used for per-host limits."""
+    parsed = urlparse.urlsplit(url)
+    port = parsed.port
+    if port is None:
+        port = 443 if parsed.scheme == "https" else 80
+    return "%s:%d" % (parsed.hostname, port)
+
+
 # For backwards compatibility: Tornado 1.0 included a new implementation of
 # AsyncHTTPClient that has since replaced the original.  Define an alias
 # so anything that used AsyncHTTPClient2 still works
@@ -378,7 +806,11 @@ class HTTPRequest(object):
                  network_interface=None, streaming_callback=None,
                  header_callback=None, prepare_curl_callback=None,
                  proxy_host=None, proxy_port=None, proxy_username=None,
-                 proxy_password='', allow_nonstandard_methods=False):
+                 proxy_password='', allow_nonstandard_methods=False,
+                 dns_timeout=None, first_byte_timeout=None,
+                 total_timeout=None, max_retries=0, retry_backoff=0.1,
+                 retry_backoff_max=10.0, hedge_after=None,
+                 hedge_percentile=None, body_producer=None):
         if headers is None:
             headers = httputil.HTTPHeaders()
         if if_modified_since:
@@ -407,6 +839,16 @@ class HTTPRequest(object):
         self.method = method
         self.headers = headers
         self.body = body
+        # Instead of body, POST and PUT requests may give a body_producer
+        # to send a large body without holding it in memory.  It is either
+        # a file-like object, which is read in chunks, or a callable run
+        # as body_producer(write, finish): write(data, callback=None)
+        # sends a piece of the body and runs callback once it has been
+        # written to the socket (wait for it before writing more), and
+        # finish() ends the body.  If the headers include a Content-Length
+        # the body is sent as is, otherwise with chunked encoding.  The
+        # curl-based client accepts only file-like objects.
+        self.body_producer = body_producer
         self.auth_username = _utf8(auth_username)
         self.auth_password = _utf8(auth_password)
         self.connect_timeout = connect_timeout
@@ -420,6 +862,32 @@ class HTTPRequest(object):
         self.header_callback = header_callback
         self.prepare_curl_callback = prepare_curl_callback
         self.allow_nonstandard_methods = allow_nonstandard_methods
+        # connect_timeout and request_timeout apply to each attempt, and
+        # dns_timeout and first_byte_timeout (the time from sending the
+        # request to receiving the response headers) narrow them down to
+        # one phase; these two are only supported by
+        # SimpleAsyncHTTPClient, and AsyncHTTPClient.fetch raises a
+        # ValueError for them.  total_timeout bounds the whole fetch,
+        # including retries and the delays between them.
+        self.dns_timeout = dns_timeout
+        self.first_byte_timeout = first_byte_timeout
+        self.total_timeout = total_timeout
+        # Idempotent requests without a streaming_callback or
+        # header_callback are retried up to max_retries times after a 599
+        # or a 502, 503 or 504 response.  The n-th retry waits between
+        # half and all of min(retry_backoff * 2 ** (n - 1),
+        # retry_backoff_max) seconds, chosen at random so that clients
+        # that failed together do not retry together.
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        # Such requests may also be hedged: if the first attempt has not
+        # finished after hedge_percentile (e.g. 95) of the recent response
+        # times for the same host, or after hedge_after seconds while too
+        # few response times are known, a second attempt is started and
+        # whichever finishes first is used.
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
         self.start_time = time.time()
 
 
@@ -438,7 +906,10 @@ class HTTPResponse(object):
         Available data are subject to change, but currently uses timings
         available from http://curl.haxx.se/libcurl/c/curl_easy_getinfo.html,
         plus 'queue', which is the delay (if any) introduced by waiting for
-        a slot under AsyncHTTPClient's max_clients setting.
+        a slot under AsyncHTTPClient's max_clients setting.  Both clients
+        report namelookup (DNS), connect, appconnect (SSL handshake),
+        pretransfer, starttransfer (first byte) and total, each measured
+        from the start of the request like libcurl does.
     """
     def __init__(self, request, code, headers={}, buffer=None,
                  effective_url=None, error=None, request_time=None,
@@ -515,15 +986,36 @@ def _curl_create(max_simultaneous_connections=None):
     return curl
 
 
+def _check_body_producer(request):
+    if request.body_producer is not None and \
+       not hasattr(request.body_producer, "read"):
+        raise NotImplementedError(
+            "callable body producers not supported by curl")
+
+
+def _check_curl_options(request, names):
+    for name in names:
+        if getattr(request, name) is not None:
+            raise ValueError("%s is not supported by curl" % name)
+
+
 def _curl_setup_request(curl, request, buffer, headers):
     curl.setopt(pycurl.URL, request.url)
     # Request headers may be either a regular dict or HTTPHeaders object
     if isinstance(request.headers, httputil.HTTPHeaders):
-        curl.setopt(pycurl.HTTPHEADER,
-                    [_utf8("%s: %s" % i) for i in request.headers.get_all()])
+        header_lines = [_utf8("%s: %s" % i)
+                        for i in request.headers.get_all()]
     else:
-        curl.setopt(pycurl.HTTPHEADER,
-                    [_utf8("%s: %s" % i) for i in request.headers.iteritems()])
+        header_lines = [_utf8("%s: %s" % i)
+                        for i in request.headers.iteritems()]
+    body_length = None
+    if request.body_producer is not None:
+        _check_body_producer(request)
+        body_length = request.headers.get("Content-Length")
+        if body_length is None and request.method == "POST":
+            # libcurl only chunks uploads on its own for PUT
+            header_lines.append("Transfer-Encoding: chunked")
+    curl.setopt(pycurl.HTTPHEADER, header_lines)
     if request.header_callback:
         curl.setopt(pycurl.HEADERFUNCTION, request.header_callback)
     else:
@@ -577,7 +1069,14 @@ def _curl_setup_request(curl, request, buffer, headers):
         raise KeyError('unknown method ' + request.method)
 
     # Handle curl's cryptic options for every individual HTTP method
-    if request.method in ("POST", "PUT"):
+    if request.method in ("POST", "PUT") and request.body_producer is not None:
+        curl.setopt(pycurl.READFUNCTION, request.body_producer.read)
+        size = -1 if body_length is None else int(body_length)
+        if request.method == "POST":
+            curl.setopt(pycurl.POSTFIELDSIZE, size)
+        else:
+            curl.setopt(pycurl.INFILESIZE, size)
+    elif request.method in ("POST", "PUT"):
         request_buffer =  cStringIO.StringIO(escape.utf8(request.body))
         curl.setopt(pycurl.READFUNCTION, request_buffer.read)
         if request.method == "POST":
@@ -633,6 +1132,23 @@ def _curl_debug(debug_type, debug_msg):
         logging.debug('%s %r', debug_types[debug_type], debug_msg)
 
 
+def _copy_response(response, request):
+    """Returns a copy of response as if it had been fetched for request."""
+    if response.buffer is not None:
+        buffer = cStringIO.StringIO(response.body)
+    else:
+        buffer = None
+    error = response.error
+    if response.code != 599:
+        # Let HTTPResponse create an HTTPError that refers to the copy
+        error = None
+    return HTTPResponse(request, response.code,
+                        headers=httputil.HTTPHeaders(response.headers),
+                        buffer=buffer, effective_url=response.effective_url,
+                        error=error, request_time=response.request_time,
+                        time_info=response.time_info)
+
+
 def _utf8(value):
     if value is None:
         return value
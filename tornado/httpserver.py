@@ -20,7 +20,11 @@ import cgi
 import errno
 import logging
 import os
+import select
+import signal
 import socket
+import stat
+import sys
 import time
 import urlparse
 
@@ -111,6 +115,16 @@ class HTTPServer(object):
            "keyfile": os.path.join(data_dir, "mydomain.key"),
        })
 
+    On Python versions with ssl.SSLContext (2.7.9+), ssl_options may also
+    be an SSLContext, and a dictionary is turned into one when the server
+    is created.  All connections share that context and with it OpenSSL's
+    session cache and session ticket keys, so returning clients can resume
+    their TLS sessions instead of paying for a full handshake; since the
+    context is created before start() forks, tickets are honored by every
+    child process.  Handshake timings and the share of resumed sessions
+    are collected in the server's ssl_handshake_stats attribute (an
+    iostream.SSLHandshakeStats).
+
     By default, listen() runs in a single thread in a single process. You
     can utilize all available CPUs on this machine by calling bind() and
     start() instead of listen():
@@ -125,9 +139,54 @@ class HTTPServer(object):
     all with their own IOLoop. You can also pass in the specific number of
     child processes you want to run with if you want to override this
     auto-detection.
+
+    A server may listen on any number of sockets. bind() may be called
+    more than once (e.g. for several addresses, or for both IPv4 and IPv6),
+    bind_unix_socket() listens on a Unix domain socket, which avoids TCP
+    loopback overhead behind a local proxy such as nginx, and add_sockets()
+    takes sockets that are already bound and listening, such as those
+    created by bind_sockets() before forking or inherited from a parent
+    process (see socket_from_fd() and inherited_sockets()):
+
+        http_server = httpserver.HTTPServer(handle_request)
+        http_server.bind(8888)
+        http_server.bind_unix_socket("/tmp/tornado.sock")
+        http_server.start(0)
+        ioloop.IOLoop.instance().start()
+
+    A running server can hand its listening sockets over to a freshly
+    executed copy of the program, so deploys never refuse connections.
+    handoff() re-executes the program with the sockets passed in the
+    environment, waits until the new process has started accepting
+    connections, and then drains this one: it stops accepting, lets
+    in-progress requests finish and stops the IOLoop. The new process picks
+    up the sockets with inherited_sockets(). handoff_on_signal() triggers
+    this on SIGUSR2, also in pre-fork mode:
+
+        http_server = httpserver.HTTPServer(handle_request)
+        sockets = httpserver.inherited_sockets()
+        if sockets:
+            http_server.add_sockets(sockets)
+        else:
+            http_server.bind(8888)
+        http_server.handoff_on_signal()
+        http_server.start(0)
+        ioloop.IOLoop.instance().start()
+
+    HTTPServer can protect itself from overload. max_connections limits
+    the number of open connections and max_requests the number of requests
+    that have been received but not yet finished. If max_loop_lag is given
+    (in seconds), we measure how late the IOLoop runs its timeouts and
+    treat the server as overloaded while that lag exceeds the threshold.
+    While overloaded, new connections are answered with a fast
+    "503 Service Unavailable" and closed, or, if reject_overload is False,
+    they are not accepted at all and wait in the listen backlog until
+    capacity frees up. Requests arriving on already-open keep-alive
+    connections while max_requests is reached also get a 503.
     """
     def __init__(self, request_callback, no_keep_alive=False, io_loop=None,
-                 xheaders=False, ssl_options=None):
+                 xheaders=False, ssl_options=None, max_connections=None,
+                 max_requests=None, max_loop_lag=None, reject_overload=True):
         """Initializes the server with the given request callback.
 
         If you use pre-forking/start() instead of the listen() method to
@@ -140,8 +199,29 @@ class HTTPServer(object):
         self.io_loop = io_loop
         self.xheaders = xheaders
         self.ssl_options = ssl_options
-        self._socket = None
+        self._ssl_context = None
+        self.ssl_handshake_stats = None
+        if ssl_options is not None:
+            if hasattr(ssl, "SSLContext"):
+                self._ssl_context = ssl_options_to_context(ssl_options)
+            self.ssl_handshake_stats = iostream.SSLHandshakeStats(
+                self._ssl_context)
+        self.max_connections = max_connections
+        self.max_requests = max_requests
+        self.max_loop_lag = max_loop_lag
+        self.reject_overload = reject_overload
+        self._sockets = {}  # fd -> socket object
         self._started = False
+        self._accepting = False
+        self._connections = set()
+        self._num_requests = 0
+        self._lag_monitor = None
+        self._draining = False
+        self._drain_callback = None
+        self._drain_timeout = None
+        self._handoff_signal = None
+        self._handoff_requested = False
+        self._master = False
 
     def listen(self, port, address=""):
         """Binds to the given port and starts the server in a single process.
@@ -155,22 +235,41 @@ class HTTPServer(object):
         self.bind(port, address)
         self.start(1)
 
-    def bind(self, port, address=""):
+    def bind(self, port, address="", family=socket.AF_UNSPEC, backlog=128):
         """Binds this server to the given port on the given IP address.
 
         To start the server, call start(). If you want to run this server
         in a single process, you can call listen() as a shortcut to the
         sequence of bind() and start() calls.
+
+        The address may be a hostname or an IPv4 or IPv6 address; if it
+        is empty we listen on all available interfaces.  By default we
+        listen on every address family the address resolves to; pass
+        family=socket.AF_INET or socket.AF_INET6 to restrict this.  bind()
+        may be called multiple times to listen on several addresses.
+        """
+        self.add_sockets(bind_sockets(port, address, family, backlog))
+
+    def bind_unix_socket(self, path, mode=0600, backlog=128):
+        """Binds this server to a Unix domain socket at the given path.
+
+        See the module-level bind_unix_socket() for details.
         """
-        assert not self._socket
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
-        flags = fcntl.fcntl(self._socket.fileno(), fcntl.F_GETFD)
-        flags |= fcntl.FD_CLOEXEC
-        fcntl.fcntl(self._socket.fileno(), fcntl.F_SETFD, flags)
-        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self._socket.setblocking(0)
-        self._socket.bind((address, port))
-        self._socket.listen(128)
+        self.add_sockets([bind_unix_socket(path, mode, backlog)])
+
+    def add_sockets(self, sockets):
+        """Makes this server accept connections on the given sockets.
+
+        The sockets must already be bound and listening.  They may be
+        added before or after start(); in the former case they are shared
+        with any pre-forked child processes.
+        """
+        for sock in sockets:
+            sock.setblocking(0)
+            self._sockets[sock.fileno()] = sock
+            if self._accepting:
+                self.io_loop.add_handler(sock.fileno(), self._handle_events,
+                                         ioloop.IOLoop.READ)
 
     def start(self, num_processes=1):
         """Starts this server in the IOLoop.
@@ -202,8 +301,10 @@ class HTTPServer(object):
             num_processes = 1
         if num_processes > 1:
             logging.info("Pre-forking %d server processes", num_processes)
+            children = set()
             for i in range(num_processes):
-                if os.fork() == 0:
+                pid = os.fork()
+                if pid == 0:
                     import random
                     from binascii import hexlify
                     try:
@@ -216,37 +317,267 @@ class HTTPServer(object):
                         seed(int(time.time() * 1000) ^ os.getpid())
                     random.seed(seed)
                     self.io_loop = ioloop.IOLoop.instance()
-                    self.io_loop.add_handler(
-                        self._socket.fileno(), self._handle_events,
-                        ioloop.IOLoop.READ)
+                    if self._handoff_signal is not None:
+                        # The master handles handoffs and tells us to
+                        # drain with SIGTERM once the new process is up.
+                        signal.signal(self._handoff_signal, signal.SIG_IGN)
+                        signal.signal(signal.SIGTERM, self._on_drain_signal)
+                    self._start_accepting()
+                    _notify_ready()
                     return
-            os.waitpid(-1, 0)
+                children.add(pid)
+            self._master = True
+            _notify_ready(close_only=True)
+            self._wait_for_children(children)
         else:
             if not self.io_loop:
                 self.io_loop = ioloop.IOLoop.instance()
-            self.io_loop.add_handler(self._socket.fileno(),
-                                     self._handle_events,
-                                     ioloop.IOLoop.READ)
+            self._start_accepting()
+            _notify_ready()
+
+    def _wait_for_children(self, children):
+        while children:
+            if self._handoff_requested:
+                self._handoff_requested = False
+                if self.handoff(block=True) is not None:
+                    for pid in children:
+                        os.kill(pid, signal.SIGTERM)
+                    while children:
+                        children.discard(_waitpid())
+                    sys.exit(0)
+            pid = _waitpid()
+            if pid is None:
+                continue
+            children.discard(pid)
+            # Like before handoff support, the master returns as soon as
+            # any child exits.
+            return
+
+    def handoff_on_signal(self, signum=None):
+        """Calls handoff() when this process receives the given signal.
+
+        The default signal is SIGUSR2.  Must be called before start().  In
+        pre-fork mode the master process performs the handoff and then
+        sends SIGTERM to its children, which drain and stop their IOLoops.
+        """
+        if signum is None:
+            signum = signal.SIGUSR2
+        self._handoff_signal = signum
+        signal.signal(signum, self._on_handoff_signal)
+
+    def _on_handoff_signal(self, signum, frame):
+        if not self._master:
+            self.io_loop.add_callback(self.handoff)
+        else:
+            # The pre-fork master is blocked in waitpid; the signal
+            # interrupts it and it notices this flag.
+            self._handoff_requested = True
+
+    def _on_drain_signal(self, signum, frame):
+        self.io_loop.add_callback(self.drain)
+
+    def handoff(self, args=None, ready_timeout=60.0, drain_timeout=None,
+                callback=None, block=False):
+        """Re-executes this program, passing it our listening sockets.
+
+        args is the command line to execute, by default the command line
+        this process was started with.  The new process is expected to
+        call inherited_sockets() and start(); once it is accepting
+        connections we call drain(drain_timeout, callback).  If it does not
+        become ready within ready_timeout seconds we keep serving.
+
+        Returns the pid of the new process, or None if it could not be
+        started.  If block is True we wait for readiness without an
+        IOLoop (this is how the pre-fork master uses it) and do not drain.
+        """
+        if args is None:
+            args = [sys.executable] + sys.argv
+        fds = list(self._sockets)
+        env = dict(os.environ)
+        env[_HANDOFF_FDS_ENV] = ",".join(str(fd) for fd in fds)
+        ready_r, ready_w = os.pipe()
+        env[_HANDOFF_READY_ENV] = str(ready_w)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                # Don't leak accepted connections (or any other descriptor
+                # lacking FD_CLOEXEC) into the new process; they would stay
+                # open after we close them here.
+                keep = sorted(fds + [ready_w])
+                start = 3
+                for fd in keep:
+                    os.closerange(start, fd)
+                    start = fd + 1
+                    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+                    fcntl.fcntl(fd, fcntl.F_SETFD, flags & ~fcntl.FD_CLOEXEC)
+                os.closerange(start, _max_fd())
+                os.execvpe(args[0], args, env)
+            finally:
+                os._exit(1)
+        os.close(ready_w)
+        logging.info("Handing off listening sockets to process %d", pid)
+        if block:
+            ready = _wait_ready(ready_r, ready_timeout)
+            os.close(ready_r)
+            return self._handoff_result(pid, ready)
+        deadline = time.time() + ready_timeout
+        def on_ready(fd, events):
+            self.io_loop.remove_handler(ready_r)
+            self.io_loop.remove_timeout(timeout)
+            ready = _wait_ready(ready_r, 0)
+            os.close(ready_r)
+            if self._handoff_result(pid, ready) is not None:
+                self.drain(drain_timeout, callback)
+        def on_timeout():
+            self.io_loop.remove_handler(ready_r)
+            os.close(ready_r)
+            self._handoff_result(pid, False)
+        self.io_loop.add_handler(ready_r, on_ready, ioloop.IOLoop.READ)
+        timeout = self.io_loop.add_timeout(deadline, on_timeout)
+        return pid
+
+    def _handoff_result(self, pid, ready):
+        if ready:
+            logging.info("Process %d is ready; draining", pid)
+            return pid
+        logging.error("Process %d did not become ready; continuing to "
+                      "serve", pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except OSError:
+            pass
+        return None
+
+    def drain(self, timeout=None, callback=None):
+        """Stops accepting connections and finishes the open ones.
+
+        Idle keep-alive connections are closed immediately, and connections
+        with a request in progress are closed once it finishes.  When all
+        connections are closed, or timeout seconds have passed, callback is
+        run (by default the IOLoop is stopped).
+        """
+        self.stop()
+        self._draining = True
+        self._drain_callback = callback or self.io_loop.stop
+        if timeout is not None:
+            self._drain_timeout = self.io_loop.add_timeout(
+                time.time() + timeout, self._on_drain_timeout)
+        for connection in list(self._connections):
+            connection.no_keep_alive = True
+            if connection._request is None:
+                connection.stream.close()
+        self._check_drained()
+
+    def _on_drain_timeout(self):
+        self._drain_timeout = None
+        logging.warning("Closing %d connections that did not finish "
+                        "draining in time", len(self._connections))
+        for connection in list(self._connections):
+            connection.stream.close()
+        self._check_drained()
+
+    def _check_drained(self):
+        if not self._draining or self._connections:
+            return
+        self._draining = False
+        if self._drain_timeout is not None:
+            self.io_loop.remove_timeout(self._drain_timeout)
+            self._drain_timeout = None
+        callback = self._drain_callback
+        self._drain_callback = None
+        callback()
 
     def stop(self):
-        self.io_loop.remove_handler(self._socket.fileno())
-        self._socket.close()
+        if self._lag_monitor is not None:
+            self._lag_monitor.stop()
+            self._lag_monitor = None
+        for fd, sock in self._sockets.iteritems():
+            self.io_loop.remove_handler(fd)
+            sock.close()
+        self._sockets = {}
+        self._accepting = False
+
+    def overloaded(self):
+        """Returns True if this server is at one of its capacity limits."""
+        if (self.max_connections is not None and
+            len(self._connections) >= self.max_connections):
+            return True
+        if (self.max_requests is not None and
+            self._num_requests >= self.max_requests):
+            return True
+        if (self._lag_monitor is not None and
+            self._lag_monitor.lag > self.max_loop_lag):
+            return True
+        return False
+
+    def _start_accepting(self):
+        if self.max_loop_lag is not None and self._lag_monitor is None:
+            self._lag_monitor = _LoopLagMonitor(
+                self.io_loop, callback=self._maybe_resume_accepting)
+            self._lag_monitor.start()
+        self._accepting = True
+        for fd in self._sockets:
+            self.io_loop.add_handler(fd, self._handle_events,
+                                     ioloop.IOLoop.READ)
+
+    def _stop_accepting(self):
+        self._accepting = False
+        for fd in self._sockets:
+            self.io_loop.remove_handler(fd)
+
+    def _maybe_resume_accepting(self):
+        if (not self._accepting and self._sockets and
+            not self.overloaded()):
+            self._start_accepting()
+
+    def _on_connection_close(self, connection):
+        self._connections.discard(connection)
+        self._maybe_resume_accepting()
+        self._check_drained()
+
+    def _on_request_start(self):
+        self._num_requests += 1
+
+    def _on_request_end(self):
+        self._num_requests -= 1
+        self._maybe_resume_accepting()
 
     def _handle_events(self, fd, events):
+        sock = self._sockets[fd]
         while True:
+            if self.overloaded() and not self.reject_overload:
+                # Leave further connections in the kernel's listen
+                # backlog; we start accepting again once a connection
+                # or request finishes.
+                self._stop_accepting()
+                return
             try:
-                connection, address = self._socket.accept()
+                connection, address = sock.accept()
             except socket.error, e:
                 if e.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN):
                     return
                 raise
+            if sock.family not in (socket.AF_INET, socket.AF_INET6):
+                # Unix domain sockets have no meaningful peer address;
+                # use a placeholder (xheaders can supply the real one).
+                address = ("0.0.0.0", 0)
+            if self.overloaded():
+                _reject_connection(connection,
+                                   plaintext=self.ssl_options is None)
+                continue
             if self.ssl_options is not None:
                 assert ssl, "Python 2.6+ and OpenSSL required for SSL"
                 try:
-                    connection = ssl.wrap_socket(connection,
-                                                 server_side=True,
-                                                 do_handshake_on_connect=False,
-                                                 **self.ssl_options)
+                    if self._ssl_context is not None:
+                        connection = self._ssl_context.wrap_socket(
+                            connection, server_side=True,
+                            do_handshake_on_connect=False)
+                    else:
+                        connection = ssl.wrap_socket(
+                            connection, server_side=True,
+                            do_handshake_on_connect=False,
+                            **self.ssl_options)
                 except ssl.SSLError, err:
                     if err.args[0] == ssl.SSL_ERROR_EOF:
                         return connection.close()
@@ -259,15 +590,271 @@ class HTTPServer(object):
                         raise
             try:
                 if self.ssl_options is not None:
-                    stream = iostream.SSLIOStream(connection, io_loop=self.io_loop)
+                    stream = iostream.SSLIOStream(
+                        connection, io_loop=self.io_loop,
+                        handshake_stats=self.ssl_handshake_stats)
                 else:
                     stream = iostream.IOStream(connection, io_loop=self.io_loop)
-                HTTPConnection(stream, address, self.request_callback,
-                               self.no_keep_alive, self.xheaders)
+                http_connection = HTTPConnection(
+                    stream, address, self.request_callback,
+                    self.no_keep_alive, self.xheaders, server=self)
+                if not stream.closed():
+                    self._connections.add(http_connection)
             except:
                 logging.error("Error in connection callback", exc_info=True)
 
 
+def ssl_options_to_context(ssl_options):
+    """Returns an ssl.SSLContext for the given ssl_options.
+
+    ssl_options may be a dictionary of ssl.wrap_socket() arguments or an
+    SSLContext, which is returned unchanged.  OpenSSL enables the server
+    session cache and session tickets on new contexts by default.
+    """
+    if isinstance(ssl_options, ssl.SSLContext):
+        return ssl_options
+    context = ssl.SSLContext(ssl_options.get("ssl_version",
+                                             ssl.PROTOCOL_SSLv23))
+    if "certfile" in ssl_options:
+        context.load_cert_chain(ssl_options["certfile"],
+                                ssl_options.get("keyfile"))
+    if "cert_reqs" in ssl_options:
+        context.verify_mode = ssl_options["cert_reqs"]
+    if "ca_certs" in ssl_options:
+        context.load_verify_locations(ssl_options["ca_certs"])
+    if "ciphers" in ssl_options:
+        context.set_ciphers(ssl_options["ciphers"])
+    return context
+
+
+def _set_close_exec(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+def bind_sockets(port, address="", family=socket.AF_UNSPEC, backlog=128):
+    """Creates listening sockets bound to the given port and address.
+
+    Returns a list of socket objects, one per address the given address
+    resolves to (for example both an IPv4 and an IPv6 socket when
+    listening on all interfaces of a dual-stack host).  IPv6 sockets are
+    restricted to IPv6 so they do not conflict with their IPv4 twins.
+
+    Binding before HTTPServer.start() forks lets every child process
+    share the same listening sockets.
+    """
+    if not address:
+        address = None
+    if not socket.has_ipv6 and family == socket.AF_UNSPEC:
+        family = socket.AF_INET
+    sockets = []
+    bound = set()
+    for res in socket.getaddrinfo(address, port, family, socket.SOCK_STREAM,
+                                  0, socket.AI_PASSIVE):
+        af, socktype, proto, canonname, sockaddr = res
+        if sockaddr in bound:
+            continue
+        bound.add(sockaddr)
+        sock = socket.socket(af, socktype, proto)
+        _set_close_exec(sock.fileno())
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if af == socket.AF_INET6 and hasattr(socket, "IPPROTO_IPV6"):
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+        sock.setblocking(0)
+        try:
+            sock.bind(sockaddr)
+        except socket.error:
+            sock.close()
+            for s in sockets:
+                s.close()
+            raise
+        sock.listen(backlog)
+        sockets.append(sock)
+    return sockets
+
+
+def bind_unix_socket(path, mode=0600, backlog=128):
+    """Creates a listening Unix domain socket at the given path.
+
+    A stale socket file left behind by a previous process is removed;
+    any other kind of file at that path is an error.  The socket file's
+    permissions are set to mode.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    _set_close_exec(sock.fileno())
+    sock.setblocking(0)
+    try:
+        st = os.stat(path)
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+    else:
+        if stat.S_ISSOCK(st.st_mode):
+            os.remove(path)
+        else:
+            raise ValueError("File %s exists and is not a socket" % path)
+    sock.bind(path)
+    os.chmod(path, mode)
+    sock.listen(backlog)
+    return sock
+
+
+def socket_from_fd(fd):
+    """Returns a socket object for the given listening file descriptor.
+
+    This is used for sockets inherited from a parent process.  The
+    address family is detected from the socket itself.  The returned
+    object owns a duplicate of fd, and the original descriptor is closed.
+    """
+    probe = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        name = probe.getsockname()
+    finally:
+        probe.close()
+    if isinstance(name, str):
+        family = socket.AF_UNIX
+    elif len(name) == 4:
+        family = socket.AF_INET6
+    else:
+        family = socket.AF_INET
+    sock = socket.fromfd(fd, family, socket.SOCK_STREAM)
+    os.close(fd)
+    _set_close_exec(sock.fileno())
+    return sock
+
+
+_HANDOFF_FDS_ENV = "TORNADO_LISTEN_FDS"
+_HANDOFF_READY_ENV = "TORNADO_READY_FD"
+
+def inherited_sockets(environ=None):
+    """Returns the listening sockets passed to us by a parent process.
+
+    This understands sockets handed over by HTTPServer.handoff() as well
+    as the systemd socket activation protocol: if the LISTEN_PID
+    environment variable names this process, LISTEN_FDS sockets are
+    available starting at file descriptor 3.  Returns an empty list if no
+    sockets were passed.
+    """
+    if environ is None:
+        environ = os.environ
+    handoff_fds = environ.pop(_HANDOFF_FDS_ENV, None)
+    if handoff_fds:
+        return [socket_from_fd(int(fd)) for fd in handoff_fds.split(",")]
+    try:
+        if int(environ.get("LISTEN_PID", 0)) != os.getpid():
+            return []
+        count = int(environ.get("LISTEN_FDS", 0))
+    except ValueError:
+        return []
+    return [socket_from_fd(fd) for fd in range(3, 3 + count)]
+
+
+def _notify_ready(close_only=False):
+    """Tells the process that handed off its sockets to us that we are up.
+
+    Pre-fork masters pass close_only=True to give up their copy of the
+    readiness pipe without reporting readiness themselves; their children
+    report it once they are accepting connections.
+    """
+    fd = os.environ.pop(_HANDOFF_READY_ENV, None)
+    if fd is None:
+        return
+    fd = int(fd)
+    try:
+        if not close_only:
+            os.write(fd, "1")
+        os.close(fd)
+    except OSError:
+        pass
+
+
+def _wait_ready(fd, timeout):
+    """Waits up to timeout seconds for a readiness byte on fd.
+
+    Returns False if the pipe was closed without one, which happens when
+    the new process exits before it starts serving.
+    """
+    while True:
+        try:
+            readable = select.select([fd], [], [], timeout)[0]
+            if not readable:
+                return False
+            return bool(os.read(fd, 1))
+        except (select.error, OSError), e:
+            if e.args[0] != errno.EINTR:
+                raise
+
+
+def _max_fd():
+    try:
+        return os.sysconf("SC_OPEN_MAX")
+    except (AttributeError, ValueError):
+        return 1024
+
+
+def _waitpid():
+    """Waits for any child to exit; returns None if interrupted."""
+    try:
+        return os.waitpid(-1, 0)[0]
+    except OSError, e:
+        if e.errno == errno.EINTR:
+            return None
+        raise
+
+
+_OVERLOADED_RESPONSE = ("HTTP/1.1 503 Service Unavailable\r\n"
+                        "Content-Length: 0\r\n"
+                        "Connection: close\r\n\r\n")
+
+def _reject_connection(connection, plaintext=True):
+    """Answers a freshly-accepted connection with a 503 and closes it.
+
+    The response is small enough to fit in an empty socket buffer, so we
+    write it directly instead of setting up an IOStream.  SSL connections
+    are simply closed since answering them would require a full handshake.
+    """
+    if plaintext:
+        try:
+            connection.setblocking(0)
+            connection.send(_OVERLOADED_RESPONSE)
+        except socket.error:
+            pass
+    connection.close()
+
+
+class _LoopLagMonitor(object):
+    """Measures how late the IOLoop runs a periodic timeout.
+
+    The lag attribute rises immediately when a timeout runs late and
+    decays gradually afterwards, so brief recoveries do not end load
+    shedding prematurely.
+    """
+    def __init__(self, io_loop, interval=0.1, callback=None):
+        self.io_loop = io_loop
+        self.interval = interval
+        self.callback = callback
+        self.lag = 0.0
+        self._deadline = None
+        self._timeout = None
+
+    def start(self):
+        self._deadline = time.time() + self.interval
+        self._timeout = self.io_loop.add_timeout(self._deadline, self._run)
+
+    def stop(self):
+        if self._timeout is not None:
+            self.io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+
+    def _run(self):
+        self._timeout = None
+        sample = max(0.0, time.time() - self._deadline)
+        self.lag = max(sample, 0.7 * self.lag + 0.3 * sample)
+        self.start()
+        if self.callback is not None:
+            self.callback()
+
+
 class HTTPConnection(object):
     """Handles a connection to an HTTP client, executing HTTP requests.
 
@@ -275,19 +862,46 @@ class HTTPConnection(object):
     until the HTTP conection is closed.
     """
     def __init__(self, stream, address, request_callback, no_keep_alive=False,
-                 xheaders=False):
+                 xheaders=False, server=None):
         self.stream = stream
         self.address = address
         self.request_callback = request_callback
         self.no_keep_alive = no_keep_alive
         self.xheaders = xheaders
+        self.server = server
         self._request = None
         self._request_finished = False
+        self._request_counted = False
+        self._close_callback = None
         # Save stack context here, outside of any request.  This keeps
         # contexts from one request from leaking into the next.
         self._header_callback = stack_context.wrap(self._on_headers)
+        self.stream.set_close_callback(self._on_connection_close)
         self.stream.read_until("\r\n\r\n", self._header_callback)
 
+    def set_close_callback(self, callback):
+        """Call the given callback when the connection is closed.
+
+        Use this rather than stream.set_close_callback, which is reserved
+        for the connection's own bookkeeping.
+        """
+        self._close_callback = stack_context.wrap(callback)
+
+    def _on_connection_close(self):
+        self._end_request()
+        if self.server is not None:
+            self.server._on_connection_close(self)
+        if self._close_callback is not None:
+            callback = self._close_callback
+            self._close_callback = None
+            callback()
+
+    def _end_request(self):
+        if self._request_counted:
+            self._request_counted = False
+            if self.server is not None:
+                self.server._on_request_end()
+
     def write(self, chunk):
         assert self._request, "Request closed"
         if not self.stream.closed():
@@ -317,6 +931,7 @@ class HTTPConnection(object):
                 disconnect = True
         self._request = None
         self._request_finished = False
+        self._end_request()
         if disconnect:
             self.stream.close()
             return
@@ -329,6 +944,13 @@ class HTTPConnection(object):
         if not version.startswith("HTTP/"):
             raise Exception("Malformed HTTP version in HTTP Request-Line")
         headers = httputil.HTTPHeaders.parse(data[eol:])
+        if (self.server is not None and self.server.max_requests is not None
+            and self.server._num_requests >= self.server.max_requests):
+            self.stream.write(_OVERLOADED_RESPONSE, self.stream.close)
+            return
+        if self.server is not None:
+            self._request_counted = True
+            self.server._on_request_start()
         self._request = HTTPRequest(
             connection=self, method=method, uri=uri, version=version,
             headers=headers, remote_ip=self.address[0])
@@ -18,9 +18,13 @@
 
 from __future__ import with_statement
 
+import collections
 import errno
+import functools
 import logging
+import os
 import socket
+import time
 
 from tornado import ioloop
 from tornado import stack_context
@@ -33,11 +37,12 @@ except ImportError:
 class IOStream(object):
     """A utility class to write to and read from a non-blocking socket.
 
-    We support three methods: write(), read_until(), and read_bytes().
-    All of the methods take callbacks (since writing and reading are
-    non-blocking and asynchronous). read_until() reads the socket until
-    a given delimiter, and read_bytes() reads until a specified number
-    of bytes have been read from the socket.
+    We support four methods: write(), read_until(), read_bytes() and
+    read_until_close().  All of the methods take callbacks (since writing
+    and reading are non-blocking and asynchronous). read_until() reads the
+    socket until a given delimiter, read_bytes() reads until a specified
+    number of bytes have been read from the socket, and read_until_close()
+    reads everything until the other side closes the connection.
 
     The socket parameter may either be connected or unconnected.  For
     server operations the socket is the result of calling socket.accept().
@@ -73,6 +78,8 @@ class IOStream(object):
         stream.connect(("friendfeed.com", 80), send_request)
         ioloop.IOLoop.instance().start()
 
+    If the stream is closed because of a socket error, the exception is
+    available in the error attribute (e.g. from a close callback).
     """
     def __init__(self, socket, io_loop=None, max_buffer_size=104857600,
                  read_chunk_size=4096):
@@ -81,21 +88,26 @@ class IOStream(object):
         self.io_loop = io_loop or ioloop.IOLoop.instance()
         self.max_buffer_size = max_buffer_size
         self.read_chunk_size = read_chunk_size
+        self.error = None
         self._read_buffer = ""
-        self._write_buffer = ""
+        self._write_buffer = collections.deque()
+        self._write_buffer_frozen = False
         self._read_delimiter = None
         self._read_bytes = None
+        self._read_until_close = False
         self._read_callback = None
+        self._streaming_callback = None
         self._write_callback = None
         self._close_callback = None
         self._connect_callback = None
         self._connecting = False
+        self._resolving = False
         self._state = self.io_loop.ERROR
         with stack_context.NullContext():
             self.io_loop.add_handler(
                 self.socket.fileno(), self._handle_events, self._state)
 
-    def connect(self, address, callback=None):
+    def connect(self, address, callback=None, resolver=None):
         """Connects the socket to a remote address without blocking.
 
         May only be called if the socket passed to the constructor was
@@ -104,6 +116,13 @@ class IOStream(object):
         If callback is specified, it will be called when the
         connection is completed.
 
+        socket.connect resolves hostnames with a blocking lookup.  To
+        avoid that, pass one of the resolvers from tornado.netutil as
+        resolver; the stream then connects to the first address it
+        returns for the socket's address family.  If the lookup fails
+        the stream is closed and the exception is stored in its error
+        attribute.
+
         Note that it is safe to call IOStream.write while the
         connection is pending, in which case the data will be written
         as soon as the connection is ready.  Calling IOStream read
@@ -111,6 +130,12 @@ class IOStream(object):
         but is non-portable.
         """
         self._connecting = True
+        if resolver is not None:
+            self._resolving = True
+            resolver.resolve(address[0], address[1],
+                             functools.partial(self._on_resolved, callback),
+                             family=self.socket.family)
+            return
         try:
             self.socket.connect(address)
         except socket.error, e:
@@ -118,13 +143,31 @@ class IOStream(object):
             if e.args[0] not in (errno.EINPROGRESS, errno.EWOULDBLOCK):
                 raise
         self._connect_callback = stack_context.wrap(callback)
+        if self._read_callback is not None:
+            # read_until or read_bytes was called while resolving
+            self._add_io_state(self.io_loop.READ)
         self._add_io_state(self.io_loop.WRITE)
 
+    def _on_resolved(self, callback, addrinfo, error):
+        self._resolving = False
+        if self.socket is None:
+            return
+        if error is not None:
+            logging.warning("Connect error on %d: %s",
+                            self.socket.fileno(), error)
+            self.error = error
+            self.close()
+            return
+        self.connect(addrinfo[0][1], callback)
+
     def read_until(self, delimiter, callback):
         """Call callback when we read the given delimiter."""
         assert not self._read_callback, "Already reading"
         self._read_delimiter = delimiter
         self._read_callback = stack_context.wrap(callback)
+        if self._resolving:
+            # Nothing to read until we know where to connect to
+            return
         while True:
             # See if we've already got the data from a previous read
             if self._read_from_buffer():
@@ -134,14 +177,22 @@ class IOStream(object):
                 break
         self._add_io_state(self.io_loop.READ)
 
-    def read_bytes(self, num_bytes, callback):
-        """Call callback when we read the given number of bytes."""
+    def read_bytes(self, num_bytes, callback, streaming_callback=None):
+        """Call callback when we read the given number of bytes.
+
+        If a streaming_callback is given, it is called with each piece of
+        the data as it arrives (at most one socket read's worth at a
+        time), and callback is called with an empty string at the end.
+        """
         assert not self._read_callback, "Already reading"
         if num_bytes == 0:
             callback("")
             return
         self._read_bytes = num_bytes
         self._read_callback = stack_context.wrap(callback)
+        self._streaming_callback = stack_context.wrap(streaming_callback)
+        if self._resolving:
+            return
         while True:
             if self._read_from_buffer():
                 return
@@ -150,6 +201,24 @@ class IOStream(object):
                 break
         self._add_io_state(self.io_loop.READ)
 
+    def read_until_close(self, callback, streaming_callback=None):
+        """Reads all data from the socket until it is closed.
+
+        callback is called with all the data once the connection is
+        closed.  If a streaming_callback is given, the data is passed to it
+        as it arrives instead, and callback gets an empty string.
+        """
+        assert not self._read_callback, "Already reading"
+        self._read_until_close = True
+        self._read_callback = stack_context.wrap(callback)
+        self._streaming_callback = stack_context.wrap(streaming_callback)
+        if self.closed():
+            self._finish_read_until_close()
+            return
+        if self._resolving:
+            return
+        self._add_io_state(self.io_loop.READ)
+
     def write(self, data, callback=None):
         """Write the given data to this stream.
 
@@ -159,8 +228,12 @@ class IOStream(object):
         callback is simply overwritten with this new callback.
         """
         self._check_closed()
-        self._write_buffer += data
-        self._add_io_state(self.io_loop.WRITE)
+        if data:
+            self._write_buffer.append(data)
+        if not self._resolving:
+            # An unconnected socket is always "writable"; wait for
+            # connect() to register interest.
+            self._add_io_state(self.io_loop.WRITE)
         self._write_callback = stack_context.wrap(callback)
 
     def set_close_callback(self, callback):
@@ -173,6 +246,8 @@ class IOStream(object):
             self.io_loop.remove_handler(self.socket.fileno())
             self.socket.close()
             self.socket = None
+            if self._read_until_close:
+                self._finish_read_until_close()
             if self._close_callback:
                 self._run_callback(self._close_callback)
 
@@ -182,7 +257,7 @@ class IOStream(object):
 
     def writing(self):
         """Returns true if we are currently writing to the stream."""
-        return len(self._write_buffer) > 0
+        return bool(self._write_buffer)
 
     def closed(self):
         return self.socket is None
@@ -199,14 +274,20 @@ class IOStream(object):
             if events & self.io_loop.WRITE:
                 if self._connecting:
                     self._handle_connect()
+                    if not self.socket:
+                        return
                 self._handle_write()
             if not self.socket:
                 return
             if events & self.io_loop.ERROR:
+                err = self.socket.getsockopt(socket.SOL_SOCKET,
+                                             socket.SO_ERROR)
+                if err:
+                    self.error = socket.error(err, os.strerror(err))
                 self.close()
                 return
             state = self.io_loop.ERROR
-            if self._read_delimiter or self._read_bytes:
+            if self.reading():
                 state |= self.io_loop.READ
             if self._write_buffer:
                 state |= self.io_loop.WRITE
@@ -286,6 +367,7 @@ class IOStream(object):
             # ssl.SSLError is a subclass of socket.error
             logging.warning("Read error on %d: %s",
                             self.socket.fileno(), e)
+            self.error = e
             self.close()
             raise
         if chunk is None:
@@ -302,11 +384,19 @@ class IOStream(object):
 
         Returns True if the read was completed.
         """
-        if self._read_bytes:
+        if self._streaming_callback is not None and self._read_buffer:
+            bytes_to_consume = len(self._read_buffer)
+            if self._read_bytes is not None:
+                bytes_to_consume = min(self._read_bytes, bytes_to_consume)
+                self._read_bytes -= bytes_to_consume
+            self._run_callback(self._streaming_callback,
+                               self._consume(bytes_to_consume))
+        if self._read_bytes is not None:
             if len(self._read_buffer) >= self._read_bytes:
                 num_bytes = self._read_bytes
                 callback = self._read_callback
                 self._read_callback = None
+                self._streaming_callback = None
                 self._read_bytes = None
                 self._run_callback(callback, self._consume(num_bytes))
                 return True
@@ -322,6 +412,28 @@ class IOStream(object):
                 return True
         return False
 
+    def _write_to_socket(self, data):
+        """Attempts to write data to the socket.
+
+        Returns the number of bytes written.  A return value of zero means
+        the write must be retried later with exactly the same data.
+        May be overridden in subclasses.
+        """
+        return self.socket.send(data)
+
+    def _finish_read_until_close(self):
+        callback = self._read_callback
+        streaming_callback = self._streaming_callback
+        self._read_callback = None
+        self._streaming_callback = None
+        self._read_until_close = False
+        data = self._consume(len(self._read_buffer))
+        if streaming_callback is not None:
+            if data:
+                self._run_callback(streaming_callback, data)
+            data = ""
+        self._run_callback(callback, data)
+
     def _handle_connect(self):
         if self._connect_callback is not None:
             callback = self._connect_callback
@@ -329,21 +441,34 @@ class IOStream(object):
             self._run_callback(callback)
         self._connecting = False
 
+    # Writes are coalesced into chunks of at most this many bytes.  On
+    # windows, socket.send blows up if given a write buffer that's too
+    # large, instead of just returning the number of bytes it was able
+    # to process.
+    _write_chunk_size = 128 * 1024
+
     def _handle_write(self):
         while self._write_buffer:
             try:
-                # On windows, socket.send blows up if given a write buffer
-                # that's too large, instead of just returning the number
-                # of bytes it was able to process.
-                temp_write_buffer = self._write_buffer[:128 * 1024]
-                num_bytes = self.socket.send(temp_write_buffer)
-                self._write_buffer = self._write_buffer[num_bytes:]
+                if not self._write_buffer_frozen:
+                    _merge_prefix(self._write_buffer, self._write_chunk_size)
+                num_bytes = self._write_to_socket(self._write_buffer[0])
+                if num_bytes == 0:
+                    # The chunk we just tried must be offered again
+                    # unchanged (SSL requires this), so don't merge any
+                    # newly written data into it until it has gone out.
+                    self._write_buffer_frozen = True
+                    break
+                self._write_buffer_frozen = False
+                _merge_prefix(self._write_buffer, num_bytes)
+                self._write_buffer.popleft()
             except socket.error, e:
                 if e.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN):
                     break
                 else:
                     logging.warning("Write error on %d: %s",
                                     self.socket.fileno(), e)
+                    self.error = e
                     self.close()
                     return
         if not self._write_buffer and self._write_callback:
@@ -369,21 +494,83 @@ class IOStream(object):
             self.io_loop.update_handler(self.socket.fileno(), self._state)
 
 
+# Largest amount of plaintext carried by a single TLS record.
+_SSL_MAX_RECORD_SIZE = 16 * 1024
+
+
+class SSLHandshakeStats(object):
+    """Aggregate statistics about the SSL handshakes of a set of streams.
+
+    Pass an instance as the handshake_stats argument of SSLIOStream;
+    HTTPServer keeps one in its ssl_handshake_stats attribute.  If the
+    streams' sockets come from an ssl.SSLContext, pass it as context to
+    get OpenSSL's session cache counters from session_stats() and
+    resumption_ratio().
+    """
+    def __init__(self, context=None):
+        self.handshakes = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.context = context
+
+    def record(self, duration):
+        self.handshakes += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+
+    def average_time(self):
+        """Returns the mean handshake duration in seconds, or None."""
+        if not self.handshakes:
+            return None
+        return self.total_time / self.handshakes
+
+    def session_stats(self):
+        """Returns the context's session cache counters, or None.
+
+        The dictionary comes from ssl.SSLContext.session_stats(); its
+        "accept" key counts the server handshakes started and "hits" the
+        sessions resumed from the cache.
+        """
+        if self.context is None:
+            return None
+        return self.context.session_stats()
+
+    def resumption_ratio(self):
+        """Returns the fraction of handshakes that resumed a session.
+
+        None without a context or before the first handshake.
+        """
+        stats = self.session_stats()
+        if not stats or not stats["accept"]:
+            return None
+        return float(stats["hits"]) / stats["accept"]
+
+
 class SSLIOStream(IOStream):
     """A utility class to write to and read from a non-blocking socket.
 
     If the socket passed to the constructor is already connected,
     it should be wrapped with
         ssl.wrap_socket(sock, do_handshake_on_connect=False, **kwargs)
+    (or the wrap_socket method of an ssl.SSLContext)
     before constructing the SSLIOStream.  Unconnected sockets will be
     wrapped when IOStream.connect is finished.
+
+    Once the handshake completes, handshake_time holds its duration in
+    seconds.  If a SSLHandshakeStats object
+    is given as handshake_stats, the handshake is also recorded there.
     """
     def __init__(self, *args, **kwargs):
+        self.handshake_stats = kwargs.pop("handshake_stats", None)
         super(SSLIOStream, self).__init__(*args, **kwargs)
         self._ssl_accepting = True
+        self._handshake_start = None
+        self.handshake_time = None
 
     def _do_ssl_handshake(self):
         # Based on code from test_ssl.py in the python stdlib
+        if self._handshake_start is None:
+            self._handshake_start = time.time()
         try:
             self.socket.do_handshake()
         except ssl.SSLError, err:
@@ -405,17 +592,30 @@ class SSLIOStream(IOStream):
                 return self.close()
         else:
             self._ssl_accepting = False
+            self.handshake_time = time.time() - self._handshake_start
+            if self.handshake_stats is not None:
+                self.handshake_stats.record(self.handshake_time)
+
+    # Write at most one full TLS record (16KB of plaintext) per call so
+    # that small writes are coalesced into full-sized records and large
+    # ones are not copied more than necessary.
+    _write_chunk_size = _SSL_MAX_RECORD_SIZE
 
     def _handle_read(self):
         if self._ssl_accepting:
             self._do_ssl_handshake()
-            return
+            if self._ssl_accepting or self.socket is None:
+                return
+            # The final handshake message may have arrived together with
+            # application data; fall through and read it now instead of
+            # waiting for another trip through the IOLoop.
         super(SSLIOStream, self)._handle_read()
 
     def _handle_write(self):
         if self._ssl_accepting:
             self._do_ssl_handshake()
-            return
+            if self._ssl_accepting or self.socket is None:
+                return
         super(SSLIOStream, self)._handle_write()
 
     def _handle_connect(self):
@@ -432,7 +632,15 @@ class SSLIOStream(IOStream):
             # The recv() method blocks (at least in python 2.6) if it is
             # called when there is nothing to read, so we have to use
             # read() instead.
-            chunk = self.socket.read(self.read_chunk_size)
+            # Ask for at least a full TLS record so that a record is
+            # decrypted with a single call, then drain whatever OpenSSL
+            # still has buffered (select() can't see that data).
+            chunk = self.socket.read(max(self.read_chunk_size,
+                                         _SSL_MAX_RECORD_SIZE))
+            if chunk:
+                pending = self.socket.pending()
+                if pending:
+                    chunk += self.socket.read(pending)
         except ssl.SSLError, e:
             # SSLError is a subclass of socket.error, so this except
             # block must come first.
@@ -449,3 +657,42 @@ class SSLIOStream(IOStream):
             self.close()
             return None
         return chunk
+
+
+def _merge_prefix(deque, size):
+    """Replace the first entries in a deque of strings with a single
+    string of up to size bytes.
+
+    >>> d = collections.deque(['abc', 'de', 'fghi', 'j'])
+    >>> _merge_prefix(d, 5); print d
+    deque(['abcde', 'fghi', 'j'])
+
+    Strings will be split as necessary to reach the desired size.
+    >>> _merge_prefix(d, 7); print d
+    deque(['abcdefg', 'hi', 'j'])
+
+    >>> _merge_prefix(d, 3); print d
+    deque(['abc', 'defg', 'hi', 'j'])
+
+    >>> _merge_prefix(d, 100); print d
+    deque(['abcdefghij'])
+    """
+    if len(deque) == 1 and len(deque[0]) <= size:
+        return
+    prefix = []
+    remaining = size
+    while deque and remaining > 0:
+        chunk = deque.popleft()
+        if len(chunk) > remaining:
+            deque.appendleft(chunk[remaining:])
+            chunk = chunk[:remaining]
+        prefix.append(chunk)
+        remaining -= len(chunk)
+    if prefix:
+        deque.appendleft(''.join(prefix))
+    if not deque:
+        deque.appendleft("")
+
+def doctests():
+    import doctest
+    return doctest.DocTestSuite()
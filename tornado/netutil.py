@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Facebook
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Non-blocking hostname resolution.
+
+socket.getaddrinfo blocks, and calling it on the IOLoop thread stalls
+every other connection for as long as the DNS server takes to answer.
+The resolvers in this module deliver their results to a callback
+instead.  All of them have the same interface:
+
+    resolver.resolve(host, port, callback, family=socket.AF_UNSPEC)
+
+callback is run with two arguments, (addrinfo, error).  On success
+addrinfo is a non-empty list of (family, sockaddr) pairs in the order
+returned by getaddrinfo and error is None; on failure addrinfo is None
+and error is the exception raised by the lookup.  The callback may be
+run before resolve() returns if the answer is already known.
+
+A typical resolver for a long-running process:
+
+    resolver = CachingResolver(ThreadedResolver(io_loop), ttl=60)
+
+and for tests that need to point real hostnames at a local server:
+
+    resolver = OverrideResolver(resolver, {"api.example.com": "127.0.0.1"})
+"""
+
+from __future__ import with_statement
+
+import functools
+import logging
+import Queue
+import socket
+import threading
+import time
+
+from tornado import ioloop
+from tornado import stack_context
+
+
+class Resolver(object):
+    """Resolves hostnames with a blocking call to socket.getaddrinfo.
+
+    This is the base class for the other resolvers, and is only suitable
+    for hosts that are known to resolve instantly (IP addresses, or names
+    in /etc/hosts).  Subclasses override resolve() and close().
+    """
+    def resolve(self, host, port, callback, family=socket.AF_UNSPEC):
+        try:
+            addrinfo = _getaddrinfo(host, port, family)
+        except Exception, e:
+            callback(None, e)
+            return
+        callback(addrinfo, None)
+
+    def close(self):
+        """Releases any resources (e.g. threads) held by the resolver."""
+        pass
+
+
+class ThreadedResolver(Resolver):
+    """Runs getaddrinfo on a pool of up to num_threads worker threads.
+
+    Threads are started as they are needed and results are delivered on
+    the IOLoop thread with IOLoop.add_callback.  IP address literals are
+    resolved immediately without involving the pool.
+    """
+    def __init__(self, io_loop=None, num_threads=10):
+        self.io_loop = io_loop or ioloop.IOLoop.instance()
+        self.num_threads = num_threads
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._idle_threads = 0
+
+    def resolve(self, host, port, callback, family=socket.AF_UNSPEC):
+        if _is_ip_literal(host):
+            return Resolver.resolve(self, host, port, callback, family)
+        callback = stack_context.wrap(callback)
+        with self._lock:
+            if (self._idle_threads <= 0 and
+                len(self._threads) < self.num_threads):
+                thread = threading.Thread(target=self._worker,
+                                          args=(self._queue,))
+                thread.setDaemon(True)
+                self._threads.append(thread)
+                self._idle_threads += 1
+                thread.start()
+            self._idle_threads -= 1
+            self._queue.put((host, port, family, callback))
+
+    def close(self):
+        """Stops the worker threads without waiting for them.
+
+        Lookups in progress still run their callbacks.  The resolver can
+        be used again afterwards; new threads are started as needed.
+        """
+        with self._lock:
+            queue, self._queue = self._queue, Queue.Queue()
+            threads, self._threads = self._threads, []
+            self._idle_threads = 0
+        for thread in threads:
+            queue.put(None)
+
+    def _worker(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            host, port, family, callback = item
+            try:
+                result = (_getaddrinfo(host, port, family), None)
+            except Exception, e:
+                result = (None, e)
+            with self._lock:
+                # Threads of a closed pool no longer count
+                if queue is self._queue:
+                    self._idle_threads += 1
+            self.io_loop.add_callback(functools.partial(callback, *result))
+
+
+class CachingResolver(Resolver):
+    """Caches the answers of another resolver for ttl seconds.
+
+    getaddrinfo does not expose the TTL of the underlying DNS records, so
+    all answers are kept for the same configurable time; keep ttl below
+    the shortest record TTL you rely on.  Failed lookups are not cached.
+    Concurrent lookups of the same name share a single query.  At most
+    max_entries answers are kept.
+    """
+    def __init__(self, resolver, ttl=60.0, max_entries=1000):
+        self.resolver = resolver
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # (host, port, family) -> (expiry time, addrinfo)
+        self._cache = {}
+        # (host, port, family) -> list of callbacks waiting for a lookup
+        self._pending = {}
+
+    def resolve(self, host, port, callback, family=socket.AF_UNSPEC):
+        key = (host, port, family)
+        entry = self._cache.get(key)
+        if entry is not None:
+            expires, addrinfo = entry
+            if expires > time.time():
+                callback(addrinfo, None)
+                return
+            del self._cache[key]
+        if key in self._pending:
+            self._pending[key].append(stack_context.wrap(callback))
+            return
+        self._pending[key] = [stack_context.wrap(callback)]
+        with stack_context.NullContext():
+            self.resolver.resolve(host, port,
+                                  functools.partial(self._on_resolved, key),
+                                  family=family)
+
+    def close(self):
+        self._cache.clear()
+        self.resolver.close()
+
+    def _on_resolved(self, key, addrinfo, error):
+        if error is None and self.ttl > 0:
+            if len(self._cache) >= self.max_entries:
+                self._evict()
+            self._cache[key] = (time.time() + self.ttl, addrinfo)
+        for callback in self._pending.pop(key, []):
+            try:
+                callback(addrinfo, error)
+            except Exception:
+                logging.error("Exception in resolver callback",
+                              exc_info=True)
+
+    def _evict(self):
+        now = time.time()
+        for key, (expires, addrinfo) in self._cache.items():
+            if expires <= now:
+                del self._cache[key]
+        while len(self._cache) >= self.max_entries:
+            self._cache.popitem()
+
+
+class OverrideResolver(Resolver):
+    """Answers some lookups from a static mapping, like /etc/hosts.
+
+    mapping maps either a hostname to the address that should be used
+    instead, or a (host, port) pair to an (address, port) pair.  Names
+    that are not in the mapping are passed on to resolver.
+    """
+    def __init__(self, resolver, mapping):
+        self.resolver = resolver
+        self.mapping = mapping
+
+    def resolve(self, host, port, callback, family=socket.AF_UNSPEC):
+        if (host, port) in self.mapping:
+            host, port = self.mapping[(host, port)]
+        elif host in self.mapping:
+            host = self.mapping[host]
+        self.resolver.resolve(host, port, callback, family=family)
+
+    def close(self):
+        self.resolver.close()
+
+
+def _getaddrinfo(host, port, family):
+    addrinfo = []
+    for af, socktype, proto, canonname, sockaddr in socket.getaddrinfo(
+        host, port, family, socket.SOCK_STREAM):
+        addrinfo.append((af, sockaddr))
+    if not addrinfo:
+        raise socket.gaierror(socket.EAI_NONAME, "No addresses for %s" % host)
+    return addrinfo
+
+
+def _is_ip_literal(host):
+    for af in (socket.AF_INET, getattr(socket, "AF_INET6", None)):
+        if af is None:
+            continue
+        try:
+            socket.inet_pton(af, host)
+            return True
+        except (socket.error, ValueError, TypeError):
+            pass
+    return False
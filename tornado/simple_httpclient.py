@@ -3,17 +3,22 @@ from __future__ import with_statement
 
 from cStringIO import StringIO
 from tornado.httpclient import HTTPRequest, HTTPResponse, HTTPError
+from tornado.httpclient import _BatchFetch, _Fetch, _HostScheduler
+from tornado.httpclient import _IDEMPOTENT_METHODS, _copy_response
+from tornado.httpclient import _hedge_delay, _record_latency
+from tornado.httpclient import _request_host, _run_response_hook
 from tornado.httputil import HTTPHeaders
 from tornado.ioloop import IOLoop
 from tornado.iostream import IOStream, SSLIOStream
+from tornado.netutil import CachingResolver, OverrideResolver, ThreadedResolver
 from tornado import stack_context
 
-import collections
 import contextlib
 import errno
 import functools
 import logging
 import re
+import select
 import socket
 import time
 import urlparse
@@ -39,8 +44,28 @@ class SimpleAsyncHTTPClient(object):
     Many features found in the curl-based AsyncHTTPClient are not yet
     implemented.  The currently-supported set of parameters to HTTPRequest
     are url, method, headers, body, streaming_callback, and header_callback.
-    Connections are not reused, and no attempt is made to limit the number
-    of outstanding requests.
+
+    Keep-alive connections are pooled per (scheme, host, port) and reused
+    by later requests to the same server.  At most max_idle_connections
+    idle connections are kept in total, and at most max_idle_per_host for
+    any one server; idle connections are closed after idle_timeout
+    seconds.  If a reused connection turns out to have been closed by the
+    server before any response arrived, idempotent requests are retried
+    once on a new connection.
+
+    Hostnames are resolved without blocking the IOLoop (see
+    tornado.netutil); by default lookups run on a small thread pool and
+    are cached for a minute.
+
+    The per-phase timeouts described in HTTPRequest (dns_timeout and
+    first_byte_timeout) are only implemented here.  Retries, hedging and
+    total_timeout work as in the curl-based client; hedging uses the
+    response times of the last few requests to each host.
+
+    Responses carry the same time_info keys as the curl-based client,
+    and response_hook works the same way (see AsyncHTTPClient).  Every
+    attempt, including retries and hedged requests, is passed to the
+    hook.
 
     Python 2.6 or higher is required for HTTPS support.  Users of Python 2.5
     should use the curl-based AsyncHTTPClient if HTTPS support is required.
@@ -49,7 +74,11 @@ class SimpleAsyncHTTPClient(object):
 
     def __new__(cls, io_loop=None, max_clients=10,
                 max_simultaneous_connections=None,
-                force_instance=False):
+                force_instance=False, max_clients_per_host=None,
+                max_idle_connections=10,
+                max_idle_per_host=4, idle_timeout=60.0, resolver=None,
+                hostname_mapping=None, single_flight=False,
+                response_hook=None):
         """Creates a SimpleAsyncHTTPClient.
 
         Only a single SimpleAsyncHTTPClient instance exists per IOLoop
@@ -58,9 +87,24 @@ class SimpleAsyncHTTPClient(object):
 
         max_clients is the number of concurrent requests that can be in
         progress.  max_simultaneous_connections has no effect and is accepted
-        only for compatibility with the curl-based AsyncHTTPClient.  Note
-        that these arguments are only used when the client is first created,
-        and will be ignored when an existing client is reused.
+        only for compatibility with the curl-based AsyncHTTPClient.
+        max_clients_per_host limits the requests in progress to any one
+        host:port; queued requests are started round-robin across hosts,
+        and per-host counters are kept in the host_stats dictionary (see
+        httpclient.HostStats).
+        max_idle_connections, max_idle_per_host and idle_timeout control
+        the keep-alive connection pool; max_idle_connections=0 disables
+        connection reuse.  resolver is a tornado.netutil resolver used
+        for hostname lookups, and hostname_mapping a dict of static
+        overrides for it (see netutil.OverrideResolver), which is mainly
+        useful in tests.  With single_flight=True, a GET that is
+        identical to one already in flight (same url, headers and
+        credentials, and no streaming or header callback) does not start
+        a new request; it waits for the first one and receives a copy of
+        its response, including any error or timeout.  Note that these
+        arguments are only used when
+        the client is first created, and will be ignored when an existing
+        client is reused.
         """
         io_loop = io_loop or IOLoop.instance()
         if io_loop in cls._ASYNC_CLIENTS and not force_instance:
@@ -69,14 +113,38 @@ class SimpleAsyncHTTPClient(object):
             instance = super(SimpleAsyncHTTPClient, cls).__new__(cls)
             instance.io_loop = io_loop
             instance.max_clients = max_clients
-            instance.queue = collections.deque()
+            instance.queue = _HostScheduler(max_clients_per_host)
+            instance.host_stats = instance.queue.stats
+            instance.response_hook = response_hook
             instance.active = {}
+            instance._pool = _StreamPool(io_loop, max_idle_connections,
+                                         max_idle_per_host, idle_timeout)
+            if resolver is None:
+                resolver = CachingResolver(ThreadedResolver(io_loop))
+            if hostname_mapping is not None:
+                resolver = OverrideResolver(resolver, hostname_mapping)
+            instance.resolver = resolver
+            instance.single_flight = single_flight
+            # coalescing key -> list of (request, callback) waiting on it
+            instance._in_flight = {}
+            # host -> deque of recent response times, for hedging
+            instance._latencies = {}
             if not force_instance:
                 cls._ASYNC_CLIENTS[io_loop] = instance
             return instance
 
     def close(self):
-        pass
+        """Closes all idle pooled connections.
+
+        Requests that are still in progress are not affected.  Like
+        AsyncHTTPClient.close, this also removes the client from the
+        per-IOLoop cache so a later SimpleAsyncHTTPClient() creates a
+        fresh instance.
+        """
+        self._pool.close()
+        self.resolver.close()
+        if self._ASYNC_CLIENTS.get(self.io_loop) is self:
+            del self._ASYNC_CLIENTS[self.io_loop]
 
     def fetch(self, request, callback, **kwargs):
         if not isinstance(request, HTTPRequest):
@@ -84,44 +152,226 @@ class SimpleAsyncHTTPClient(object):
         if not isinstance(request.headers, HTTPHeaders):
             request.headers = HTTPHeaders(request.headers)
         callback = stack_context.wrap(callback)
-        self.queue.append((request, callback))
-        self._process_queue()
+        if self.single_flight:
+            key = _single_flight_key(request)
+            if key is not None:
+                if key in self._in_flight:
+                    self._in_flight[key].append((request, callback))
+                    return
+                self._in_flight[key] = []
+                callback = functools.partial(self._on_shared_response,
+                                             key, callback)
+        _Fetch(self, _request_host(request.url), request, callback).start()
         if self.queue:
             logging.debug("max_clients limit reached, request queued. "
                           "%d active, %d queued requests." % (
                     len(self.active), len(self.queue)))
 
+    def fetch_all(self, requests, callback, max_concurrency=None,
+                  timeout=None):
+        """Executes a list of requests; see AsyncHTTPClient.fetch_all."""
+        _BatchFetch(self, requests, callback, max_concurrency,
+                    timeout).start()
+
+    def _enqueue(self, host, request, callback, attempt):
+        self.queue.add(host, (request, callback, attempt))
+        self._process_queue()
+
     def _process_queue(self):
         with stack_context.NullContext():
             while self.queue and len(self.active) < self.max_clients:
-                request, callback = self.queue.popleft()
+                next = self.queue.pop()
+                if next is None:
+                    # Everything queued is for hosts at their limit
+                    break
+                host, (request, callback, attempt) = next
+                if attempt.cancelled:
+                    self.queue.finish(host)
+                    continue
                 key = object()
                 self.active[key] = (request, callback)
-                _HTTPConnection(self.io_loop, request,
-                                functools.partial(self._on_fetch_complete,
-                                                  key, callback))
+                attempt.connection = _HTTPConnection(
+                    self.io_loop, self, request,
+                    functools.partial(self._on_fetch_complete,
+                                      key, host, callback))
 
-    def _on_fetch_complete(self, key, callback, response):
+    def _on_fetch_complete(self, key, host, callback, response):
         del self.active[key]
+        self.queue.finish(host)
+        _run_response_hook(self.response_hook, host, response)
         callback(response)
         self._process_queue()
 
+    def _on_shared_response(self, key, callback, response):
+        waiters = self._in_flight.pop(key)
+        try:
+            callback(response)
+        finally:
+            for request, callback in waiters:
+                try:
+                    callback(_copy_response(response, request))
+                except Exception:
+                    logging.error("Exception in HTTP callback",
+                                  exc_info=True)
+
+    def _record_latency(self, host, latency):
+        _record_latency(self._latencies, host, latency)
+
+    def _hedge_delay(self, host, request):
+        """Returns how long to wait before hedging request, or None."""
+        return _hedge_delay(self._latencies, host, request)
+
+
+def _file_producer(file, chunk_size=64 * 1024):
+    """Returns a body producer that sends the contents of file."""
+    def produce(write, finish):
+        def send_next():
+            data = file.read(chunk_size)
+            if data:
+                write(data, send_next)
+            else:
+                finish()
+        send_next()
+    return produce
+
+
+def _single_flight_key(request):
+    """Returns the key under which request may share a fetch, or None."""
+    if (request.method != "GET" or request.body is not None or
+        request.streaming_callback is not None or
+        request.header_callback is not None):
+        return None
+    return (request.url, tuple(sorted(request.headers.get_all())),
+            request.auth_username, request.auth_password,
+            request.follow_redirects, request.max_redirects,
+            request.use_gzip)
+
+
+class _StreamPool(object):
+    """Idle keep-alive IOStreams, keyed by (scheme, host, port).
+
+    Streams are handed out most-recently-used first.  A stream is only
+    reused if it is still open and has nothing to read: a readable idle
+    connection has either been closed by the server or received data we
+    did not ask for, and is discarded either way.
+    """
+    def __init__(self, io_loop, max_idle=10, max_idle_per_host=4,
+                 idle_timeout=60.0):
+        self.io_loop = io_loop
+        self.max_idle = max_idle
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        # key -> list of (stream, timeout handle), oldest first
+        self._idle = {}
+        self._count = 0
+
+    def get(self, key):
+        """Returns an idle stream for key, or None."""
+        entries = self._idle.get(key)
+        while entries:
+            stream, timeout = entries[-1]
+            self._remove(key, stream)
+            if self._usable(stream):
+                stream.set_close_callback(None)
+                return stream
+            stream.close()
+        return None
+
+    def put(self, key, stream):
+        """Adds a stream that has finished a request to the pool.
+
+        The stream is closed instead if the pool is full.
+        """
+        if stream.closed():
+            return
+        entries = self._idle.get(key, [])
+        if (self.max_idle_per_host is not None and
+            len(entries) >= self.max_idle_per_host):
+            if not entries:
+                stream.close()
+                return
+            oldest = entries[0][0]
+            self._remove(key, oldest)
+            oldest.close()
+        if self._count >= self.max_idle:
+            stream.close()
+            return
+        timeout = None
+        # Idle streams no longer belong to the request that used them
+        with stack_context.NullContext():
+            if self.idle_timeout:
+                timeout = self.io_loop.add_timeout(
+                    time.time() + self.idle_timeout,
+                    functools.partial(self._on_idle_timeout, key, stream))
+            stream.set_close_callback(
+                functools.partial(self._remove, key, stream))
+        self._idle.setdefault(key, []).append((stream, timeout))
+        self._count += 1
+
+    def close(self):
+        """Closes all idle streams."""
+        for key, entries in self._idle.items():
+            for stream, timeout in list(entries):
+                self._remove(key, stream)
+                stream.close()
+
+    def _usable(self, stream):
+        if stream.closed():
+            return False
+        try:
+            readable, _, _ = select.select([stream.socket.fileno()], [], [], 0)
+        except (select.error, socket.error):
+            return False
+        return not readable
+
+    def _on_idle_timeout(self, key, stream):
+        for s, timeout in self._idle.get(key, []):
+            if s is stream:
+                self._remove(key, stream, cancel_timeout=False)
+                stream.close()
+                return
+
+    def _remove(self, key, stream, cancel_timeout=True):
+        entries = self._idle.get(key, [])
+        for i, (s, timeout) in enumerate(entries):
+            if s is stream:
+                del entries[i]
+                self._count -= 1
+                if timeout is not None and cancel_timeout:
+                    self.io_loop.remove_timeout(timeout)
+                if not entries:
+                    del self._idle[key]
+                return
 
 
 class _HTTPConnection(object):
     _SUPPORTED_METHODS = set(["GET", "HEAD", "POST", "PUT", "DELETE"])
+    # Requests that may safely be sent again if a reused connection
+    # turns out to have been closed by the server.
+    _IDEMPOTENT_METHODS = _IDEMPOTENT_METHODS
 
-    def __init__(self, io_loop, request, callback):
+    def __init__(self, io_loop, client, request, callback):
         self.start_time = time.time()
         self.io_loop = io_loop
+        self.client = client
         self.request = request
         self.callback = callback
         self.code = None
         self.headers = None
         self.chunks = None
         self._decompressor = None
+        self._keep_alive = False
+        self._reused = False
+        self._chunked_body = False
+        # False while a body_producer is still sending the body
+        self._body_done = True
         # Timeout handle returned by IOLoop.add_timeout
         self._timeout = None
+        # Timeout for the DNS lookup or the wait for the first byte
+        self._phase_timeout = None
+        # Seconds from start_time to the end of each phase, named as in
+        # libcurl's timing info
+        self.time_info = {"queue": self.start_time - request.start_time}
         with stack_context.StackContext(self.cleanup):
             parsed = urlparse.urlsplit(self.request.url)
             if ":" in parsed.netloc:
@@ -130,33 +380,115 @@ class _HTTPConnection(object):
             else:
                 host = parsed.netloc
                 port = 443 if parsed.scheme == "https" else 80
+            self._parsed = parsed
+            self._pool_key = (parsed.scheme, host, port)
 
-            if parsed.scheme == "https":
-                # TODO: cert verification, etc
-                self.stream = SSLIOStream(socket.socket(),
-                                          io_loop=self.io_loop)
+            self.stream = self.client._pool.get(self._pool_key)
+            stats = self.client.host_stats[_request_host(request.url)]
+            if self.stream is not None:
+                stats.pool_hits += 1
+                self.time_info.update(namelookup=0.0, connect=0.0)
+                self._reused = True
+                self.stream.set_close_callback(self._on_close)
+                self._on_connect(parsed)
             else:
-                self.stream = IOStream(socket.socket(),
-                                       io_loop=self.io_loop)
-            timeout = min(request.connect_timeout, request.request_timeout)
-            if timeout:
-                self._connect_timeout = self.io_loop.add_timeout(
-                    self.start_time + timeout,
-                    self._on_timeout)
-            self.stream.connect((host, port),
-                                functools.partial(self._on_connect, parsed))
+                stats.pool_misses += 1
+                self._connect()
+
+    def _connect(self):
+        scheme, host, port = self._pool_key
+        self.stream = None
+        # The connect timeout covers the DNS lookup as well
+        timeout = min(self.request.connect_timeout,
+                      self.request.request_timeout)
+        if timeout:
+            self._timeout = self.io_loop.add_timeout(
+                self.start_time + timeout,
+                self._on_timeout)
+        if self.request.dns_timeout:
+            self._set_phase_timeout(self.request.dns_timeout, "DNS timeout")
+        self.client.resolver.resolve(host, port, self._on_resolved)
+
+    def _on_resolved(self, addrinfo, error):
+        if self.callback is None:
+            # Timed out while waiting for the lookup
+            return
+        self._clear_phase_timeout()
+        self.time_info["namelookup"] = time.time() - self.start_time
+        if error is not None:
+            raise error
+        af, sockaddr = addrinfo[0]
+        if self._pool_key[0] == "https":
+            # TODO: cert verification, etc
+            self.stream = SSLIOStream(socket.socket(af),
+                                      io_loop=self.io_loop)
+        else:
+            self.stream = IOStream(socket.socket(af),
+                                   io_loop=self.io_loop)
+        self.stream.set_close_callback(self._on_close)
+        self.stream.connect(sockaddr,
+                            functools.partial(self._on_connect, self._parsed))
+
+    def _set_phase_timeout(self, timeout, message):
+        self._phase_timeout = self.io_loop.add_timeout(
+            time.time() + timeout,
+            functools.partial(self._on_phase_timeout, message))
+
+    def _clear_phase_timeout(self):
+        if self._phase_timeout is not None:
+            self.io_loop.remove_timeout(self._phase_timeout)
+            self._phase_timeout = None
 
     def _on_timeout(self):
         self._timeout = None
-        self.stream.close()
-        if self.callback is not None:
-            self.callback(HTTPResponse(self.request, 599,
-                                       error=HTTPError(599, "Timeout")))
-            self.callback = None
+        self.cancel(HTTPError(599, "Timeout"))
+
+    def _on_phase_timeout(self, message):
+        self._phase_timeout = None
+        self.cancel(HTTPError(599, message))
+
+    def cancel(self, error=None):
+        """Abandons the request, answering it with a 599 response."""
+        if self.callback is None:
+            return
+        if self._timeout is not None:
+            self.io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+        self._clear_phase_timeout()
+        callback = self.callback
+        self.callback = None
+        callback(self._response(599, error=error or
+                                HTTPError(599, "Cancelled")))
+        if self.stream is not None:
+            self.stream.close()
+
+    def _on_close(self):
+        if self.callback is None:
+            return
+        if self._timeout is not None:
+            self.io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+        self._clear_phase_timeout()
+        if (self._reused and self.code is None and
+            self.request.method in self._IDEMPOTENT_METHODS and
+            self.request.body_producer is None):
+            # The server gave up on the idle connection just as we
+            # reused it; try again on a fresh one.
+            logging.debug("reused connection to %s closed, retrying",
+                          self._parsed.netloc)
+            self._reused = False
+            del self.time_info["namelookup"], self.time_info["connect"]
+            self._connect()
+            return
+        callback = self.callback
+        self.callback = None
+        callback(self._response(599, error=(
+                    self.stream.error or HTTPError(599, "Connection closed"))))
 
     def _on_connect(self, parsed):
+        self.time_info.setdefault("connect", time.time() - self.start_time)
         if self._timeout is not None:
-            self.io_loop.remove_callback(self._timeout)
+            self.io_loop.remove_timeout(self._timeout)
             self._timeout = None
         if self.request.request_timeout:
             self._timeout = self.io_loop.add_timeout(
@@ -178,12 +510,19 @@ class _HTTPConnection(object):
         if self.request.user_agent:
             self.request.headers["User-Agent"] = self.request.user_agent
         has_body = self.request.method in ("POST", "PUT")
-        if has_body:
+        if has_body and self.request.body_producer is not None:
+            assert self.request.body is None
+            self._chunked_body = ("Content-Length" not in
+                                  self.request.headers)
+            if self._chunked_body:
+                self.request.headers["Transfer-Encoding"] = "chunked"
+        elif has_body:
             assert self.request.body is not None
             self.request.headers["Content-Length"] = len(
                 self.request.body)
         else:
             assert self.request.body is None
+            assert self.request.body_producer is None
         if (self.request.method == "POST" and
             "Content-Type" not in self.request.headers):
             self.request.headers["Content-Type"] = "application/x-www-form-urlencoded"
@@ -196,9 +535,44 @@ class _HTTPConnection(object):
         for k, v in self.request.headers.get_all():
             request_lines.append("%s: %s" % (k, v))
         self.stream.write("\r\n".join(request_lines) + "\r\n\r\n")
+        # Start reading at once so that a server that answers before
+        # the body is complete (e.g. with a 413) is heard.
+        self.stream.read_until("\r\n\r\n", self._on_headers)
+        if has_body and self.request.body_producer is not None:
+            self._body_done = False
+            producer = self.request.body_producer
+            if hasattr(producer, "read"):
+                producer = _file_producer(producer)
+            producer(self._write_body, self._finish_body)
+            return
         if has_body:
             self.stream.write(self.request.body)
-        self.stream.read_until("\r\n\r\n", self._on_headers)
+        self._finish_body()
+
+    def _write_body(self, data, callback=None):
+        if self.callback is None or self.stream.closed():
+            # The request is already over; drop the rest of the body
+            return
+        if not data:
+            # Nothing to send (and in chunked encoding an empty chunk
+            # would end the body); IOStream would never call back.
+            if callback is not None:
+                self.io_loop.add_callback(callback)
+            return
+        if self._chunked_body:
+            data = "%x\r\n%s\r\n" % (len(data), data)
+        self.stream.write(data, callback)
+
+    def _finish_body(self):
+        if self.callback is None or self.stream.closed():
+            return
+        if self.request.body_producer is not None:
+            if self._chunked_body:
+                self.stream.write("0\r\n\r\n")
+            self._body_done = True
+        if self.request.first_byte_timeout:
+            self._set_phase_timeout(self.request.first_byte_timeout,
+                                    "First byte timeout")
 
     @contextlib.contextmanager
     def cleanup(self):
@@ -206,16 +580,40 @@ class _HTTPConnection(object):
             yield
         except Exception, e:
             logging.warning("uncaught exception", exc_info=True)
+            self._clear_phase_timeout()
             if self.callback is not None:
-                self.callback(HTTPResponse(self.request, 599, error=e))
+                callback = self.callback
                 self.callback = None
+                callback(self._response(599, error=e))
+            if getattr(self, "stream", None) is not None:
+                # The connection is in an unknown state; never reuse it
+                self.stream.close()
 
     def _on_headers(self, data):
+        self._clear_phase_timeout()
+        self.time_info["starttransfer"] = time.time() - self.start_time
+        # The request is written as soon as the connection (and, for
+        # SSL, the handshake) is complete.
+        handshake_time = getattr(self.stream, "handshake_time", None)
+        if handshake_time is not None and not self._reused:
+            self.time_info["appconnect"] = (self.time_info["connect"] +
+                                            handshake_time)
+        else:
+            self.time_info["appconnect"] = 0.0
+        self.time_info["pretransfer"] = max(self.time_info["connect"],
+                                            self.time_info["appconnect"])
         first_line, _, header_data = data.partition("\r\n")
-        match = re.match("HTTP/1.[01] ([0-9]+) .*", first_line)
+        match = re.match("HTTP/1.([01]) ([0-9]+) .*", first_line)
         assert match
-        self.code = int(match.group(1))
+        self.code = int(match.group(2))
         self.headers = HTTPHeaders.parse(header_data)
+        connection_header = self.headers.get("Connection", "").lower()
+        if match.group(1) == "1":
+            self._keep_alive = connection_header != "close"
+        else:
+            self._keep_alive = connection_header == "keep-alive"
+        if self.request.headers.get("Connection", "").lower() == "close":
+            self._keep_alive = False
         if self.request.header_callback is not None:
             for k, v in self.headers.get_all():
                 self.request.header_callback("%s: %s\r\n" % (k, v))
@@ -224,34 +622,69 @@ class _HTTPConnection(object):
             # Magic parameter makes zlib module understand gzip header
             # http://stackoverflow.com/questions/1838699/how-can-i-decompress-a-gzip-stream-with-zlib
             self._decompressor = zlib.decompressobj(16+zlib.MAX_WBITS)
-        if self.headers.get("Transfer-Encoding") == "chunked":
+        if (self.request.method == "HEAD" or self.code in (204, 304) or
+            100 <= self.code < 200):
+            # These responses never have a body, whatever the headers say
+            self._on_body("")
+        elif self.headers.get("Transfer-Encoding") == "chunked":
             self.chunks = []
             self.stream.read_until("\r\n", self._on_chunk_length)
         elif "Content-Length" in self.headers:
-            self.stream.read_bytes(int(self.headers["Content-Length"]),
-                                   self._on_body)
+            length = int(self.headers["Content-Length"])
+            if self.request.streaming_callback is not None:
+                self.stream.read_bytes(
+                    length, self._on_body,
+                    streaming_callback=self._on_streaming_data)
+            else:
+                self.stream.read_bytes(length, self._on_body)
         else:
-            raise Exception("No Content-length or chunked encoding, "
-                            "don't know how to read %s", self.request.url)
+            # No framing, so the body runs until the server closes the
+            # connection.
+            self._keep_alive = False
+            if self.request.streaming_callback is not None:
+                self.stream.read_until_close(
+                    self._on_body, streaming_callback=self._on_streaming_data)
+            else:
+                self.stream.read_until_close(self._on_body)
+
+    def _on_streaming_data(self, data):
+        if self._decompressor:
+            data = self._decompressor.decompress(data)
+        if data:
+            self.request.streaming_callback(data)
 
     def _on_body(self, data):
         if self._timeout is not None:
             self.io_loop.remove_timeout(self._timeout)
             self._timeout = None
-        if self._decompressor:
-            data = self._decompressor.decompress(data)
-        if self.request.streaming_callback:
-            if self.chunks is None:
-                # if chunks is not None, we already called streaming_callback
-                # in _on_chunk_data
-                self.request.streaming_callback(data)
+        if self.request.streaming_callback is not None:
+            # The body has already been passed to streaming_callback
+            # piece by piece as it arrived.
             buffer = StringIO()
         else:
-            buffer = StringIO(data) # TODO: don't require one big string?
-        response = HTTPResponse(self.request, self.code, headers=self.headers,
-                                buffer=buffer)
-        self.callback(response)
+            if self._decompressor:
+                data = self._decompressor.decompress(data)
+            buffer = StringIO(data)
+        response = self._response(self.code, headers=self.headers,
+                                  buffer=buffer)
+        callback = self.callback
         self.callback = None
+        self._release_stream()
+        callback(response)
+
+    def _response(self, code, **kwargs):
+        request_time = time.time() - self.start_time
+        self.time_info["total"] = request_time
+        return HTTPResponse(self.request, code, request_time=request_time,
+                            time_info=self.time_info, **kwargs)
+
+    def _release_stream(self):
+        """Returns the stream to the pool if it can carry another request."""
+        if (self._keep_alive and self._body_done and
+            not self.stream.closed()):
+            self.client._pool.put(self._pool_key, self.stream)
+        else:
+            self.stream.close()
 
     def _on_chunk_length(self, data):
         # TODO: "chunk extensions" http://tools.ietf.org/html/rfc2616#section-3.6.1
@@ -260,20 +693,37 @@ class _HTTPConnection(object):
             # all the data has been decompressed, so we don't need to
             # decompress again in _on_body
             self._decompressor = None
-            self._on_body(''.join(self.chunks))
+            # Consume the (usually empty) trailer so the connection is
+            # positioned at the start of the next response.
+            self.stream.read_until("\r\n", self._on_trailer_line)
+        elif self.request.streaming_callback is not None:
+            # Pass large chunks on as they arrive instead of buffering
+            # each one whole.
+            self.stream.read_bytes(length, self._on_chunk_streamed,
+                                   streaming_callback=self._on_streaming_data)
         else:
             self.stream.read_bytes(length + 2,  # chunk ends with \r\n
                               self._on_chunk_data)
 
+    def _on_trailer_line(self, data):
+        if data == "\r\n":
+            self._on_body(''.join(self.chunks))
+        else:
+            self.stream.read_until("\r\n", self._on_trailer_line)
+
     def _on_chunk_data(self, data):
         assert data[-2:] == "\r\n"
         chunk = data[:-2]
         if self._decompressor:
             chunk = self._decompressor.decompress(chunk)
-        if self.request.streaming_callback is not None:
-            self.request.streaming_callback(chunk)
-        else:
-            self.chunks.append(chunk)
+        self.chunks.append(chunk)
+        self.stream.read_until("\r\n", self._on_chunk_length)
+
+    def _on_chunk_streamed(self, data):
+        self.stream.read_bytes(2, self._on_chunk_end)
+
+    def _on_chunk_end(self, data):
+        assert data == "\r\n"
         self.stream.read_until("\r\n", self._on_chunk_length)
 
 
@@ -77,16 +77,45 @@ functions in to your template just like any other variable:
 
 We provide the functions escape(), url_escape(), json_encode(), and squeeze()
 to all templates by default.
+
+Parts of a page that are expensive to generate and rarely change can be
+kept in a FragmentCache with the cache block.  It takes a key expression
+and optionally a time to live in seconds given as ttl=<expression>, and
+its body is only run again once the fragment for that key has expired or
+been evicted:
+
+   {% cache "sidebar-" + user.name ttl=60 %}
+     {% for item in expensive_query() %}<li>{{ escape(item) }}</li>{% end %}
+   {% end %}
+
+Fragments are shared by all generations of the template, so the key must
+include everything the output depends on.
+
+Large pages can be streamed with stream() instead of generate(); the output
+is then passed to a callback in pieces, before and after each top-level
+{% block %} or {% include %}:
+
+   t.stream(handler.write, myvalue="XXX")
 """
 
 from __future__ import with_statement
 
+import __builtin__
 import cStringIO
 import datetime
+import errno
+import hashlib
+import imp
 import logging
+import marshal
+import os
 import os.path
 import re
+import tempfile
+import time
+import types
 
+import tornado
 from tornado import escape
 
 class Template(object):
@@ -96,34 +125,49 @@ class Template(object):
     the template from variables with generate().
     """
     def __init__(self, template_string, name="<string>", loader=None,
-                 compress_whitespace=None):
+                 compress_whitespace=None, cached=None):
+        """Parses and compiles template_string.
+
+        cached may be a (code, compiled) pair previously taken from the
+        code and compiled attributes of a Template with the same source
+        (see BytecodeCache); parsing and compiling are then skipped.
+
+        {% cache %} blocks store their output in the fragment_cache of the
+        loader, or in a FragmentCache of this template without a loader.
+        """
         self.name = name
+        self._template_string = template_string
+        self._file = None
+        self.fragment_cache = getattr(loader, "fragment_cache", None)
+        if self.fragment_cache is None:
+            self.fragment_cache = FragmentCache()
         if compress_whitespace is None:
             compress_whitespace = name.endswith(".html") or \
                 name.endswith(".js")
-        reader = _TemplateReader(name, template_string)
-        self.file = _File(_parse(reader))
-        self.code = self._generate_python(loader, compress_whitespace)
-        try:
-            self.compiled = compile(self.code, self.name, "exec")
-        except:
-            formatted_code = _format_code(self.code).rstrip()
-            logging.error("%s code:\n%s", self.name, formatted_code)
-            raise
+        if cached is not None:
+            self.code, self.compiled = cached
+        else:
+            self.code = self._generate_python(loader, compress_whitespace)
+            try:
+                self.compiled = compile(self.code, self.name, "exec")
+            except:
+                formatted_code = _format_code(self.code).rstrip()
+                logging.error("%s code:\n%s", self.name, formatted_code)
+                raise
+        # The compiled module only defines _execute.  Run it once and keep
+        # the function's code; each call to generate() then only has to
+        # bind that code to a namespace holding the template arguments.
+        namespace = {}
+        exec self.compiled in namespace
+        self._execute_code = namespace["_execute"].func_code
 
     def generate(self, **kwargs):
         """Generate this template with the given arguments."""
-        namespace = {
-            "escape": escape.xhtml_escape,
-            "xhtml_escape": escape.xhtml_escape,
-            "url_escape": escape.url_escape,
-            "json_encode": escape.json_encode,
-            "squeeze": escape.squeeze,
-            "datetime": datetime,
-        }
+        namespace = _DEFAULT_NAMESPACE.copy()
+        namespace["_fragment_cache"] = self.fragment_cache
         namespace.update(kwargs)
-        exec self.compiled in namespace
-        execute = namespace["_execute"]
+        execute = types.FunctionType(self._execute_code, namespace,
+                                     "_execute")
         try:
             return execute()
         except:
@@ -131,6 +175,33 @@ class Template(object):
             logging.error("%s code:\n%s", self.name, formatted_code)
             raise
 
+    def stream(self, callback, **kwargs):
+        """Generate this template, passing the output to callback in pieces.
+
+        callback is called with the output so far before and after each
+        top-level {% block %} or {% include %} (except where only text
+        lies between two of these points), and once more with the rest of
+        the output, so the beginning of a page can be sent before the rest
+        has been generated.
+        """
+        def flush(buffer):
+            if buffer:
+                callback("".join(buffer))
+                del buffer[:]
+        rest = self.generate(_flush=flush, **kwargs)
+        if rest:
+            callback(rest)
+
+    def _get_file(self):
+        # Only needed to compile this template or one that extends or
+        # includes it, so templates from a BytecodeCache are parsed lazily
+        if self._file is None:
+            reader = _TemplateReader(self.name, self._template_string)
+            self._file = _File(_parse(reader))
+        return self._file
+
+    file = property(_get_file)
+
     def _generate_python(self, loader, compress_whitespace):
         buffer = cStringIO.StringIO()
         try:
@@ -159,19 +230,68 @@ class Template(object):
         return ancestors
 
 
+# Names available to every template
+_DEFAULT_NAMESPACE = {
+    # exec would add this, but FunctionType does not
+    "__builtins__": __builtin__,
+    "escape": escape.xhtml_escape,
+    "xhtml_escape": escape.xhtml_escape,
+    "url_escape": escape.url_escape,
+    "json_encode": escape.json_encode,
+    "squeeze": escape.squeeze,
+    "datetime": datetime,
+    # Called at the points where stream() passes on the output
+    "_flush": lambda buffer: None,
+}
+
+
 class Loader(object):
     """A template loader that loads from a single root directory.
 
     You must use a template loader to use template constructs like
     {% extends %} and {% include %}. Loader caches all templates after
     they are loaded the first time.
+
+    If a BytecodeCache is given, compiled templates are also stored
+    there and reused by later processes.
+
+    The output of {% cache %} blocks is stored in fragment_cache, which
+    may be any object with the get(), set() and clear() methods of
+    FragmentCache; by default each Loader has its own FragmentCache.
+    Fragments are cleared when templates are reset or reloaded.
+
+    If check_interval is not None, a cached template is reloaded when its
+    file, or a template it extends or includes, has been modified.  The
+    files of each template are checked at most once every check_interval
+    seconds (0 checks on every load), and only the templates affected by
+    a change are recompiled.
     """
-    def __init__(self, root_directory):
+    def __init__(self, root_directory, bytecode_cache=None,
+                 check_interval=None, fragment_cache=None):
         self.root = os.path.abspath(root_directory)
         self.templates = {}
+        self.bytecode_cache = bytecode_cache
+        self.check_interval = check_interval
+        if fragment_cache is None:
+            fragment_cache = FragmentCache()
+        self.fragment_cache = fragment_cache
+        # One set per template being compiled, collecting the names of
+        # the templates its code depends on
+        self._dependencies = []
+        # name -> file signature taken just before the file was read
+        self._signatures = {}
+        # name -> list of (path, signature) for the template's own file
+        # and those of its dependencies
+        self._sources = {}
+        # name -> time the template's files were last checked
+        self._checked = {}
 
     def reset(self):
+        self.fragment_cache.clear()
         self.templates = {}
+        self._signatures = {}
+        self._sources = {}
+        self._checked = {}
 
     def resolve_path(self, name, parent_path=None):
         if parent_path and not parent_path.startswith("<") and \
@@ -186,13 +306,242 @@ class Loader(object):
 
     def load(self, name, parent_path=None):
         name = self.resolve_path(name, parent_path=parent_path)
+        for dependencies in self._dependencies:
+            dependencies.add(name)
+        if name in self.templates and self.check_interval is not None:
+            self._check_modified(name)
         if name not in self.templates:
-            path = os.path.join(self.root, name)
-            f = open(path, "r")
-            self.templates[name] = Template(f.read(), name=name, loader=self)
-            f.close()
+            self.templates[name] = self._create_template(name)
+            self._checked[name] = time.time()
         return self.templates[name]
 
+    def precompile(self, extensions=None):
+        """Loads and compiles every template under the root directory.
+
+        Call this at startup (before forking, so that child processes
+        share the compiled templates) to move compilation, and any
+        template errors, out of the first requests.  Hidden files and
+        directories are skipped; if extensions is given, only files
+        ending with one of them are loaded.  Returns the names of the
+        loaded templates.
+        """
+        names = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            for filename in sorted(filenames):
+                if filename.startswith("."):
+                    continue
+                if extensions and not filename.endswith(tuple(extensions)):
+                    continue
+                path = os.path.join(dirpath, filename)
+                name = path[len(self.root) + 1:].replace(os.path.sep, "/")
+                try:
+                    self.load(name)
+                except Exception:
+                    logging.error("Could not compile template %s", name)
+                    raise
+                names.append(name)
+        return names
+
+    def _check_modified(self, name):
+        now = time.time()
+        if now - self._checked.get(name, 0) < self.check_interval:
+            return
+        self._checked[name] = now
+        changed = set(path for path, signature in self._sources.get(name, ())
+                      if _file_signature(path) != signature)
+        if not changed:
+            return
+        self.fragment_cache.clear()
+        # Drop every loaded template built from a changed file, so that
+        # e.g. a changed base template is not reused from memory when the
+        # templates extending it are recompiled.
+        for other, sources in self._sources.items():
+            if changed.intersection(path for path, signature in sources):
+                logging.info("Reloading modified template %s", other)
+                self.templates.pop(other, None)
+                del self._sources[other]
+
+    def _create_template(self, name):
+        path = os.path.join(self.root, name)
+        self._signatures[name] = _file_signature(path)
+        f = open(path, "r")
+        try:
+            template_string = f.read()
+        finally:
+            f.close()
+        if self.bytecode_cache is not None:
+            entry = self.bytecode_cache.get(path)
+            if entry is not None:
+                self._sources[name], code, compiled = entry
+                return Template(template_string, name=name, loader=self,
+                                cached=(code, compiled))
+        dependencies = set([name])
+        self._dependencies.append(dependencies)
+        try:
+            template = Template(template_string, name=name, loader=self)
+        finally:
+            self._dependencies.pop()
+        self._sources[name] = [
+            (os.path.join(self.root, n), self._signatures.get(n))
+            for n in dependencies]
+        if self.bytecode_cache is not None:
+            self.bytecode_cache.set(path, self._sources[name],
+                                    template.code, template.compiled)
+        return template
+
+
+class BytecodeCache(object):
+    """Keeps compiled templates in a directory shared between processes.
+
+    Parsing and compiling a large template tree can add seconds to the
+    start of every process.  With a BytecodeCache, a Loader only does
+    that work for templates that changed since some process last
+    compiled them, and otherwise loads the marshalled code.
+
+    Entries are keyed by the template's path, the template engine
+    version and the Python bytecode version.  They record the
+    modification time and size of the template and of every template it
+    extends or includes, and are ignored if any of those have changed.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        try:
+            os.makedirs(directory)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def get(self, path):
+        """Returns the entry cached for path, or None.
+
+        Entries are (signatures, code, compiled) tuples with the same
+        meaning as the arguments to set().
+        """
+        try:
+            f = open(self._filename(path), "rb")
+            try:
+                entry = marshal.load(f)
+            finally:
+                f.close()
+            signatures, code, compiled = entry
+        except (IOError, EOFError, ValueError, TypeError):
+            return None
+        for dependency, signature in signatures:
+            if _file_signature(dependency) != signature:
+                return None
+        return signatures, code, compiled
+
+    def set(self, path, signatures, code, compiled):
+        """Caches the code compiled from path.
+
+        signatures lists a (path, (mtime, size)) pair for the template and
+        each of its dependencies, taken before they were read.
+        """
+        data = marshal.dumps((signatures, code, compiled))
+        # Write to a temporary file and rename it into place so that other
+        # processes never see a partial entry.
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            os.rename(temp_path, self._filename(path))
+        except (IOError, OSError):
+            logging.warning("Could not cache compiled template %s", path,
+                            exc_info=True)
+
+    def _filename(self, path):
+        key = "%s\0%s\0%s\0%s" % (os.path.abspath(path), tornado.version,
+                                  _ENGINE_VERSION, imp.get_magic())
+        return os.path.join(self.directory,
+                            hashlib.sha1(key).hexdigest() + ".tmplc")
+
+
+class FragmentCache(object):
+    """An in-process cache for the output of {% cache %} blocks.
+
+    Fragments expire after the time to live given in the template, and
+    the least recently used ones are dropped once the cached output
+    exceeds max_bytes.
+
+    Other caches (for example one shared between processes) can be given
+    to Loader instead, as long as they have the same get(), set() and
+    clear() methods.
+    """
+    def __init__(self, max_bytes=10 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        # key -> [prev, next, key, value, expires]
+        self._map = {}
+        self._root = root = []
+        root[:] = [root, root, None, None, None]
+
+    def __len__(self):
+        return len(self._map)
+
+    def get(self, key):
+        """Returns the fragment stored for key, or None."""
+        link = self._map.get(key)
+        if link is None:
+            return None
+        if link[4] is not None and link[4] <= time.time():
+            self._remove(link)
+            return None
+        self._unlink(link)
+        self._append(link)
+        return link[3]
+
+    def set(self, key, value, ttl=None):
+        """Stores value for key, for ttl seconds or until evicted."""
+        link = self._map.get(key)
+        if link is not None:
+            self._remove(link)
+        if len(value) > self.max_bytes:
+            return
+        while self.size + len(value) > self.max_bytes:
+            self._remove(self._root[1])
+        if ttl is not None:
+            ttl += time.time()
+        link = [None, None, key, value, ttl]
+        self._map[key] = link
+        self._append(link)
+        self.size += len(value)
+
+    def clear(self):
+        self.__init__(self.max_bytes)
+
+    def _remove(self, link):
+        del self._map[link[2]]
+        self._unlink(link)
+        self.size -= len(link[3])
+
+    def _append(self, link):
+        root = self._root
+        last = root[0]
+        link[0] = last
+        link[1] = root
+        last[1] = root[0] = link
+
+    def _unlink(self, link):
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+
+
+# Increase when the code generated for templates changes, so that
+# BytecodeCache entries written by older versions are ignored.
+_ENGINE_VERSION = 4
+
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
 
 class _Node(object):
     def each_child(self):
@@ -213,9 +562,9 @@ class _File(_Node):
     def generate(self, writer):
         writer.write_line("def _execute():")
         with writer.indent():
-            writer.write_line("_buffer = []")
+            writer.write_buffer()
             self.body.generate(writer)
-            writer.write_line("return ''.join(_buffer)")
+            writer.write_return()
 
     def each_child(self):
         return (self.body,)
@@ -243,7 +592,9 @@ class _NamedBlock(_Node):
         return (self.body,)
 
     def generate(self, writer):
+        writer.write_flush()
         writer.named_blocks[self.name].generate(writer)
+        writer.write_flush()
 
     def find_named_blocks(self, loader, named_blocks):
         named_blocks[self.name] = self.body
@@ -266,10 +617,12 @@ class _IncludeBlock(_Node):
 
     def generate(self, writer):
         included = writer.loader.load(self.name, self.template_name)
+        writer.write_flush()
         old = writer.current_template
         writer.current_template = included
         included.file.body.generate(writer)
         writer.current_template = old
+        writer.write_flush()
 
 
 class _ApplyBlock(_Node):
@@ -285,11 +638,39 @@ class _ApplyBlock(_Node):
         writer.apply_counter += 1
         writer.write_line("def %s():" % method_name)
         with writer.indent():
-            writer.write_line("_buffer = []")
+            writer.write_buffer()
             self.body.generate(writer)
-            writer.write_line("return ''.join(_buffer)")
-        writer.write_line("_buffer.append(%s(%s()))" % (
-            self.method, method_name))
+            writer.write_return()
+        writer.write_line("_append(%s(%s()))" % (self.method, method_name))
+
+
+class _CacheBlock(_Node):
+    def __init__(self, key, ttl, block_id, body=None):
+        self.key = key
+        self.ttl = ttl
+        # Fragments of different blocks never share keys
+        self.block_id = block_id
+        self.body = body
+
+    def each_child(self):
+        return (self.body,)
+
+    def generate(self, writer):
+        method_name = "cache%d" % writer.apply_counter
+        writer.apply_counter += 1
+        writer.write_line("_cache_key = (%r, %s)" % (self.block_id, self.key))
+        writer.write_line("_tmp = _fragment_cache.get(_cache_key)")
+        writer.write_line("if _tmp is None:")
+        with writer.indent():
+            writer.write_line("def %s():" % method_name)
+            with writer.indent():
+                writer.write_buffer()
+                self.body.generate(writer)
+                writer.write_return()
+            writer.write_line("_tmp = %s()" % method_name)
+            writer.write_line("_fragment_cache.set(_cache_key, _tmp, %s)" %
+                              self.ttl)
+        writer.write_line("_append(_tmp)")
 
 
 class _ControlBlock(_Node):
@@ -327,11 +708,34 @@ class _Expression(_Node):
         self.expression = expression
 
     def generate(self, writer):
+        value = self._constant_value()
+        if value is not None:
+            writer.write_text(value)
+            return
         writer.write_line("_tmp = %s" % self.expression)
-        writer.write_line("if isinstance(_tmp, str): _buffer.append(_tmp)")
+        writer.write_line("if isinstance(_tmp, str): _append(_tmp)")
         writer.write_line("elif isinstance(_tmp, unicode): "
-                          "_buffer.append(_tmp.encode('utf-8'))")
-        writer.write_line("else: _buffer.append(str(_tmp))")
+                          "_append(_tmp.encode('utf-8'))")
+        writer.write_line("else: _append(str(_tmp))")
+
+    def _constant_value(self):
+        # Expressions of literals alone, like {{ "&nbsp;" * 4 }}, are
+        # rendered once here and emitted as text
+        try:
+            code = compile(self.expression, "<string>", "eval")
+        except SyntaxError:
+            return None
+        if code.co_names:
+            return None
+        try:
+            value = eval(code, {"__builtins__": {}})
+        except Exception:
+            return None
+        if not isinstance(value, _CONSTANT_TYPES):
+            return None
+        if isinstance(value, unicode):
+            return value.encode("utf-8")
+        return str(value)
 
 
 class _Text(_Node):
@@ -349,7 +753,7 @@ class _Text(_Node):
             value = re.sub(r"(\s*\n\s*)", "\n", value)
 
         if value:
-            writer.write_line('_buffer.append(%r)' % value)
+            writer.write_text(value)
 
 
 class ParseError(Exception):
@@ -367,6 +771,12 @@ class _CodeWriter(object):
         self.compress_whitespace = compress_whitespace
         self.apply_counter = 0
         self._indent = 0
+        # Text not written yet, so that adjacent text (across comments,
+        # blocks and includes) is appended with a single call
+        self._text = []
+        self._text_indent = 0
+        # Index in _text of a flush point not written yet
+        self._flush_at = None
 
     def indent(self):
         return self
@@ -382,9 +792,55 @@ class _CodeWriter(object):
         assert self._indent > 0
         self._indent -= 1
 
+    def write_buffer(self):
+        self.write_line("_buffer = []")
+        self.write_line("_append = _buffer.append")
+
+    def write_return(self):
+        # stream() passes on whatever is left, so a flush point followed
+        # only by text is not needed
+        self._flush_at = None
+        self.write_line("return ''.join(_buffer)")
+
+    def write_text(self, value):
+        if self._text and self._text_indent != self._indent:
+            self._write_pending()
+        self._text.append(value)
+        self._text_indent = self._indent
+
+    def write_flush(self):
+        # Only flush at the top level of _execute: not once per loop
+        # iteration, and never from the buffer of an {% apply %} function.
+        # The flush is written when code follows, so that flush points
+        # with only text between them do not split the text; the last of
+        # them is used.
+        if self._indent == 1:
+            if self._text and self._text_indent != self._indent:
+                self._write_pending()
+            self._flush_at = len(self._text)
+
+    def _write_pending(self):
+        text, self._text = self._text, []
+        flush_at, self._flush_at = self._flush_at, None
+        if flush_at is None:
+            self._write_append(text)
+        else:
+            self._write_append(text[:flush_at])
+            self._write("_flush(_buffer)", 1)
+            self._write_append(text[flush_at:])
+
+    def _write_append(self, text):
+        if text:
+            self._write("_append(%r)" % "".join(text), self._text_indent)
+
     def write_line(self, line, indent=None):
+        if self._text or self._flush_at is not None:
+            self._write_pending()
         if indent == None:
             indent = self._indent
+        self._write(line, indent)
+
+    def _write(self, line, indent):
         for i in xrange(indent):
             self.file.write("    ")
         print >> self.file, line
@@ -449,6 +905,18 @@ def _format_code(code):
     return "".join([format % (i + 1, line) for (i, line) in enumerate(lines)])
 
 
+_CONSTANT_TYPES = (basestring, int, long, float, bool, type(None))
+_TTL_RE = re.compile(r"^(.*\S)\s+ttl=(.+)$")
+
+
+def _is_expression(code):
+    try:
+        compile(code, "<string>", "eval")
+    except SyntaxError:
+        return False
+    return True
+
+
 def _parse(reader, in_block=None):
     body = _ChunkList([])
     while True:
@@ -557,8 +1025,10 @@ def _parse(reader, in_block=None):
             body.chunks.append(block)
             continue
 
-        elif operator in ("apply", "block", "try", "if", "for", "while"):
+        elif operator in ("apply", "block", "cache", "try", "if", "for",
+                          "while"):
             # parse inner body recursively
+            start = reader.pos
             block_body = _parse(reader, operator)
             if operator == "apply":
                 if not suffix:
@@ -568,6 +1038,19 @@ def _parse(reader, in_block=None):
                 if not suffix:
                     raise ParseError("block missing name on line %d" % line)
                 block = _NamedBlock(suffix, block_body)
+            elif operator == "cache":
+                if not suffix:
+                    raise ParseError("cache missing key on line %d" % line)
+                key, ttl = suffix, None
+                # "key ttl=expr", unless that only splits a single
+                # expression such as f(x, ttl=1)
+                match = _TTL_RE.match(suffix)
+                if match and _is_expression(match.group(1)) and \
+                        _is_expression(match.group(2)):
+                    key, ttl = match.groups()
+                # The position of the tag tells apart blocks on one line
+                block_id = "%s:%d:%d" % (reader.name, line, start)
+                block = _CacheBlock(key, ttl, block_id, block_body)
             else:
                 block = _ControlBlock(contents, block_body)
             body.chunks.append(block)
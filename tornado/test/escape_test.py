@@ -125,3 +125,75 @@ class EscapeTestCase(unittest.TestCase):
             linked = tornado.escape.linkify(text, **kwargs)
             self.assertEqual(linked, html)
 
+
+    def test_xhtml_escape(self):
+        tests = [
+            ("<foo>", "&lt;foo&gt;"),
+            (u"<foo>", u"&lt;foo&gt;"),
+            ('"a" & b', "&quot;a&quot; &amp; b"),
+            ("&amp;", "&amp;amp;"),
+            # & is escaped first, so entities are not unescaped by accident
+            ("&lt;", "&amp;lt;"),
+            ("&lt;" * 60, "&amp;lt;" * 60),
+            (u"\xe9l\xe8ve", u"\xe9l\xe8ve"),
+            ("", ""),
+            ("<a & b>" * 50, "&lt;a &amp; b&gt;" * 50),
+            ]
+        for unescaped, escaped in tests:
+            result = tornado.escape.xhtml_escape(unescaped)
+            self.assertEqual(result, escaped)
+            self.assertEqual(type(result), type(escaped))
+            self.assertEqual(tornado.escape.xhtml_unescape(escaped),
+                             unescaped)
+
+    def test_json_encode(self):
+        value = {"a": u"</script>", "b": [1, 2.5, None, "</"] * 10}
+        encoded = tornado.escape.json_encode(value)
+        self.assertTrue("</" not in encoded)
+        self.assertEqual(tornado.escape.json_decode(encoded), value)
+        chunks = list(tornado.escape.json_encode_chunks(value, chunk_size=16))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual("".join(chunks), encoded)
+
+    def test_json_encode_output(self):
+        value = {"</k": [u"</\xe9", "a/b", 1.5, float("inf"), None, True]}
+        encoded = ('{"<\\/k": ["<\\/\\u00e9", "a/b", 1.5, Infinity, '
+                   'null, true]}')
+        self.assertEqual(tornado.escape.json_encode(value), encoded)
+        self.assertEqual("".join(tornado.escape.json_encode_chunks(value)),
+                         encoded)
+        self.assertEqual(tornado.escape.json_encode("</script>"),
+                         '"<\\/script>"')
+
+    def test_json_chunks_split_escape(self):
+        saved = (tornado.escape._json_encode, tornado.escape._json_decode,
+                 tornado.escape._json_iterencode,
+                 tornado.escape._json_escapes_slashes)
+        tornado.escape.set_json_backend(
+            saved[0], saved[1], lambda value: iter(['["a<', '/b", "<', '/"]']))
+        try:
+            chunks = list(tornado.escape.json_encode_chunks(None,
+                                                            chunk_size=1))
+            self.assertEqual("".join(chunks), '["a<\\/b", "<\\/"]')
+            self.assertEqual(len(chunks), 3)
+        finally:
+            tornado.escape.set_json_backend(*saved)
+
+    def test_json_backend(self):
+        calls = []
+        def encode(value):
+            calls.append(value)
+            return '"<\\/"'
+        saved = (tornado.escape._json_encode, tornado.escape._json_decode,
+                 tornado.escape._json_iterencode,
+                 tornado.escape._json_escapes_slashes)
+        tornado.escape.set_json_backend(encode, lambda s: "decoded",
+                                        escapes_slashes=True)
+        try:
+            self.assertEqual(tornado.escape.json_encode("</"), '"<\\/"')
+            self.assertEqual(list(tornado.escape.json_encode_chunks("</")),
+                             ['"<\\/"'])
+            self.assertEqual(tornado.escape.json_decode("x"), "decoded")
+            self.assertEqual(calls, ["</", "</"])
+        finally:
+            tornado.escape.set_json_backend(*saved)
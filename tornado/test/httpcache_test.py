@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+from __future__ import with_statement
+
+import shutil
+import tempfile
+
+from tornado.httpcache import CachingHTTPClient, _LRUCache
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+from tornado.testing import AsyncHTTPTestCase, LogTrapTestCase
+from tornado.web import Application, RequestHandler, asynchronous
+
+class CountingHandler(RequestHandler):
+    def initialize(self, counts, cache_control=None, vary=None):
+        self.counts = counts
+        self.cache_control = cache_control
+        self.vary = vary
+
+    def get(self):
+        self.counts[self.request.path] = self.counts.get(self.request.path, 0) + 1
+        if self.cache_control is not None:
+            self.set_header("Cache-Control", self.cache_control)
+        if self.vary is not None:
+            self.set_header("Vary", self.vary)
+        # RequestHandler adds an Etag and answers If-None-Match with 304
+        self.finish("%s %s" % (self.request.path,
+                               self.request.headers.get("Accept", "")))
+
+    def post(self):
+        self.finish("posted")
+
+class SlowHandler(RequestHandler):
+    def initialize(self, counts, pending, wake):
+        self.counts = counts
+        self.pending = pending
+        self.wake = wake
+
+    @asynchronous
+    def get(self):
+        self.counts["/slow"] = self.counts.get("/slow", 0) + 1
+        self.set_header("Cache-Control", "max-age=60")
+        self.pending.append(lambda: self.finish("slow"))
+        self.wake()
+
+class CachingHTTPClientTest(AsyncHTTPTestCase, LogTrapTestCase):
+    def get_app(self):
+        self.counts = {}
+        self.pending = []
+        c = dict(counts=self.counts)
+        return Application([
+                ("/fresh", CountingHandler, dict(c, cache_control="max-age=60")),
+                ("/revalidate", CountingHandler, dict(c, cache_control="no-cache")),
+                ("/no-store", CountingHandler, dict(c, cache_control="no-store, max-age=60")),
+                ("/vary", CountingHandler, dict(c, cache_control="max-age=60",
+                                                vary="Accept")),
+                ("/slow", SlowHandler, dict(c, pending=self.pending,
+                                            wake=self.stop)),
+                ])
+
+    def setUp(self):
+        super(CachingHTTPClientTest, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.client = SimpleAsyncHTTPClient(self.io_loop, force_instance=True)
+        self.cache = CachingHTTPClient(self.client)
+
+    def tearDown(self):
+        self.client.close()
+        shutil.rmtree(self.cache_dir)
+        super(CachingHTTPClientTest, self).tearDown()
+
+    def cached_fetch(self, path, cache=None, **kwargs):
+        (cache or self.cache).fetch(self.get_url(path), self.stop, **kwargs)
+        return self.wait()
+
+    def test_fresh_response(self):
+        for i in range(3):
+            response = self.cached_fetch("/fresh")
+            self.assertEqual(response.code, 200)
+            self.assertEqual(response.body, "/fresh ")
+        self.assertEqual(self.counts["/fresh"], 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+        # Request directives can bypass the stored copy
+        self.cached_fetch("/fresh", headers={"Cache-Control": "max-age=0"})
+        self.assertEqual(self.counts["/fresh"], 2)
+
+    def test_revalidation(self):
+        for i in range(3):
+            response = self.cached_fetch("/revalidate")
+            self.assertEqual(response.code, 200)
+            self.assertEqual(response.body, "/revalidate ")
+        # Every use goes to the server, but only the first transfers a body
+        self.assertEqual(self.counts["/revalidate"], 3)
+        self.assertEqual(self.cache.revalidations, 2)
+
+    def test_no_store(self):
+        self.cached_fetch("/no-store")
+        self.cached_fetch("/no-store")
+        self.assertEqual(self.counts["/no-store"], 2)
+        self.assertEqual(len(self.cache.memory), 0)
+
+    def test_vary(self):
+        self.assertEqual(self.cached_fetch(
+                "/vary", headers={"Accept": "a"}).body, "/vary a")
+        self.assertEqual(self.cached_fetch(
+                "/vary", headers={"Accept": "a"}).body, "/vary a")
+        self.assertEqual(self.counts["/vary"], 1)
+        self.assertEqual(self.cached_fetch(
+                "/vary", headers={"Accept": "b"}).body, "/vary b")
+        self.assertEqual(self.counts["/vary"], 2)
+
+    def test_unsafe_method_invalidates(self):
+        self.cached_fetch("/fresh")
+        response = self.cached_fetch("/fresh", method="POST", body="")
+        self.assertEqual(response.body, "posted")
+        self.cached_fetch("/fresh")
+        self.assertEqual(self.counts["/fresh"], 2)
+
+    def test_coalescing(self):
+        responses = []
+        for i in range(3):
+            self.cache.fetch(self.get_url("/slow"),
+                             lambda response: (responses.append(response),
+                                               self.stop()))
+        self.wait(condition=lambda: self.pending)
+        self.pending.pop()()
+        self.wait(condition=lambda: len(responses) == 3)
+        self.assertEqual(self.counts["/slow"], 1)
+        self.assertEqual([r.body for r in responses], ["slow"] * 3)
+        # Each caller gets its own response object
+        self.assertEqual(len(set(id(r) for r in responses)), 3)
+
+    def test_disk_tier(self):
+        cache = CachingHTTPClient(self.client, cache_dir=self.cache_dir)
+        self.cached_fetch("/fresh", cache=cache)
+        # A new cache (e.g. after a restart) finds the entry on disk
+        cache = CachingHTTPClient(self.client, cache_dir=self.cache_dir)
+        response = self.cached_fetch("/fresh", cache=cache)
+        self.assertEqual(response.body, "/fresh ")
+        self.assertEqual(self.counts["/fresh"], 1)
+        self.assertEqual(cache.hits, 1)
+
+class LRUCacheTest(LogTrapTestCase):
+    def test_eviction(self):
+        cache = _LRUCache(10)
+        cache.put("a", "A", 4)
+        cache.put("b", "B", 4)
+        self.assertEqual(cache.get("a"), "A")
+        cache.put("c", "C", 4)
+        # "b" was least recently used
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), "A")
+        self.assertEqual(cache.size, 8)
+        cache.put("big", "X", 11)
+        self.assertEqual(cache.get("big"), None)
+        self.assertEqual(len(cache), 2)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import time
+
+from cStringIO import StringIO
+try:
+    import pycurl
+except ImportError:
+    pycurl = None
+from tornado.test.simple_httpclient_test import (EchoHandler, FlakyHandler,
+                                                 HangHandler,
+                                                 HelloWorldHandler)
+from tornado.testing import AsyncHTTPTestCase, LogTrapTestCase
+from tornado.web import Application
+
+class CurlHTTPClientTestCase(AsyncHTTPTestCase, LogTrapTestCase):
+    # AsyncHTTPTestCase.http_client is the curl-based AsyncHTTPClient
+    def get_app(self):
+        # requests seen by /flaky
+        self.attempts = []
+        return Application([
+            ("/hello", HelloWorldHandler),
+            ("/hang", HangHandler),
+            ("/echo", EchoHandler),
+            ("/flaky", FlakyHandler, dict(attempts=self.attempts)),
+            ])
+
+    def test_response_hook(self):
+        seen = []
+        def hook(host, response):
+            seen.append((host, response))
+            raise Exception("errors in the hook are logged")
+        self.http_client.response_hook = hook
+        for i in range(2):
+            response = self.fetch("/hello")
+            self.assertEqual(response.body, "Hello world!")
+        self.assertEqual([host for host, r in seen],
+                         ["localhost:%d" % self.get_http_port()] * 2)
+        self.assertTrue(seen[-1][1] is response)
+
+    def test_pool_stats(self):
+        for i in range(3):
+            self.fetch("/hello")
+        stats = self.http_client.host_stats["localhost:%d" %
+                                            self.get_http_port()]
+        self.assertEqual((stats.pool_hits, stats.pool_misses), (2, 1))
+
+    def test_fetch_all(self):
+        urls = [self.get_url("/hello?name=%d" % i) for i in range(5)]
+        self.http_client.fetch_all(urls, self.stop, max_concurrency=2)
+        responses = self.wait()
+        self.assertEqual([r.body for r in responses],
+                         ["Hello %d!" % i for i in range(5)])
+        self.http_client.fetch_all([], self.stop)
+        self.assertEqual(self.wait(), [])
+
+    def test_fetch_all_timeout(self):
+        urls = [self.get_url("/hello"), self.get_url("/hang")]
+        self.http_client.fetch_all(urls, self.stop, timeout=0.2)
+        responses = self.wait()
+        self.assertEqual([r.code for r in responses], [200, 599])
+        self.assertEqual(str(responses[1].error), "HTTP 599: Timeout")
+
+    def test_body_producer_file(self):
+        body = "".join(chr(i % 256) for i in range(200000))
+        response = self.fetch("/echo", method="PUT",
+                              headers={"Content-Length": str(len(body))},
+                              body_producer=StringIO(body))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, body)
+
+    def test_body_producer_callable(self):
+        def producer(write, finish):
+            write("abc")
+            finish()
+        client = self.http_client
+        # More refused requests than the client has curl handles
+        for i in range(len(client._curls) + 1):
+            self.assertRaises(NotImplementedError, client.fetch,
+                              self.get_url("/echo"), self.stop, method="PUT",
+                              headers={"Content-Length": "3"},
+                              body_producer=producer)
+        # No curl handle was taken for the refused requests
+        client.fetch(self.get_url("/hello"), self.stop)
+        response = self.wait()
+        self.assertEqual(response.body, "Hello world!")
+
+    def test_retry(self):
+        response = self.fetch("/flaky?fail=2", max_retries=3,
+                              retry_backoff=0.01)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, "3")
+
+    def test_retries_exhausted(self):
+        response = self.fetch("/flaky?fail=5", max_retries=1,
+                              retry_backoff=0.01)
+        self.assertEqual(response.code, 503)
+        self.assertEqual(len(self.attempts), 2)
+
+    def test_total_timeout(self):
+        start = time.time()
+        response = self.fetch("/flaky?fail=100", max_retries=100,
+                              retry_backoff=0.05, total_timeout=0.3)
+        self.assertEqual(response.code, 599)
+        self.assertEqual(str(response.error), "HTTP 599: Timeout")
+        self.assertTrue(time.time() - start < 1)
+
+    def test_hedge(self):
+        # The first attempt hangs; the hedged one answers
+        response = self.fetch("/flaky?hang=1", hedge_after=0.05)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, "2")
+        # The handle of the cancelled attempt is given back
+        self.io_loop.add_callback(self.stop)
+        self.wait()
+        client = self.http_client
+        self.assertEqual(len(client._free_list), len(client._curls))
+        self.assertEqual(self.fetch("/hello").body, "Hello world!")
+
+    def test_unsupported_options(self):
+        for name in ("dns_timeout", "first_byte_timeout"):
+            self.assertRaises(ValueError, self.http_client.fetch,
+                              self.get_url("/hello"), self.stop,
+                              **{name: 1})
+        self.assertEqual(len(self.http_client._requests), 0)
+
+
+if pycurl is None:
+    del CurlHTTPClientTestCase
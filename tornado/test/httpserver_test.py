@@ -1,13 +1,21 @@
 #!/usr/bin/env python
 
-from tornado.testing import AsyncHTTPTestCase, LogTrapTestCase
-from tornado.web import Application, RequestHandler
+from tornado.httpserver import bind_sockets, socket_from_fd, inherited_sockets
+from tornado.iostream import IOStream
+from tornado.testing import AsyncHTTPTestCase, LogTrapTestCase, get_unused_port
+from tornado.web import Application, RequestHandler, asynchronous
 import os
 try:
     import pycurl
 except ImportError:
     pycurl = None
 import re
+import shutil
+import signal
+import socket
+import tempfile
+import sys
+import time
 import unittest
 import urllib
 
@@ -23,13 +31,22 @@ class HelloWorldRequestHandler(RequestHandler):
     def post(self):
         self.finish("Got %d bytes in POST" % len(self.request.body))
 
+class ChunkedWriteHandler(RequestHandler):
+    def get(self):
+        # Lots of small writes, which the stream should coalesce
+        for i in xrange(int(self.get_argument("n"))):
+            self.write("%05d" % i)
+            self.flush()
+        self.finish()
+
 class SSLTest(AsyncHTTPTestCase, LogTrapTestCase):
     def get_app(self):
-        return Application([('/', HelloWorldRequestHandler)])
+        return Application([('/', HelloWorldRequestHandler),
+                            ('/chunks', ChunkedWriteHandler)])
 
     def get_httpserver_options(self):
         # Testing keys were generated with:
-        # openssl req -new -keyout tornado/test/test.key -out tornado/test/test.crt -nodes -days 3650 -x509
+        # openssl req -new -newkey rsa:2048 -keyout tornado/test/test.key -out tornado/test/test.crt -nodes -days 3650 -x509 -subj "/CN=localhost"
         test_dir = os.path.dirname(__file__)
         return dict(ssl_options=dict(
                 certfile=os.path.join(test_dir, 'test.crt'),
@@ -48,6 +65,9 @@ class SSLTest(AsyncHTTPTestCase, LogTrapTestCase):
     def test_ssl(self):
         response = self.fetch('/')
         self.assertEqual(response.body, "Hello world")
+        info = response.time_info
+        self.assertTrue(0 < info["connect"] < info["appconnect"] <=
+                        info["starttransfer"])
 
     def test_large_post(self):
         response = self.fetch('/',
@@ -55,6 +75,57 @@ class SSLTest(AsyncHTTPTestCase, LogTrapTestCase):
                               body='A'*5000)
         self.assertEqual(response.body, "Got 5000 bytes in POST")
 
+    def test_very_large_post(self):
+        # Much larger than a single TLS record
+        response = self.fetch('/',
+                              method='POST',
+                              body='A'*1000000)
+        self.assertEqual(response.body, "Got 1000000 bytes in POST")
+
+    def test_many_small_writes(self):
+        response = self.fetch('/chunks?n=20000')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body,
+                         "".join("%05d" % i for i in xrange(20000)))
+
+    def test_handshake_stats(self):
+        self.fetch('/')
+        stats = self.http_server.ssl_handshake_stats
+        self.assertEqual(stats.handshakes, 1)
+        self.assertTrue(stats.average_time() >= 0)
+        self.assertEqual(stats.max_time, stats.total_time)
+
+    def test_handshake_stats_reconnect(self):
+        # Connection: close makes the client open a new connection, with a
+        # new handshake, for the second request
+        for i in range(2):
+            response = self.fetch('/', headers={"Connection": "close"})
+            self.assertEqual(response.body, "Hello world")
+        stats = self.http_server.ssl_handshake_stats
+        self.assertEqual(stats.handshakes, 2)
+        self.assertTrue(0 <= stats.max_time <= stats.total_time)
+        self.assertTrue(stats.average_time() <= stats.max_time)
+        if self.http_server._ssl_context is not None:
+            session_stats = stats.session_stats()
+            self.assertTrue("hits" in session_stats)
+            self.assertEqual(session_stats["accept"], 2)
+            self.assertTrue(0 <= stats.resumption_ratio() <= 1)
+
+class SSLContextTest(SSLTest):
+    def get_httpserver_options(self):
+        options = super(SSLContextTest, self).get_httpserver_options()
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.load_cert_chain(options["ssl_options"]["certfile"],
+                                options["ssl_options"]["keyfile"])
+        return dict(ssl_options=context)
+
+    def test_shared_context(self):
+        self.assertTrue(self.http_server._ssl_context is
+                        self.http_server.ssl_options)
+
+if ssl is not None and not hasattr(ssl, "SSLContext"):
+    del SSLContextTest
+
 if (ssl is None or pycurl is None or
     (pycurl.version_info()[5].startswith('GnuTLS') and
      pycurl.version_info()[2] < 0x71400)):
@@ -65,3 +136,245 @@ if (ssl is None or pycurl is None or
     # cause this test to deadlock as the blocking network ops happen in
     # the same IOLoop as the server.
     del SSLTest
+    if ssl is not None:
+        del SSLContextTest
+
+
+class WaitingHandler(RequestHandler):
+    def initialize(self, test):
+        self.test = test
+
+    @asynchronous
+    def get(self):
+        self.test.waiting.append(self)
+        self.test.stop()
+
+class OverloadTest(AsyncHTTPTestCase, LogTrapTestCase):
+    def get_app(self):
+        self.waiting = []
+        return Application([('/', HelloWorldRequestHandler),
+                            ('/wait', WaitingHandler, dict(test=self))])
+
+    def get_httpserver_options(self):
+        return dict(max_connections=2, max_requests=1)
+
+    def connect(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
+        s.connect(("localhost", self.get_http_port()))
+        return IOStream(s, io_loop=self.io_loop)
+
+    def test_max_requests(self):
+        stream = self.connect()
+        stream.write("GET /wait HTTP/1.0\r\n\r\n")
+        self.wait()
+        self.assertEqual(len(self.waiting), 1)
+        response = self.fetch('/')
+        self.assertEqual(response.code, 503)
+        # Once the pending request finishes we accept requests again
+        self.waiting.pop().finish()
+        stream.read_until("\r\n\r\n", self.stop)
+        self.wait()
+        response = self.fetch('/')
+        self.assertEqual(response.body, "Hello world")
+        stream.close()
+
+    def test_max_connections(self):
+        # Open the idle connections one at a time so that neither is
+        # accepted while the other's request is counted by max_requests
+        streams = []
+        for i in range(2):
+            stream = self.connect()
+            streams.append(stream)
+            stream.write("GET / HTTP/1.1\r\n\r\n")
+            stream.read_until("Hello world", self.stop)
+            self.wait()
+        response = self.fetch('/')
+        self.assertEqual(response.code, 503)
+        for stream in streams:
+            stream.close()
+        # Let the server notice the closed connections
+        self.io_loop.add_timeout(time.time() + 0.1, self.stop)
+        self.wait()
+        response = self.fetch('/')
+        self.assertEqual(response.body, "Hello world")
+
+class BacklogOverloadTest(AsyncHTTPTestCase, LogTrapTestCase):
+    def get_app(self):
+        return Application([('/', HelloWorldRequestHandler)])
+
+    def get_httpserver_options(self):
+        return dict(max_connections=1, reject_overload=False)
+
+    def test_backlog(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
+        s.connect(("localhost", self.get_http_port()))
+        stream = IOStream(s, io_loop=self.io_loop)
+        stream.write("GET / HTTP/1.1\r\n\r\n")
+        stream.read_until("Hello world", self.stop)
+        self.wait()
+        # The second connection waits in the backlog until the first closes
+        self.http_client.fetch(self.get_url('/'), self.stop)
+        self.io_loop.add_timeout(time.time() + 0.1, stream.close)
+        response = self.wait()
+        self.assertEqual(response.body, "Hello world")
+
+class LoopLagTest(AsyncHTTPTestCase, LogTrapTestCase):
+    def get_app(self):
+        return Application([('/', HelloWorldRequestHandler)])
+
+    def get_httpserver_options(self):
+        return dict(max_loop_lag=0.1)
+
+    def test_loop_lag(self):
+        # Block the IOLoop so the lag monitor's next timeout runs late
+        self.io_loop.add_callback(lambda: time.sleep(0.5))
+        self.io_loop.add_timeout(time.time() + 0.15, self.stop)
+        self.wait()
+        self.assertTrue(self.http_server.overloaded())
+        response = self.fetch('/')
+        self.assertEqual(response.code, 503)
+        # The measured lag decays once the IOLoop is responsive again
+        self.io_loop.add_timeout(time.time() + 1, self.stop)
+        self.wait()
+        self.assertFalse(self.http_server.overloaded())
+        response = self.fetch('/')
+        self.assertEqual(response.body, "Hello world")
+
+class ListenerTest(AsyncHTTPTestCase, LogTrapTestCase):
+    def get_app(self):
+        return Application([('/', HelloWorldRequestHandler)])
+
+    def request(self, family, address):
+        s = socket.socket(family, socket.SOCK_STREAM)
+        s.connect(address)
+        stream = IOStream(s, io_loop=self.io_loop)
+        stream.write("GET / HTTP/1.0\r\n\r\n")
+        stream.read_until("Hello world", self.stop)
+        data = self.wait()
+        stream.close()
+        return data
+
+    def test_unix_socket(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "test.sock")
+            self.http_server.bind_unix_socket(path)
+            self.assertTrue(self.request(socket.AF_UNIX, path).startswith(
+                    "HTTP/1.0 200 OK"))
+            # A stale socket file is replaced
+            self.http_server.stop()
+            self.http_server.bind_unix_socket(path)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_multiple_listeners(self):
+        port = get_unused_port()
+        self.http_server.add_sockets(bind_sockets(port, "127.0.0.1"))
+        self.assertTrue(self.request(socket.AF_INET, ("127.0.0.1", port)))
+        # The original listener is still active
+        self.assertEqual(self.fetch('/').body, "Hello world")
+
+    def test_ipv6(self):
+        try:
+            sockets = bind_sockets(get_unused_port(), "::1")
+        except socket.error:
+            # IPv6 is not available on this host
+            return
+        self.assertEqual(sockets[0].family, socket.AF_INET6)
+        self.http_server.add_sockets(sockets)
+        port = sockets[0].getsockname()[1]
+        self.assertTrue(self.request(socket.AF_INET6, ("::1", port)))
+
+    def test_inherited_fd(self):
+        port = get_unused_port()
+        [sock] = bind_sockets(port, "127.0.0.1")
+        fd = os.dup(sock.fileno())
+        sock.close()
+        self.http_server.add_sockets([socket_from_fd(fd)])
+        self.assertTrue(self.request(socket.AF_INET, ("127.0.0.1", port)))
+
+    def test_inherited_sockets_environ(self):
+        self.assertEqual(inherited_sockets({}), [])
+        self.assertEqual(inherited_sockets(dict(LISTEN_PID="1",
+                                                LISTEN_FDS="2")), [])
+
+class DrainTest(AsyncHTTPTestCase, LogTrapTestCase):
+    def get_app(self):
+        self.waiting = []
+        return Application([('/', HelloWorldRequestHandler),
+                            ('/wait', WaitingHandler, dict(test=self))])
+
+    def test_drain(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
+        s.connect(("localhost", self.get_http_port()))
+        busy = IOStream(s, io_loop=self.io_loop)
+        busy.write("GET /wait HTTP/1.1\r\n\r\n")
+        self.wait()
+        drained = []
+        self.http_server.drain(callback=lambda: drained.append(True))
+        # The in-flight request is allowed to finish, then the
+        # connection is closed despite HTTP/1.1 keep-alive.
+        self.assertFalse(drained)
+        self.waiting.pop().finish()
+        busy.set_close_callback(self.stop)
+        self.wait()
+        self.assertEqual(drained, [True])
+
+    def test_drain_timeout(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
+        s.connect(("localhost", self.get_http_port()))
+        busy = IOStream(s, io_loop=self.io_loop)
+        busy.write("GET /wait HTTP/1.1\r\n\r\n")
+        self.wait()
+        self.http_server.drain(timeout=0.1, callback=self.stop)
+        self.wait()
+
+_HANDOFF_SCRIPT = """
+import sys
+sys.path.insert(0, %r)
+from tornado import httpserver, ioloop, web
+class NewHandler(web.RequestHandler):
+    def get(self):
+        self.write("new process")
+server = httpserver.HTTPServer(web.Application([("/", NewHandler)]))
+server.add_sockets(httpserver.inherited_sockets())
+server.start()
+ioloop.IOLoop.instance().start()
+"""
+
+class HandoffTest(AsyncHTTPTestCase, LogTrapTestCase):
+    def get_app(self):
+        return Application([('/', HelloWorldRequestHandler)])
+
+    def test_inherited_sockets_environ(self):
+        [sock] = bind_sockets(get_unused_port(), "127.0.0.1")
+        fd = os.dup(sock.fileno())
+        environ = dict(TORNADO_LISTEN_FDS=str(fd))
+        [inherited] = inherited_sockets(environ)
+        self.assertEqual(inherited.getsockname(), sock.getsockname())
+        self.assertFalse(environ)
+        inherited.close()
+        sock.close()
+
+    def test_handoff(self):
+        self.assertEqual(self.fetch('/').body, "Hello world")
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+                    os.path.abspath(__file__))))
+        pid = self.http_server.handoff(
+            args=[sys.executable, "-c", _HANDOFF_SCRIPT % root],
+            callback=self.stop)
+        try:
+            self.wait(timeout=10)
+            self.assertEqual(self.fetch('/').body, "new process")
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+
+    def test_failed_handoff(self):
+        pid = self.http_server.handoff(
+            args=[sys.executable, "-c", "import sys; sys.exit(1)"],
+            callback=self.stop)
+        # The new process exits without becoming ready, so we keep serving
+        self.io_loop.add_timeout(time.time() + 0.5, self.stop)
+        self.wait()
+        self.assertEqual(self.fetch('/').body, "Hello world")
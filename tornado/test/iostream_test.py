@@ -7,6 +7,9 @@ class HelloHandler(RequestHandler):
     def get(self):
         self.write("Hello")
 
+    def post(self):
+        self.write("Got %d bytes" % len(self.request.body))
+
 class TestIOStream(AsyncHTTPTestCase, LogTrapTestCase):
     def get_app(self):
         return Application([('/', HelloHandler)])
@@ -31,3 +34,53 @@ class TestIOStream(AsyncHTTPTestCase, LogTrapTestCase):
         self.stream.read_bytes(3, self.stop)
         data = self.wait()
         self.assertEqual(data, "200")
+
+
+    def test_write_many_chunks(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
+        s.connect(("localhost", self.get_http_port()))
+        self.stream = IOStream(s, io_loop=self.io_loop)
+        self.stream.write("POST / HTTP/1.0\r\nContent-Length: 1000000\r\n\r\n")
+        for i in xrange(1000):
+            self.stream.write("A" * 1000)
+        self.stream.write("", self.stop)
+        self.wait()
+        self.assertFalse(self.stream.writing())
+        self.stream.read_until("\r\n\r\n", self.stop)
+        self.wait()
+        self.stream.read_bytes(len("Got 1000000 bytes"), self.stop)
+        data = self.wait()
+        self.assertEqual(data, "Got 1000000 bytes")
+
+    def test_streaming_read(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
+        s.connect(("localhost", self.get_http_port()))
+        self.stream = IOStream(s, io_loop=self.io_loop)
+        self.stream.write("GET / HTTP/1.0\r\n\r\n")
+        self.stream.read_until("\r\n\r\n", self.stop)
+        self.wait()
+        chunks = []
+        self.stream.read_bytes(3, self.stop,
+                               streaming_callback=chunks.append)
+        data = self.wait()
+        self.assertEqual(data, "")
+        self.assertEqual("".join(chunks), "Hel")
+
+        # The rest of the response is read until the server closes
+        chunks = []
+        self.stream.read_until_close(self.stop,
+                                     streaming_callback=chunks.append)
+        data = self.wait()
+        self.assertEqual(data, "")
+        self.assertEqual("".join(chunks), "lo")
+        self.assertTrue(self.stream.closed())
+
+    def test_read_until_close(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
+        s.connect(("localhost", self.get_http_port()))
+        self.stream = IOStream(s, io_loop=self.io_loop)
+        self.stream.write("GET / HTTP/1.0\r\n\r\n")
+        self.stream.read_until_close(self.stop)
+        data = self.wait()
+        self.assertTrue(data.startswith("HTTP/1.0 200"))
+        self.assertTrue(data.endswith("Hello"))
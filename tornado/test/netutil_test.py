@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+from __future__ import with_statement
+
+import socket
+import threading
+import time
+
+from tornado import netutil
+from tornado.iostream import IOStream
+from tornado.netutil import (Resolver, ThreadedResolver, CachingResolver,
+                             OverrideResolver)
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, LogTrapTestCase
+from tornado.web import Application, RequestHandler
+
+class CountingResolver(Resolver):
+    """Answers every lookup with 127.0.0.1 after a trip through the IOLoop."""
+    def __init__(self, io_loop, error=None):
+        self.io_loop = io_loop
+        self.error = error
+        self.lookups = []
+
+    def resolve(self, host, port, callback, family=socket.AF_UNSPEC):
+        self.lookups.append(host)
+        if self.error is not None:
+            self.io_loop.add_callback(lambda: callback(None, self.error))
+        else:
+            result = [(socket.AF_INET, ("127.0.0.1", port))]
+            self.io_loop.add_callback(lambda: callback(result, None))
+
+class ResolverTest(AsyncTestCase, LogTrapTestCase):
+    def resolve(self, resolver, host, port=80):
+        resolver.resolve(host, port, lambda *args: self.stop(args))
+        return self.wait()
+
+    def test_threaded_resolver(self):
+        resolver = ThreadedResolver(self.io_loop, num_threads=2)
+        try:
+            addrinfo, error = self.resolve(resolver, "localhost")
+            self.assertEqual(error, None)
+            self.assertTrue(addrinfo)
+            family, sockaddr = addrinfo[0]
+            self.assertEqual(sockaddr[1], 80)
+        finally:
+            resolver.close()
+
+    def test_resolve_after_close(self):
+        resolver = ThreadedResolver(self.io_loop, num_threads=2)
+        try:
+            self.resolve(resolver, "localhost")
+            resolver.close()
+            addrinfo, error = self.resolve(resolver, "localhost")
+            self.assertEqual(error, None)
+            self.assertTrue(addrinfo)
+        finally:
+            resolver.close()
+
+    def test_close_does_not_wait(self):
+        resolver = ThreadedResolver(self.io_loop)
+        release = threading.Event()
+        real_getaddrinfo = netutil._getaddrinfo
+        def slow_getaddrinfo(host, port, family):
+            release.wait(5)
+            return real_getaddrinfo(host, port, family)
+        netutil._getaddrinfo = slow_getaddrinfo
+        try:
+            resolver.resolve("localhost", 80, lambda *args: self.stop(args))
+            start = time.time()
+            resolver.close()
+            self.assertTrue(time.time() - start < 1)
+            release.set()
+            # The lookup in progress still completes
+            addrinfo, error = self.wait()
+            self.assertEqual(error, None)
+        finally:
+            release.set()
+            netutil._getaddrinfo = real_getaddrinfo
+
+    def test_ip_literal(self):
+        resolver = ThreadedResolver(self.io_loop)
+        results = []
+        resolver.resolve("127.0.0.1", 8080,
+                         lambda *args: results.append(args))
+        # Resolved synchronously, without starting any threads
+        self.assertEqual(results, [([(socket.AF_INET, ("127.0.0.1", 8080))],
+                                    None)])
+        self.assertEqual(resolver._threads, [])
+
+    def test_caching_resolver(self):
+        counting = CountingResolver(self.io_loop)
+        resolver = CachingResolver(counting, ttl=0.1)
+        results = []
+        # Concurrent lookups share one query
+        for i in range(3):
+            resolver.resolve("example.com", 80,
+                             lambda *args: (results.append(args),
+                                            self.stop()))
+        self.wait(condition=lambda: len(results) == 3)
+        self.assertEqual(counting.lookups, ["example.com"])
+        self.assertEqual(self.resolve(resolver, "example.com"), results[0])
+        self.assertEqual(counting.lookups, ["example.com"])
+        # Expired entries are looked up again
+        self.io_loop.add_timeout(time.time() + 0.15, self.stop)
+        self.wait()
+        self.resolve(resolver, "example.com")
+        self.assertEqual(counting.lookups, ["example.com", "example.com"])
+
+    def test_errors_not_cached(self):
+        counting = CountingResolver(self.io_loop,
+                                    error=socket.gaierror("no such host"))
+        resolver = CachingResolver(counting)
+        addrinfo, error = self.resolve(resolver, "example.com")
+        self.assertEqual(addrinfo, None)
+        self.assertTrue(isinstance(error, socket.gaierror))
+        self.resolve(resolver, "example.com")
+        self.assertEqual(len(counting.lookups), 2)
+
+    def test_override_resolver(self):
+        counting = CountingResolver(self.io_loop)
+        resolver = OverrideResolver(counting, {
+                "www.example.com": "localhost",
+                ("api.example.com", 443): ("localhost", 8443)})
+        self.resolve(resolver, "www.example.com")
+        addrinfo, error = self.resolve(resolver, "api.example.com", 443)
+        self.assertEqual(addrinfo[0][1], ("127.0.0.1", 8443))
+        self.resolve(resolver, "other.example.com")
+        self.assertEqual(counting.lookups,
+                         ["localhost", "localhost", "other.example.com"])
+
+class HelloHandler(RequestHandler):
+    def get(self):
+        self.write("Hello")
+
+class ResolvingConnectTest(AsyncHTTPTestCase, LogTrapTestCase):
+    def get_app(self):
+        return Application([('/', HelloHandler)])
+
+    def test_connect_with_resolver(self):
+        resolver = CountingResolver(self.io_loop)
+        stream = IOStream(socket.socket(), io_loop=self.io_loop)
+        stream.connect(("www.example.com", self.get_http_port()),
+                       resolver=resolver)
+        # Writes before the address is known are buffered
+        stream.write("GET / HTTP/1.0\r\n\r\n")
+        stream.read_until("\r\n\r\n", self.stop)
+        data = self.wait()
+        self.assertTrue(data.startswith("HTTP/1.0 200"))
+        self.assertEqual(resolver.lookups, ["www.example.com"])
+        stream.close()
+
+    def test_resolve_error(self):
+        resolver = CountingResolver(self.io_loop,
+                                    error=socket.gaierror("no such host"))
+        stream = IOStream(socket.socket(), io_loop=self.io_loop)
+        stream.set_close_callback(self.stop)
+        stream.connect(("www.example.com", 80), resolver=resolver)
+        self.wait()
+        self.assertTrue(isinstance(stream.error, socket.gaierror))
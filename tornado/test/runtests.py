@@ -2,13 +2,19 @@
 import unittest
 
 TEST_MODULES = [
+    'tornado.httpcache.doctests',
     'tornado.httputil.doctests',
+    'tornado.iostream.doctests',
     'tornado.test.escape_test',
+    'tornado.test.httpcache_test',
+    'tornado.test.httpclient_test',
     'tornado.test.httpserver_test',
     'tornado.test.ioloop_test',
     'tornado.test.iostream_test',
+    'tornado.test.netutil_test',
     'tornado.test.simple_httpclient_test',
     'tornado.test.stack_context_test',
+    'tornado.test.template_test',
     'tornado.test.testing_test',
     'tornado.test.web_test',
 ]
@@ -3,12 +3,19 @@
 from __future__ import with_statement
 
 import collections
+import functools
 import gzip
 import logging
 import socket
+import time
 
 from contextlib import closing
+from cStringIO import StringIO
+from tornado.httpserver import HTTPServer
+from tornado.httpclient import HTTPRequest
 from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream
+from tornado.netutil import Resolver
 from tornado.simple_httpclient import SimpleAsyncHTTPClient
 from tornado.testing import AsyncHTTPTestCase, LogTrapTestCase, get_unused_port
 from tornado.web import Application, RequestHandler, asynchronous
@@ -34,6 +41,23 @@ class AuthHandler(RequestHandler):
     def get(self):
         self.finish(self.request.headers["Authorization"])
 
+class PortHandler(RequestHandler):
+    def get(self):
+        # The client's port identifies the connection the request came on
+        self.finish(str(self.request.connection.address[1]))
+
+    def head(self):
+        self.set_header("Content-Length", "12")
+
+class LargeHandler(RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "application/octet-stream")
+        self.finish("x" * int(self.get_argument("size")))
+
+class EchoHandler(RequestHandler):
+    def put(self):
+        self.finish(self.request.body)
+
 class HangHandler(RequestHandler):
     @asynchronous
     def get(self):
@@ -50,16 +74,40 @@ class TriggerHandler(RequestHandler):
         self.queue.append(self.finish)
         self.wake_callback()
 
+class FlakyHandler(RequestHandler):
+    def initialize(self, attempts):
+        self.attempts = attempts
+
+    @asynchronous
+    def get(self):
+        self.attempts.append(self.request)
+        if len(self.attempts) <= int(self.get_argument("fail", 0)):
+            self.send_error(503)
+        elif len(self.attempts) > int(self.get_argument("hang", 0)):
+            self.finish(str(len(self.attempts)))
+
+    post = get
+
+class SilentResolver(Resolver):
+    def resolve(self, host, port, callback, **kwargs):
+        pass
+
 class SimpleHTTPClientTestCase(AsyncHTTPTestCase, LogTrapTestCase):
     def get_app(self):
         # callable objects to finish pending /trigger requests
         self.triggers = collections.deque()
+        # requests seen by /flaky
+        self.attempts = []
         return Application([
             ("/hello", HelloWorldHandler),
             ("/post", PostHandler),
             ("/chunk", ChunkHandler),
             ("/auth", AuthHandler),
             ("/hang", HangHandler),
+            ("/echo", EchoHandler),
+            ("/port", PortHandler),
+            ("/large", LargeHandler),
+            ("/flaky", FlakyHandler, dict(attempts=self.attempts)),
             ("/trigger", TriggerHandler, dict(queue=self.triggers,
                                               wake_callback=self.stop)),
             ], gzip=True)
@@ -176,3 +224,353 @@ class SimpleHTTPClientTestCase(AsyncHTTPTestCase, LogTrapTestCase):
         self.assertEqual(seen, [0, 1])
         self.assertEqual(len(client.queue), 0)
 
+
+    def test_connection_reuse(self):
+        ports = [self.fetch("/port").body for i in range(3)]
+        self.assertEqual(len(set(ports)), 1)
+        # Chunked responses and HEAD requests leave the connection usable
+        self.assertEqual(self.fetch("/chunk").body, "asdfqwer")
+        response = self.fetch("/port", method="HEAD")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self.fetch("/port").body, ports[0])
+
+    def test_pool_stats(self):
+        for i in range(3):
+            self.fetch("/hello")
+        stats = self.http_client.host_stats["localhost:%d" %
+                                            self.get_http_port()]
+        self.assertEqual((stats.pool_hits, stats.pool_misses), (2, 1))
+
+    def test_time_info(self):
+        seen = []
+        self.http_client.response_hook = lambda host, response: seen.append(
+            (host, response))
+        for i in range(2):
+            response = self.fetch("/hello")
+            info = response.time_info
+            self.assertEqual(sorted(info.keys()),
+                             ["appconnect", "connect", "namelookup",
+                              "pretransfer", "queue", "starttransfer",
+                              "total"])
+            self.assertTrue(info["namelookup"] <= info["connect"] <=
+                            info["pretransfer"] <= info["starttransfer"] <=
+                            info["total"])
+            self.assertEqual(info["total"], response.request_time)
+        # The second request reused the connection
+        self.assertEqual(info["connect"], 0)
+        self.assertEqual([host for host, r in seen],
+                         ["localhost:%d" % self.get_http_port()] * 2)
+        self.assertTrue(seen[-1][1] is response)
+
+    def test_no_reuse_after_connection_close(self):
+        first = self.fetch("/port", headers={"Connection": "close"}).body
+        self.assertEqual(self.http_client._pool._count, 0)
+        self.assertNotEqual(self.fetch("/port").body, first)
+
+    def test_pool_disabled(self):
+        client = SimpleAsyncHTTPClient(self.io_loop, force_instance=True,
+                                       max_idle_connections=0)
+        ports = set()
+        for i in range(2):
+            client.fetch(self.get_url("/port"), self.stop)
+            ports.add(self.wait().body)
+        self.assertEqual(len(ports), 2)
+
+    def test_stale_connection_discarded(self):
+        self.fetch("/port")
+        self.assertEqual(self.http_client._pool._count, 1)
+        # Drop the server side of the pooled connection
+        for conn in list(self.http_server._connections):
+            conn.stream.close()
+        self.io_loop.add_callback(self.stop)
+        self.wait()
+        response = self.fetch("/hello")
+        self.assertEqual(response.body, "Hello world!")
+
+    def test_retry_on_reused_connection(self):
+        # Pretend the closed connection still looks usable, as happens
+        # when the server closes it just as we pick it up.
+        pool = self.http_client._pool
+        pool._usable = lambda stream: not stream.closed()
+        self.fetch("/port")
+        for conn in list(self.http_server._connections):
+            conn.stream.close()
+        self.io_loop.add_callback(self.stop)
+        self.wait()
+        response = self.fetch("/hello")
+        self.assertEqual(response.body, "Hello world!")
+        # Non-idempotent requests are not retried
+        self.fetch("/port")
+        for conn in list(self.http_server._connections):
+            conn.stream.close()
+        self.io_loop.add_callback(self.stop)
+        self.wait()
+        response = self.fetch("/post", method="POST",
+                              body="arg1=foo&arg2=bar")
+        self.assertEqual(response.code, 599)
+
+    def test_idle_timeout(self):
+        client = SimpleAsyncHTTPClient(self.io_loop, force_instance=True,
+                                       idle_timeout=0.1)
+        client.fetch(self.get_url("/port"), self.stop)
+        self.wait()
+        self.assertEqual(client._pool._count, 1)
+        self.io_loop.add_timeout(time.time() + 0.2, self.stop)
+        self.wait()
+        self.assertEqual(client._pool._count, 0)
+
+    def test_max_idle_per_host(self):
+        client = SimpleAsyncHTTPClient(self.io_loop, force_instance=True,
+                                       max_idle_per_host=1)
+        seen = []
+        for i in range(2):
+            client.fetch(self.get_url("/trigger"),
+                         lambda response: (seen.append(response),
+                                           self.stop()))
+        self.wait(condition=lambda: len(self.triggers) == 2)
+        self.triggers.popleft()()
+        self.triggers.popleft()()
+        self.wait(condition=lambda: len(seen) == 2)
+        self.assertEqual(client._pool._count, 1)
+        client.close()
+        self.assertEqual(client._pool._count, 0)
+
+    def test_hostname_mapping(self):
+        client = SimpleAsyncHTTPClient(self.io_loop, force_instance=True,
+                                       hostname_mapping={
+                "www.example.com": "127.0.0.1"})
+        client.fetch("http://www.example.com:%d/hello" % self.get_http_port(),
+                     self.stop)
+        response = self.wait()
+        self.assertEqual(response.body, "Hello world!")
+        client.close()
+
+    def test_per_host_limit(self):
+        client = SimpleAsyncHTTPClient(self.io_loop, max_clients=3,
+                                       max_clients_per_host=1,
+                                       force_instance=True)
+        port = self.get_http_port()
+        seen = []
+        # Three requests for one host, then one for another.  With only one
+        # slot per host, the second host must not wait behind the first.
+        for host in ["localhost", "localhost", "localhost", "127.0.0.1"]:
+            client.fetch("http://%s:%d/trigger" % (host, port),
+                         lambda response, host=host: (seen.append(host),
+                                                      self.stop()))
+        self.wait(condition=lambda: len(self.triggers) == 2)
+        stats = client.host_stats["localhost:%d" % port]
+        self.assertEqual((stats.active, stats.queued), (1, 2))
+        other = client.host_stats["127.0.0.1:%d" % port]
+        self.assertEqual((other.active, other.queued), (1, 0))
+        self.assertEqual(len(client.queue), 2)
+
+        while len(seen) < 4:
+            self.triggers.popleft()()
+            self.wait(condition=lambda: self.triggers or len(seen) == 4)
+        self.assertEqual(sorted(seen), ["127.0.0.1"] + ["localhost"] * 3)
+        self.assertEqual((stats.active, stats.queued, stats.requests),
+                         (0, 0, 3))
+        self.assertTrue(stats.max_queue_time > 0)
+        self.assertTrue(stats.average_queue_time() <= stats.max_queue_time)
+        client.close()
+
+    def test_single_flight(self):
+        client = SimpleAsyncHTTPClient(self.io_loop, single_flight=True,
+                                       force_instance=True)
+        responses = []
+        def callback(response):
+            responses.append(response)
+            self.stop()
+        url = self.get_url("/trigger")
+        for i in range(3):
+            client.fetch(url, callback)
+        # A different header set is not shared
+        client.fetch(url, callback, headers={"X-Test": "1"})
+        self.wait(condition=lambda: len(self.triggers) == 2)
+        self.assertEqual(len(client.active), 2)
+        while self.triggers:
+            self.triggers.popleft()()
+        self.wait(condition=lambda: len(responses) == 4)
+        self.assertEqual([r.code for r in responses], [200] * 4)
+        self.assertEqual(len(set(id(r) for r in responses)), 4)
+        self.assertEqual(len(set(id(r.request) for r in responses)), 4)
+        self.assertEqual(client._in_flight, {})
+
+        # Requests with a body are never shared
+        for i in range(2):
+            client.fetch(self.get_url("/post"), callback, method="POST",
+                         body="arg1=foo&arg2=bar")
+        self.assertEqual(len(client.active), 2)
+        self.wait(condition=lambda: len(responses) == 6)
+        client.close()
+
+    def test_retry(self):
+        response = self.fetch("/flaky?fail=2", max_retries=3,
+                              retry_backoff=0.01)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, "3")
+
+    def test_retries_exhausted(self):
+        response = self.fetch("/flaky?fail=5", max_retries=1,
+                              retry_backoff=0.01)
+        self.assertEqual(response.code, 503)
+        self.assertEqual(len(self.attempts), 2)
+
+    def test_no_retry_for_post(self):
+        response = self.fetch("/flaky?fail=5", method="POST", body="",
+                              max_retries=3, retry_backoff=0.01)
+        self.assertEqual(response.code, 503)
+        self.assertEqual(len(self.attempts), 1)
+
+    def test_total_timeout(self):
+        start = time.time()
+        response = self.fetch("/flaky?fail=100", max_retries=100,
+                              retry_backoff=0.05, total_timeout=0.3)
+        self.assertEqual(response.code, 599)
+        self.assertEqual(str(response.error), "HTTP 599: Timeout")
+        self.assertTrue(time.time() - start < 1)
+
+    def test_hedge(self):
+        # The first attempt hangs; the hedged one answers
+        response = self.fetch("/flaky?hang=1", hedge_after=0.05)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, "2")
+        self.assertEqual(len(self.http_client.active), 0)
+
+    def test_hedge_percentile(self):
+        client = self.http_client
+        request = HTTPRequest("http://example.com/", hedge_after=2,
+                              hedge_percentile=50)
+        for i in range(1, 10):
+            client._record_latency("example.com:80", i / 10.0)
+        # Too few samples; fall back to hedge_after
+        self.assertEqual(client._hedge_delay("example.com:80", request), 2)
+        client._record_latency("example.com:80", 1.0)
+        self.assertEqual(client._hedge_delay("example.com:80", request), 0.6)
+        request.hedge_percentile = 100
+        self.assertEqual(client._hedge_delay("example.com:80", request), 1.0)
+
+    def test_first_byte_timeout(self):
+        response = self.fetch("/hang", first_byte_timeout=0.1)
+        self.assertEqual(response.code, 599)
+        self.assertEqual(str(response.error), "HTTP 599: First byte timeout")
+
+    def test_dns_timeout(self):
+        client = SimpleAsyncHTTPClient(self.io_loop, force_instance=True,
+                                       resolver=SilentResolver())
+        client.fetch("http://www.example.com/", self.stop, dns_timeout=0.1)
+        response = self.wait()
+        self.assertEqual(response.code, 599)
+        self.assertEqual(str(response.error), "HTTP 599: DNS timeout")
+        client.close()
+
+    def test_fetch_all(self):
+        urls = [self.get_url("/hello?name=%d" % i) for i in range(5)]
+        self.http_client.fetch_all(urls, self.stop, max_concurrency=2)
+        responses = self.wait()
+        self.assertEqual([r.body for r in responses],
+                         ["Hello %d!" % i for i in range(5)])
+        self.http_client.fetch_all([], self.stop)
+        self.assertEqual(self.wait(), [])
+
+    def test_fetch_all_timeout(self):
+        requests = [self.get_url("/hello"), self.get_url("/hang"),
+                    HTTPRequest(self.get_url("/hello?name=late"))]
+        self.http_client.fetch_all(requests, self.stop, max_concurrency=2,
+                                   timeout=0.2)
+        responses = self.wait()
+        self.assertEqual([r.code for r in responses], [200, 599, 200])
+        self.assertEqual(responses[2].body, "Hello late!")
+        self.assertEqual(str(responses[1].error), "HTTP 599: Timeout")
+        self.assertTrue(responses[1].request is not None)
+
+    def test_body_producer_file(self):
+        body = "".join(chr(i % 256) for i in range(200000))
+        response = self.fetch("/echo", method="PUT",
+                              headers={"Content-Length": str(len(body))},
+                              body_producer=StringIO(body))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, body)
+
+    def test_body_producer_callable(self):
+        def producer(write, finish):
+            chunks = ["abc", "", "defg"]
+            def send_next():
+                if chunks:
+                    write(chunks.pop(0), send_next)
+                else:
+                    finish()
+            send_next()
+        response = self.fetch("/echo", method="PUT",
+                              headers={"Content-Length": "7"},
+                              body_producer=producer)
+        self.assertEqual(response.body, "abcdefg")
+        # The connection is still usable afterwards
+        self.assertEqual(self.fetch("/hello").body, "Hello world!")
+
+    def test_chunked_body_producer(self):
+        # HTTPServer does not accept chunked requests, so answer this one
+        # by hand once the terminating chunk has arrived.
+        port = get_unused_port()
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("127.0.0.1", port))
+        listener.listen(1)
+        requests = []
+        def on_request(stream, data):
+            requests.append(data)
+            stream.write("HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok",
+                         stream.close)
+        def accept(fd, events):
+            connection, address = listener.accept()
+            stream = IOStream(connection, io_loop=self.io_loop)
+            stream.read_until("\r\n0\r\n\r\n",
+                              functools.partial(on_request, stream))
+        self.io_loop.add_handler(listener.fileno(), accept, IOLoop.READ)
+        try:
+            self.http_client.fetch("http://127.0.0.1:%d/" % port, self.stop,
+                                   method="POST",
+                                   body_producer=StringIO("x" * 70000))
+            response = self.wait()
+        finally:
+            self.io_loop.remove_handler(listener.fileno())
+            listener.close()
+        self.assertEqual(response.body, "ok")
+        headers, _, body = requests[0].partition("\r\n\r\n")
+        self.assertTrue("Transfer-Encoding: chunked" in headers)
+        self.assertEqual(body, "10000\r\n%s\r\n1170\r\n%s\r\n0\r\n\r\n" % (
+                "x" * 65536, "x" * 4464))
+
+    def test_streaming_large_body(self):
+        chunks = []
+        response = self.fetch("/large?size=1000000",
+                              streaming_callback=chunks.append)
+        self.assertEqual(response.code, 200)
+        self.assertFalse(response.body)
+        self.assertEqual(sum(len(c) for c in chunks), 1000000)
+        # Delivered incrementally, not as one string
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(max(len(c) for c in chunks) < 1000000)
+
+    def test_body_until_close(self):
+        # A response with neither Content-Length nor chunked encoding
+        def handle_request(request):
+            request.write("HTTP/1.1 200 OK\r\n\r\nuntil close")
+            request.finish()
+        port = get_unused_port()
+        server = HTTPServer(handle_request, io_loop=self.io_loop)
+        server.listen(port)
+        try:
+            url = "http://localhost:%d/" % port
+            self.http_client.fetch(url, self.stop,
+                                   headers={"Connection": "close"})
+            response = self.wait()
+            self.assertEqual(response.body, "until close")
+            chunks = []
+            self.http_client.fetch(url, self.stop,
+                                   headers={"Connection": "close"},
+                                   streaming_callback=chunks.append)
+            self.wait()
+            self.assertEqual("".join(chunks), "until close")
+        finally:
+            server.stop()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from tornado.template import BytecodeCache, FragmentCache, Loader, ParseError, Template
+from tornado.testing import LogTrapTestCase
+
+
+def write_file(root, name, content, mtime_offset=0):
+    path = os.path.join(root, name)
+    f = open(path, "w")
+    f.write(content)
+    f.close()
+    if mtime_offset:
+        # Make the change visible on filesystems with coarse mtimes
+        mtime = os.stat(path).st_mtime + mtime_offset
+        os.utime(path, (mtime, mtime))
+
+
+class TemplateTest(unittest.TestCase):
+    def test_simple(self):
+        template = Template("Hello {{ name }}!")
+        self.assertEqual(template.generate(name="Ben"), "Hello Ben!")
+
+    def test_default_namespace(self):
+        template = Template("{{ escape(x) }} {{ len(x) }} "
+                            "{{ datetime.date(2010, 1, 2) }}")
+        self.assertEqual(template.generate(x="<>"), "&lt;&gt; 2 2010-01-02")
+
+    def test_arguments_not_shared(self):
+        # Each call gets a fresh namespace; earlier arguments (and names
+        # set by the template itself) do not leak into later calls.
+        template = Template("{% set y = x %}{{ x }}"
+                            "{% if 'z' in globals() %}z{% end %}")
+        self.assertEqual(template.generate(x=1, z=2), "1z")
+        self.assertEqual(template.generate(x=3), "3")
+
+    def test_argument_shadows_default(self):
+        template = Template("{{ escape('<') }}")
+        self.assertEqual(template.generate(escape=lambda s: "E"), "E")
+        self.assertEqual(template.generate(), "&lt;")
+
+    def test_apply(self):
+        def upper(s):
+            return s.upper()
+        template = Template("{% apply upper %}foo {{ x }}{% end %}")
+        self.assertEqual(template.generate(upper=upper, x="bar"), "FOO BAR")
+
+    def test_text_merged(self):
+        template = Template("a{% comment x %}b{% block x %}c{% end %}"
+                            "{{ 'd' * 2 }}{{ u'\\xe9' }}")
+        self.assertEqual(template.generate(), "abcdd\xc3\xa9")
+        self.assertEqual(template.code.count("_append("), 1)
+
+    def test_text_merged_in_control_blocks(self):
+        template = Template("a{% if x %}b{% else %}c{% end %}d"
+                            "{% for i in x %}{{ i }}e{% end %}")
+        self.assertEqual(template.generate(x=[1, 2]), "abd1e2e")
+        self.assertEqual(template.generate(x=[]), "acd")
+
+    def test_text_merged_across_comments(self):
+        template = Template("a{% comment {{ x }} %}b{% comment %}c")
+        self.assertEqual(template.generate(), "abc")
+        self.assertEqual(template.code.count("_append("), 1)
+
+    def test_text_not_merged_into_apply(self):
+        template = Template("a{% apply upper %}b{{ 'c' }}{% end %}d")
+        self.assertEqual(template.generate(upper=lambda s: s.upper()), "aBCd")
+        self.assertTrue("_append('bc')" in template.code)
+
+    def test_constants_rendered_like_expressions(self):
+        template = Template("{{ 1 + 1 }}|{{ 0.5 }}|{{ u'\\u2603' }}|"
+                            "{{ '<&>' }}|{{ '  a  ' }}  b", name="x.html")
+        # Folded constants are utf-8 encoded but neither escaped nor
+        # whitespace compressed, as if they were evaluated at runtime
+        self.assertEqual(template.generate(),
+                         "2|0.5|\xe2\x98\x83|<&>|  a   b")
+        self.assertEqual(template.code.count("_append("), 1)
+
+    def test_calls_not_folded(self):
+        template = Template("{{ escape('<') }}{{ len('ab') }}")
+        self.assertEqual(template.generate(len=lambda s: 0), "&lt;0")
+        self.assertTrue("escape('<')" in template.code)
+        self.assertTrue("len('ab')" in template.code)
+
+    def test_stream(self):
+        template = Template("<head>{% block head %}{{ x }}{% end %}</head>"
+                            "{% for i in range(2) %}{% block row %}{{ i }}"
+                            "{% end %}{% end %}</body>")
+        chunks = []
+        template.stream(chunks.append, x=1)
+        # Blocks inside the loop do not flush
+        self.assertEqual(chunks, ["<head>", "1", "</head>01</body>"])
+        self.assertEqual(template.generate(x=1), "".join(chunks))
+
+    def test_stream_apply(self):
+        template = Template("{% apply upper %}{% block a %}a{% end %}"
+                            "{% end %}{% block b %}b{% end %}c")
+        chunks = []
+        template.stream(chunks.append, upper=lambda s: s.upper())
+        self.assertEqual(chunks, ["Abc"])
+        self.assertEqual(template.code.count("_flush("), 0)
+
+
+class CacheBlockTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def count(self, x):
+        self.calls.append(x)
+        return x
+
+    def test_cache(self):
+        template = Template("{% for k in keys %}"
+                            "[{% cache k %}{{ count(k) }}{% end %}]"
+                            "{% end %}")
+        self.assertEqual(template.generate(count=self.count, keys=[1, 2, 1]),
+                         "[1][2][1]")
+        self.assertEqual(template.generate(count=self.count, keys=[2]),
+                         "[2]")
+        self.assertEqual(self.calls, [1, 2])
+
+    def test_ttl(self):
+        template = Template('{% cache "k" + str(n) ttl=0.5 %}{{ count(n) }}'
+                            "{% end %}")
+        self.assertEqual(template.generate(count=self.count, n=1), "1")
+        self.assertEqual(template.generate(count=self.count, n=1), "1")
+        self.assertEqual(self.calls, [1])
+        for link in template.fragment_cache._map.values():
+            link[4] -= 1
+        self.assertEqual(template.generate(count=self.count, n=1), "1")
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_ttl_expression(self):
+        template = Template("{% cache n - 1 ttl=n * 60 %}{{ count(n) }}"
+                            "{% end %}")
+        self.assertEqual(template.generate(count=self.count, n=2), "2")
+        [link] = template.fragment_cache._map.values()
+        self.assertEqual(link[2][1], 1)
+        self.assertTrue(110 < link[4] - time.time() <= 120)
+
+    def test_key_expression(self):
+        # Without ttl= the whole expression is the key
+        template = Template("{% cache n - 1 %}{{ count(n) }}{% end %}"
+                            "{% cache make_key(n, ttl=n) %}{{ n }}{% end %}")
+        make_key = lambda n, ttl: (n, ttl)
+        for i in range(2):
+            self.assertEqual(template.generate(count=self.count, n=2,
+                                               make_key=make_key), "22")
+        self.assertEqual(self.calls, [2])
+
+    def test_blocks_do_not_share_keys(self):
+        template = Template("{% cache (a, 2) %}x{% end %}"
+                            "{% cache (a, 2) %}y{% end %}\n"
+                            "{% cache (a, 2) %}z{% end %}")
+        self.assertEqual(template.generate(a=1), "xy\nz")
+
+    def test_missing_key(self):
+        self.assertRaises(ParseError, Template, "{% cache %}a{% end %}")
+
+
+class FragmentCacheTest(unittest.TestCase):
+    def test_lru(self):
+        cache = FragmentCache(max_bytes=4)
+        cache.set("a", "xx")
+        cache.set("b", "xx")
+        self.assertEqual(cache.get("a"), "xx")
+        cache.set("c", "xx")
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), "xx")
+        self.assertEqual(cache.size, 4)
+        cache.set("d", "xxxxx")
+        self.assertEqual(cache.get("d"), None)
+
+    def test_expiry(self):
+        cache = FragmentCache()
+        cache.set("a", "x", ttl=-1)
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+
+class BytecodeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(tempfile.mkdtemp(), "cache")
+        self.write("base.html", "<title>{% block title %}{% end %}</title>")
+        self.write("page.html", '{% extends "base.html" %}'
+                   "{% block title %}{{ title }}{% end %}")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        shutil.rmtree(os.path.dirname(self.cache_dir))
+
+    def write(self, name, content, mtime_offset=0):
+        write_file(self.root, name, content, mtime_offset)
+
+    def load(self, name):
+        loader = Loader(self.root, bytecode_cache=BytecodeCache(self.cache_dir))
+        return loader.load(name)
+
+    def test_reuse(self):
+        template = self.load("page.html")
+        self.assertEqual(template.generate(title="x"), "<title>x</title>")
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+        template = self.load("page.html")
+        # Loaded from the cache without parsing
+        self.assertTrue(template._file is None)
+        self.assertEqual(template.generate(title="y"), "<title>y</title>")
+
+    def test_dependency_changed(self):
+        self.load("page.html")
+        self.write("base.html", "<h1>{% block title %}{% end %}</h1>",
+                   mtime_offset=10)
+        template = self.load("page.html")
+        self.assertEqual(template.generate(title="x"), "<h1>x</h1>")
+
+    def test_corrupt_entry(self):
+        self.load("page.html")
+        for name in os.listdir(self.cache_dir):
+            f = open(os.path.join(self.cache_dir, name), "w")
+            f.write("garbage")
+            f.close()
+        template = self.load("page.html")
+        self.assertEqual(template.generate(title="x"), "<title>x</title>")
+
+
+class ReloadTest(LogTrapTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write("base.html", "<title>{% block title %}{% end %}</title>")
+        self.write("page.html", '{% extends "base.html" %}'
+                   '{% block title %}{% include "row.html" %}{% end %}')
+        self.write("row.html", "{{ x }}")
+        self.write("other.html", "other")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, content, mtime_offset=0):
+        write_file(self.root, name, content, mtime_offset)
+
+    def test_dependency_changed(self):
+        loader = Loader(self.root, check_interval=0)
+        self.assertEqual(loader.load("page.html").generate(x=1),
+                         "<title>1</title>")
+        other = loader.load("other.html")
+        self.write("base.html", "<h1>{% block title %}{% end %}</h1>",
+                   mtime_offset=10)
+        self.assertEqual(loader.load("page.html").generate(x=1),
+                         "<h1>1</h1>")
+        self.write("row.html", "[{{ x }}]", mtime_offset=10)
+        self.assertEqual(loader.load("page.html").generate(x=1),
+                         "<h1>[1]</h1>")
+        # Templates not built from a changed file are kept
+        self.assertTrue(loader.load("other.html") is other)
+
+    def test_check_interval(self):
+        loader = Loader(self.root, check_interval=3600)
+        template = loader.load("row.html")
+        self.write("row.html", "[{{ x }}]", mtime_offset=10)
+        self.assertTrue(loader.load("row.html") is template)
+        loader._checked["row.html"] -= 3600
+        self.assertEqual(loader.load("row.html").generate(x=1), "[1]")
+
+    def test_include_merged(self):
+        loader = Loader(self.root)
+        template = loader.load("page.html")
+        self.assertEqual(template.generate(x=1), "<title>1</title>")
+        # Text from the base template, the block and the include
+        self.assertTrue("_append('<title>')" in template.code)
+
+    def test_no_check(self):
+        loader = Loader(self.root)
+        template = loader.load("row.html")
+        self.write("row.html", "[{{ x }}]", mtime_offset=10)
+        self.assertTrue(loader.load("row.html") is template)
+
+
+class PrecompileTest(LogTrapTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, "sub"))
+        os.mkdir(os.path.join(self.root, ".svn"))
+        for name, content in [
+            ("base.html", "<title>{% block title %}{% end %}</title>"),
+            ("sub/page.html", '{% extends "../base.html" %}'
+             '{% block title %}{% include "row.txt" %}{% end %}'),
+            ("sub/row.txt", "{{ x }}"),
+            (".page.html.swp", "{% if %}"),
+            (".svn/entries", "{% if %}")]:
+            f = open(os.path.join(self.root, name), "w")
+            f.write(content)
+            f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_precompile(self):
+        loader = Loader(self.root)
+        self.assertEqual(loader.precompile(),
+                         ["base.html", "sub/page.html", "sub/row.txt"])
+        self.assertEqual(sorted(loader.templates),
+                         ["base.html", "sub/page.html", "sub/row.txt"])
+        self.assertEqual(loader.templates["sub/page.html"].generate(x=1),
+                         "<title>1</title>")
+
+    def test_extensions(self):
+        loader = Loader(self.root)
+        self.assertEqual(loader.precompile(extensions=[".txt"]),
+                         ["sub/row.txt"])
+
+    def test_error(self):
+        f = open(os.path.join(self.root, "broken.html"), "w")
+        f.write("{% if x %}")
+        f.close()
+        self.assertRaises(ParseError, Loader(self.root).precompile)
+
+
+if __name__ == "__main__":
+    unittest.main()
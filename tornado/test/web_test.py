@@ -1,11 +1,14 @@
 from tornado.escape import json_decode
 from tornado.iostream import IOStream
 from tornado.testing import LogTrapTestCase, AsyncHTTPTestCase
-from tornado.web import RequestHandler, _O, authenticated, Application, asynchronous
+from tornado.web import RequestHandler, _O, authenticated, Application, asynchronous, UIModule
 
 import logging
+import os
 import re
+import shutil
 import socket
+import tempfile
 import tornado.ioloop
 
 class CookieTestRequestHandler(RequestHandler):
@@ -130,3 +133,170 @@ class RequestEncodingTest(AsyncHTTPTestCase, LogTrapTestCase):
         self.assertEqual(json_decode(self.fetch('/%3F?%3F=%3F').body),
                          dict(path='?', args={'?': ['?']}))
 
+
+class TemplateHandler(RequestHandler):
+    def get(self, name):
+        self.render(name, title="Hi")
+
+class PrecompileTemplatesTest(AsyncHTTPTestCase, LogTrapTestCase):
+    def get_app(self):
+        self.template_path = tempfile.mkdtemp()
+        for name, content in [
+            ("base.html", "<title>{% block title %}{% end %}</title>"),
+            ("page.html", '{% extends "base.html" %}'
+             "{% block title %}{{ title }}{% end %}")]:
+            f = open(os.path.join(self.template_path, name), "w")
+            f.write(content)
+            f.close()
+        return Application([("/(.*)", TemplateHandler)],
+                           template_path=self.template_path,
+                           precompile_templates=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.template_path)
+        super(PrecompileTemplatesTest, self).tearDown()
+
+    def test_precompiled(self):
+        loader = RequestHandler._templates[self.template_path]
+        self.assertEqual(sorted(loader.templates), ["base.html", "page.html"])
+        page = loader.templates["page.html"]
+        self.assertEqual(self.fetch("/page.html").body, "<title>Hi</title>")
+        self.assertTrue(loader.templates["page.html"] is page)
+
+
+class HeadModule(UIModule):
+    def render(self):
+        return "head"
+
+    def css_files(self):
+        return "/head.css"
+
+class BodyModule(UIModule):
+    def render(self):
+        return "body"
+
+    def css_files(self):
+        return "/body.css"
+
+    def javascript_files(self):
+        return "/body.js"
+
+class CountingModule(UIModule):
+    calls = 0
+
+    def render(self):
+        return ""
+
+    def embedded_javascript(self):
+        CountingModule.calls += 1
+        return "f(%d);" % CountingModule.calls
+
+class StaticCountingModule(CountingModule):
+    static_assets = True
+
+class UserModule(UIModule):
+    def render(self):
+        return ""
+
+    def embedded_javascript(self):
+        return "user(%s);" % self.handler.get_argument("user")
+
+class StreamTemplateHandler(RequestHandler):
+    def get(self):
+        self.stream_render("page.html")
+
+class ModuleTemplateHandler(RequestHandler):
+    def get(self, name):
+        self.render(name)
+
+class StreamRenderTest(AsyncHTTPTestCase, LogTrapTestCase):
+    def get_app(self):
+        self.template_path = tempfile.mkdtemp()
+        f = open(os.path.join(self.template_path, "page.html"), "w")
+        f.write("<head>{% block head %}{{ modules.Head() }}{% end %}</head>"
+                "<body>{% block body %}{{ modules.Body() }}{% end %}</body>")
+        f.close()
+        for name, module in [("count", "Count"), ("static", "Static"),
+                             ("user", "User")]:
+            f = open(os.path.join(self.template_path, name + ".html"), "w")
+            f.write("<head></head><body>{{ modules.%s() }}</body>" % module)
+            f.close()
+        return Application([("/", StreamTemplateHandler),
+                            ("/render/(.*)", ModuleTemplateHandler)],
+                           template_path=self.template_path,
+                           ui_modules=dict(Head=HeadModule, Body=BodyModule,
+                                           Count=CountingModule,
+                                           Static=StaticCountingModule,
+                                           User=UserModule))
+
+    def tearDown(self):
+        shutil.rmtree(self.template_path)
+        super(StreamRenderTest, self).tearDown()
+
+    def test_stream_render(self):
+        response = self.fetch("/")
+        self.assertEqual(response.headers.get("Transfer-Encoding"), "chunked")
+        self.assertEqual(
+            response.body,
+            '<head>head<link href="/head.css" type="text/css" '
+            'rel="stylesheet"/>\n</head><body>body<link href="/body.css" '
+            'type="text/css" rel="stylesheet"/>\n<script src="/body.js" '
+            'type="text/javascript"></script>\n</body>')
+
+    def test_render(self):
+        self.assertEqual(
+            self.fetch("/render/page.html").body,
+            '<head>head<link href="/body.css" type="text/css" '
+            'rel="stylesheet"/><link href="/head.css" type="text/css" '
+            'rel="stylesheet"/>\n</head><body>body<script src="/body.js" '
+            'type="text/javascript"></script>\n</body>')
+
+    def script(self, js):
+        return ('<head></head><body><script type="text/javascript">\n'
+                '//<![CDATA[\n%s\n//]]>\n</script>\n</body>' % js)
+
+    def test_module_html_not_cached_by_default(self):
+        CountingModule.calls = 0
+        for i in range(1, 3):
+            self.assertEqual(self.fetch("/render/count.html").body,
+                             self.script("f(%d);" % i))
+        for user in ["a", "b"]:
+            self.assertEqual(self.fetch("/render/user.html?user=" + user).body,
+                             self.script("user(%s);" % user))
+
+    def test_module_html_cached(self):
+        CountingModule.calls = 0
+        for i in range(2):
+            self.assertEqual(self.fetch("/render/static.html").body,
+                             self.script("f(1);"))
+        self.assertEqual(self.fetch("/render/count.html").body,
+                         self.script("f(2);"))
+
+
+class StreamJSONHandler(RequestHandler):
+    def get(self):
+        if self.get_argument("list", None):
+            try:
+                self.stream_json(range(10))
+            except AssertionError:
+                self.finish("refused")
+                return
+        self.stream_json(dict(items=range(1000), tag="</script>"),
+                         chunk_size=100)
+        self.finish()
+
+class StreamJSONTest(AsyncHTTPTestCase, LogTrapTestCase):
+    def get_app(self):
+        return Application([("/", StreamJSONHandler)])
+
+    def test_stream_json(self):
+        response = self.fetch("/")
+        self.assertEqual(response.headers.get("Transfer-Encoding"), "chunked")
+        self.assertTrue(response.headers["Content-Type"].startswith(
+                "text/javascript"))
+        self.assertTrue("</" not in response.body)
+        self.assertEqual(json_decode(response.body),
+                         dict(items=range(1000), tag="</script>"))
+
+    def test_stream_json_refuses_lists(self):
+        self.assertEqual(self.fetch("/?list=1").body, "refused")
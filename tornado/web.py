@@ -103,7 +103,7 @@ class RequestHandler(object):
         self.clear()
         # Check since connection is not available in WSGI
         if hasattr(self.request, "connection"):
-            self.request.connection.stream.set_close_callback(
+            self.request.connection.set_close_callback(
                 self.on_connection_close)
         self.initialize(**kwargs)
 
@@ -400,6 +400,9 @@ class RequestHandler(object):
         cross-site security vulnerability.  All JSON output should be
         wrapped in a dictionary.  More details at
         http://haacked.com/archive/2008/11/20/anatomy-of-a-subtle-json-vulnerability.aspx
+
+        To send a large dictionary while it is being encoded, use
+        stream_json() instead.
         """
         assert not self._finished
         if isinstance(chunk, dict):
@@ -408,18 +411,123 @@ class RequestHandler(object):
         chunk = _utf8(chunk)
         self._write_buffer.append(chunk)
 
+    def stream_json(self, value, chunk_size=64 * 1024):
+        """Writes the given dictionary as JSON, sending it as it is encoded.
+
+        Like write() with a dictionary, but the JSON is encoded in pieces of
+        about chunk_size bytes (see escape.json_encode_chunks), and each
+        one is flushed to the client before the next is encoded, so the
+        encoding of a large dictionary never exists as one string.
+        Call finish() afterwards.
+
+        As with write(), lists are refused because of a potential
+        cross-site security vulnerability; wrap them in a dictionary.
+        """
+        assert isinstance(value, dict), "stream_json() takes a dictionary"
+        self.set_header("Content-Type", "text/javascript; charset=UTF-8")
+        for chunk in escape.json_encode_chunks(value, chunk_size):
+            self.write(chunk)
+            if not self.application._wsgi:
+                self.flush()
+
     def render(self, template_name, **kwargs):
         """Renders the template with the given arguments as the response."""
         html = self.render_string(template_name, **kwargs)
 
-        # Insert the additional JS and CSS added by the modules on the page
+        # Insert the additional JS and CSS added by the modules on the page.
+        # The pieces go to the output buffer as they are, so the page is
+        # only copied once, when the buffer is flushed.
+        head, body = self._module_html(
+            getattr(self, "_active_modules", {}).values())
+        start = 0
+        if head:
+            hloc = html.index('</head>')
+            self.write(html[:hloc])
+            self.write(head)
+            start = hloc
+        if body:
+            sloc = max(html.rindex('</body>'), start)
+            self.write(html[start:sloc])
+            self.write(body)
+            start = sloc
+        self.finish(html[start:] if start else html)
+
+    def stream_render(self, template_name, **kwargs):
+        """Renders the template as the response, sending it as it is generated.
+
+        Unlike render(), the output is flushed to the client before and
+        after each top-level {% block %} or {% include %} of the template
+        (see template.Template.stream), so the browser can start on the
+        <head> of a large page early and the page is never held in memory
+        as a whole.  The CSS and <head> HTML of the UI modules rendered
+        before </head> are inserted there; those of modules first rendered
+        later are inserted before </body>, with their JavaScript.
+
+        Since the headers are sent with the first piece of output, errors
+        raised by the template after that cannot change the response.
+        """
+        t, args = self._load_template(template_name, kwargs)
+        head_modules = []
+        state = dict(head=False, body=False)
+
+        def write(chunk):
+            modules = getattr(self, "_active_modules", {})
+            if not state["head"] and "</head>" in chunk:
+                state["head"] = True
+                head_modules.extend(modules.values())
+                head = self._module_html(head_modules)[0]
+                hloc = chunk.index("</head>")
+                chunk = chunk[:hloc] + head + chunk[hloc:]
+            if not state["body"] and "</body>" in chunk:
+                state["body"] = True
+                chunk = self._insert_body_html(chunk, head_modules)
+            self.write(chunk)
+            if not self.application._wsgi:
+                self.flush()
+
+        t.stream(write, **args)
+        if not state["body"]:
+            self.write(self._insert_body_html("", head_modules))
+        self.finish()
+
+    def _insert_body_html(self, chunk, head_modules):
+        modules = getattr(self, "_active_modules", {}).values()
+        # CSS of modules first rendered after </head> was sent
+        late_head = self._module_html(
+            [m for m in modules if m not in head_modules])[0]
+        body = self._module_html(modules)[1]
+        sloc = chunk.rfind("</body>")
+        if sloc == -1:
+            sloc = len(chunk)
+        return chunk[:sloc] + late_head + body + chunk[sloc:]
+
+    def _module_html(self, modules):
+        """Returns the HTML the given UI modules add to the page.
+
+        The result is a (head, body) pair: the CSS and <head> HTML to
+        insert before </head>, and the JavaScript and <body> HTML to insert
+        before </body>.  It is cached for each set of modules whose
+        static_assets attribute is true.
+        """
+        if not modules:
+            return "", ""
+        if getattr(self, "include_host", False) or \
+           not all(module.static_assets for module in modules):
+            return self._build_module_html(modules)
+        cache = self.application._module_html_cache
+        key = frozenset(module.__class__ for module in modules)
+        if key not in cache:
+            cache[key] = self._build_module_html(modules)
+        return cache[key]
+
+    def _build_module_html(self, modules):
         js_embed = []
         js_files = []
         css_embed = []
         css_files = []
         html_heads = []
         html_bodies = []
-        for module in getattr(self, "_active_modules", {}).itervalues():
+        for module in modules:
             embed_part = module.embedded_javascript()
             if embed_part: js_embed.append(_utf8(embed_part))
             file_part = module.javascript_files()
@@ -440,6 +548,8 @@ class RequestHandler(object):
             if head_part: html_heads.append(_utf8(head_part))
             body_part = module.html_body()
             if body_part: html_bodies.append(_utf8(body_part))
+        head = []
+        body = []
         if js_files:
             # Maintain order of JavaScript files given by modules
             paths = []
@@ -450,16 +560,14 @@ class RequestHandler(object):
                 if path not in unique_paths:
                     paths.append(path)
                     unique_paths.add(path)
-            js = ''.join('<script src="' + escape.xhtml_escape(p) +
-                         '" type="text/javascript"></script>'
-                         for p in paths)
-            sloc = html.rindex('</body>')
-            html = html[:sloc] + js + '\n' + html[sloc:]
+            body.append(''.join('<script src="' + escape.xhtml_escape(p) +
+                                '" type="text/javascript"></script>'
+                                for p in paths) + '\n')
         if js_embed:
-            js = '<script type="text/javascript">\n//<![CDATA[\n' + \
-                '\n'.join(js_embed) + '\n//]]>\n</script>'
-            sloc = html.rindex('</body>')
-            html = html[:sloc] + js + '\n' + html[sloc:]
+            body.append('<script type="text/javascript">\n//<![CDATA[\n' +
+                        '\n'.join(js_embed) + '\n//]]>\n</script>\n')
+        if html_bodies:
+            body.append(''.join(html_bodies) + '\n')
         if css_files:
             paths = set()
             for path in css_files:
@@ -467,23 +575,15 @@ class RequestHandler(object):
                     paths.add(self.static_url(path))
                 else:
                     paths.add(path)
-            css = ''.join('<link href="' + escape.xhtml_escape(p) + '" '
-                          'type="text/css" rel="stylesheet"/>'
-                          for p in paths)
-            hloc = html.index('</head>')
-            html = html[:hloc] + css + '\n' + html[hloc:]
+            head.append(''.join('<link href="' + escape.xhtml_escape(p) + '" '
+                                'type="text/css" rel="stylesheet"/>'
+                                for p in paths) + '\n')
         if css_embed:
-            css = '<style type="text/css">\n' + '\n'.join(css_embed) + \
-                '\n</style>'
-            hloc = html.index('</head>')
-            html = html[:hloc] + css + '\n' + html[hloc:]
+            head.append('<style type="text/css">\n' + '\n'.join(css_embed) +
+                        '\n</style>\n')
         if html_heads:
-            hloc = html.index('</head>')
-            html = html[:hloc] + ''.join(html_heads) + '\n' + html[hloc:]
-        if html_bodies:
-            hloc = html.index('</body>')
-            html = html[:hloc] + ''.join(html_bodies) + '\n' + html[hloc:]
-        self.finish(html)
+            head.append(''.join(html_heads) + '\n')
+        return ''.join(head), ''.join(body)
 
     def render_string(self, template_name, **kwargs):
         """Generate the given template with the given arguments.
@@ -491,6 +591,10 @@ class RequestHandler(object):
         We return the generated string. To generate and write a template
         as a response, use render() above.
         """
+        t, args = self._load_template(template_name, kwargs)
+        return t.generate(**args)
+
+    def _load_template(self, template_name, kwargs):
         # If no template_path is specified, use the path of the calling file
         template_path = self.get_template_path()
         if not template_path:
@@ -499,13 +603,8 @@ class RequestHandler(object):
             while frame.f_code.co_filename == web_file:
                 frame = frame.f_back
             template_path = os.path.dirname(frame.f_code.co_filename)
-        if not getattr(RequestHandler, "_templates", None):
-            RequestHandler._templates = {}
-        if template_path not in RequestHandler._templates:
-            loader = self.application.settings.get("template_loader") or\
-              template.Loader(template_path)
-            RequestHandler._templates[template_path] = loader
-        t = RequestHandler._templates[template_path].load(template_name)
+        t = self.application._get_template_loader(template_path).load(
+            template_name)
         args = dict(
             handler=self,
             request=self.request,
@@ -518,7 +617,7 @@ class RequestHandler(object):
         )
         args.update(self.ui)
         args.update(kwargs)
-        return t.generate(**args)
+        return t, args
 
     def flush(self, include_footers=False):
         """Flushes the current output buffer to the network."""
@@ -583,10 +682,10 @@ class RequestHandler(object):
 
         if hasattr(self.request, "connection"):
             # Now that the request is finished, clear the callback we
-            # set on the IOStream (which would otherwise prevent the
+            # set on the connection (which would otherwise prevent the
             # garbage collection of the RequestHandler when there
             # are keepalive connections)
-            self.request.connection.stream.set_close_callback(None)
+            self.request.connection.set_close_callback(None)
 
         if not self.application._wsgi:
             self.flush(include_footers=True)
@@ -1062,6 +1161,20 @@ class Application(object):
     keyword argument. We will serve those files from the /static/ URI
     (this is configurable with the static_url_prefix setting),
     and we will serve /favicon.ico and /robots.txt from the same directory.
+
+    Templates are loaded from the template_path setting.  If the
+    template_bytecode_path setting names a directory, compiled templates
+    are cached there (see template.BytecodeCache) so that new processes
+    start without recompiling them.  With the precompile_templates
+    setting (True, or a list of file extensions to compile), every
+    template under template_path is compiled when the Application is
+    created (see template.Loader.precompile); create it before forking
+    so that child processes share the result.  With the
+    template_reload_interval setting, a template is recompiled when its
+    file or a template it extends or includes changes, checking the files
+    at most once per that many seconds (see template.Loader); debug mode
+    checks on every render.  The template_fragment_cache setting replaces
+    the in-process template.FragmentCache used by {% cache %} blocks.
     """
     def __init__(self, handlers=None, default_host="", transforms=None,
                  wsgi=False, **settings):
@@ -1125,6 +1238,8 @@ class Application(object):
         self.default_host = default_host
         self.settings = settings
         self.ui_modules = {}
+        # frozenset of UIModule classes -> (head, body) HTML
+        self._module_html_cache = {}
         self.ui_methods = {}
         self._wsgi = wsgi
         self._load_ui_modules(settings.get("ui_modules", {}))
@@ -1141,12 +1256,40 @@ class Application(object):
                 (r"/(robots\.txt)", StaticFileHandler, dict(path=path)),
             ] + handlers
         if handlers: self.add_handlers(".*$", handlers)
+        precompile = self.settings.get("precompile_templates")
+        if precompile and self.settings.get("template_path"):
+            if precompile is True:
+                precompile = None
+            self._get_template_loader(
+                self.settings["template_path"]).precompile(precompile)
 
         # Automatically reload modified modules
         if self.settings.get("debug") and not wsgi:
             import autoreload
             autoreload.start()
 
+    def _get_template_loader(self, template_path):
+        """Returns the (shared) template loader for template_path."""
+        if not getattr(RequestHandler, "_templates", None):
+            RequestHandler._templates = {}
+        if template_path not in RequestHandler._templates:
+            loader = self.settings.get("template_loader")
+            if loader is None:
+                kwargs = {}
+                bytecode_path = self.settings.get("template_bytecode_path")
+                if bytecode_path:
+                    kwargs["bytecode_cache"] = template.BytecodeCache(
+                        bytecode_path)
+                interval = self.settings.get("template_reload_interval")
+                if interval is None and self.settings.get("debug"):
+                    interval = 0
+                kwargs["check_interval"] = interval
+                kwargs["fragment_cache"] = self.settings.get(
+                    "template_fragment_cache")
+                loader = template.Loader(template_path, **kwargs)
+            RequestHandler._templates[template_path] = loader
+        return RequestHandler._templates[template_path]
+
     def listen(self, port, address="", **kwargs):
         """Starts an HTTP server for this application on the given port.
 
@@ -1282,12 +1425,15 @@ class Application(object):
                 handler = ErrorHandler(self, request, 404)
 
         # In debug mode, re-compile templates and reload static files on every
-        # request so you don't need to restart to see changes
+        # request so you don't need to restart to see changes.  Loaders that
+        # check for modified templates themselves only recompile those.
         if self.settings.get("debug"):
             if getattr(RequestHandler, "_templates", None):
                 for loader in RequestHandler._templates.values():
-                    loader.reset()
+                    if getattr(loader, "check_interval", None) is None:
+                        loader.reset()
             RequestHandler._static_hashes = {}
+            self._module_html_cache = {}
 
         handler._execute(transforms, *args, **kwargs)
         return handler
@@ -1574,7 +1720,14 @@ class UIModule(object):
     UI modules often execute additional queries, and they can include
     additional CSS and JavaScript that will be included in the output
     page, which is automatically inserted on page render.
+
+    Set static_assets to True in modules whose CSS, JavaScript, head and
+    body methods return the same thing for every request.  The HTML built
+    from them is then cached per set of modules on a page instead of
+    being built for each request.
     """
+    static_assets = False
+
     def __init__(self, handler):
         self.handler = handler
         self.request = handler.request